@@ -1,13 +1,24 @@
 #!/usr/bin/python
 
 '''
-Simple patch packer.
+Patch packer.
 
-This file will process all patch files within a directory and pack all valid DX7 patches into
-a 'collection.bin' file which can be used by dx7pytorch.
+This file will process all patch files within a directory (and its subdirectories) and pack all
+valid DX7 patches into a 'collection.bin' file which can be used by dx7pytorch.
 
-Usage: 
-    python3 patchpacker.py /path/to/syx/files
+Files are parsed in parallel. Every sysex message in a file is read, so single voice dumps,
+32 voice bulk dumps (the 4104-byte .syx format) and files holding several of them are all
+accepted. Dumps whose checksum does not match their data, or that are cut short, are skipped.
+Patches are deduplicated by the CRC32 of their 118 parameter bytes (names are ignored),
+and unique patches are appended to the collection as soon as each file is parsed.
+
+Usage:
+    python3 patchpacker.py /path/to/syx/files [more/paths ...]
+    python3 patchpacker.py --append /path/to/new/files     # add to an existing collection.bin
+
+With --append, the hashes and the list of files already packed are read from the index files
+written next to the collection ('collection.bin.hashes' and 'collection.bin.files'), so the
+collection itself is not read again and files packed before are skipped.
 
 DX7 Patch sources
 -----------------
@@ -18,58 +29,227 @@ http://bobbyblues.recup.ch/yamaha_dx7/dx7_patches.html
 
 '''
 
-import numpy as np
+import argparse
+import json
 import os
-from os import listdir
-from os.path import isfile, join
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from zlib import crc32
 
+import numpy as np
 
-def get_unique(hashlist,patches,n_similar):
-    
-    n_patches = int(len(patches)/128)
-    patches = patches.reshape((n_patches,128)).astype(np.uint8)
-    unique_patches = np.empty(0)
-    
-    for i in range(n_patches):
-        patch_hash = crc32(patches[i,0:118])
-        if(sum(np.isin(hashlist, patch_hash)) == 0):
-            hashlist = np.append(hashlist,patch_hash)
-            unique_patches = np.append(unique_patches,patches[i,:])
+try:
+    from dx7pytorch.dxsynth import pack_patches
+except ImportError:
+    # Running from a source checkout without installing the package.
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from dx7pytorch.dxsynth import pack_patches
+
+DX7_VOICE_SIZE_PACKED = 128
+DX7_VOICE_SIZE_UNPACKED = 155
+# Bytes of a packed patch that identify it: everything but the name.
+HASHED_BYTES = 118
+
+SYSEX_START = 0xF0
+SYSEX_END = 0xF7
+YAMAHA_ID = 0x43
+# Format byte and data length of the DX7 voice dumps.
+FORMAT_BULK = 0x09
+FORMAT_SINGLE = 0x00
+BULK_DATA_SIZE = 32 * DX7_VOICE_SIZE_PACKED
+
+
+def sysex_messages(data):
+    """
+    Split a buffer into sysex messages.
+
+    :param data: uint8 array with the contents of a file.
+    :return: List of uint8 arrays, one per F0 ... F7 message (both included).
+    """
+    starts = np.flatnonzero(data == SYSEX_START)
+    ends = np.flatnonzero(data == SYSEX_END)
+    # First F7 after each F0.
+    following = np.searchsorted(ends, starts)
+    return [data[start:ends[i] + 1] for start, i in zip(starts, following) if i < ends.size]
+
+
+def sysex_checksum(data):
+    """
+    :param data: uint8 array with the data bytes of a dump.
+    :return: Checksum byte that follows them: the two's complement of their sum, masked to 7 bits.
+    """
+    return -int(data.sum(dtype=np.int64)) & 0x7F
+
+
+def parse_message(message):
+    """
+    Extract the packed patches of a DX7 voice dump.
+
+    :param message: uint8 array with one sysex message.
+    :return: (N, 128) uint8 array of packed patches. Empty for anything but complete voice dumps
+             with a valid checksum.
+    """
+    if message.size < 6 or message[1] != YAMAHA_ID or message[2] & 0xF0 != 0:
+        return np.empty((0, DX7_VOICE_SIZE_PACKED), dtype=np.uint8)
+    data_size = (int(message[4]) << 7) | int(message[5])
+    data = message[6:6 + data_size]
+    # Data bytes, checksum and F7.
+    if message.size != 6 + data_size + 2 or message[6 + data_size] != sysex_checksum(data):
+        return np.empty((0, DX7_VOICE_SIZE_PACKED), dtype=np.uint8)
+    if message[3] == FORMAT_BULK and data_size == BULK_DATA_SIZE:
+        return data.reshape((32, DX7_VOICE_SIZE_PACKED))
+    if message[3] == FORMAT_SINGLE and data_size == DX7_VOICE_SIZE_UNPACKED:
+        return pack_patches(data)[np.newaxis, :]
+    return np.empty((0, DX7_VOICE_SIZE_PACKED), dtype=np.uint8)
+
+
+def parse_file(filename):
+    """
+    :param filename: Path to a sysex file.
+    :return: (N, 128) uint8 array with every patch found in the file, in order.
+    """
+    data = np.fromfile(filename, dtype=np.uint8)
+    patches = [parse_message(message) for message in sysex_messages(data)]
+    if not patches:
+        return np.empty((0, DX7_VOICE_SIZE_PACKED), dtype=np.uint8)
+    return np.concatenate(patches)
+
+
+def patch_hash(patch):
+    return crc32(patch[0:HASHED_BYTES].tobytes())
+
+
+def find_files(paths, extensions):
+    """
+    :param paths: Files or directories, scanned recursively.
+    :param extensions: Lowercase file extensions to keep, or None for every file.
+    :return: Sorted list of absolute file paths.
+    """
+    found = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isfile(path):
+            found.append(path)
+            continue
+        for root, _, files in os.walk(path):
+            for name in files:
+                if extensions is None or os.path.splitext(name)[1].lower() in extensions:
+                    found.append(os.path.join(root, name))
+    return sorted(set(found))
+
+
+def file_signature(filename):
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class PatchCollection:
+    """
+    Collection file opened for appending, with its hash and file index.
+    """
+
+    def __init__(self, filename, append=False):
+        self.filename = filename
+        self.hashes_filename = filename + '.hashes'
+        self.files_filename = filename + '.files'
+        self.hashes = set()
+        self.files = {}
+        self.npatches = 0
+
+        if append and os.path.exists(filename):
+            self.npatches = os.path.getsize(filename) // DX7_VOICE_SIZE_PACKED
+            if os.path.exists(self.hashes_filename):
+                self.hashes.update(np.fromfile(self.hashes_filename, dtype=np.uint32).tolist())
+            else:
+                # Collections packed before the index existed: hash them once.
+                print("No index for {}. Hashing its {} patches . . .".format(filename, self.npatches))
+                patches = np.fromfile(filename, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED))
+                self.hashes.update(patch_hash(patch) for patch in patches)
+                np.array(sorted(self.hashes), dtype=np.uint32).tofile(self.hashes_filename)
+            if os.path.exists(self.files_filename):
+                with open(self.files_filename) as f:
+                    self.files = json.load(f)
+            mode = 'ab'
         else:
-            n_similar += 1
-    return hashlist,unique_patches,n_similar
-
-mypath = os.path.abspath(sys.argv[1])
-
-onlyfiles = [f for f in listdir(mypath) if isfile(join(mypath, f))]
-
-print("Processing {} files. Please wait . . .".format(len(onlyfiles)))
-
-collection = np.empty(0)
-hashlist = np.empty(0)
-n_total_processed = 0
-n_similar = 0
-
-for i in range(len(onlyfiles)):
-    filearray = np.fromfile(mypath + '/' + onlyfiles[i], dtype=np.uint8)
-    #Check DX7 MK1 sysex header.
-    compare = filearray[0:6] == np.array([0xF0, 0x43, 0x00, 0x09, 0x20, 0x00])
-    #Check file size.
-    if(len(filearray) != 4104):
-        #print("Error in file {}. Unexpected sysex header. Skipping".format(onlyfiles[i],filearray[0:6]))
-        continue
-    if(compare.all() == False):
-        continue
-    
-    hashlist,unique_patches,n_similar = get_unique(hashlist,filearray[6:4102],n_similar)
-    collection = np.append(collection,unique_patches)
-    n_total_processed += 32
-    if(i % 50 == 0 and i != 0):
-        print("Processed {} files.".format(i))
-
-print("Processed {} patches. {} similar patches filtered.".format(n_total_processed,n_similar))
-print("Compiled patch dataset contains {} patches.".format(int(len(collection)/128)))
-
-collection.astype('uint8').tofile("collection.bin")
+            mode = 'wb'
+        self.collection = open(filename, mode)
+        self.hashes_file = open(self.hashes_filename, mode)
+
+    def is_packed(self, filename):
+        return self.files.get(filename) == file_signature(filename)
+
+    def add(self, filename, patches):
+        """
+        Append the patches not seen before to the collection.
+
+        :return: Number of patches added.
+        """
+        unique = []
+        hashes = []
+        for patch in patches:
+            h = patch_hash(patch)
+            if h not in self.hashes:
+                self.hashes.add(h)
+                unique.append(patch)
+                hashes.append(h)
+        if unique:
+            np.array(unique, dtype=np.uint8).tofile(self.collection)
+            np.array(hashes, dtype=np.uint32).tofile(self.hashes_file)
+            self.npatches += len(unique)
+        self.files[filename] = file_signature(filename)
+        return len(unique)
+
+    def close(self):
+        self.collection.close()
+        self.hashes_file.close()
+        with open(self.files_filename, 'w') as f:
+            json.dump(self.files, f)
+
+
+def pack(paths, output='collection.bin', append=False, jobs=None, extensions=('.syx',)):
+    """
+    Pack every DX7 patch found under paths into a collection file.
+
+    :param paths: Files or directories to scan.
+    :param output: Collection file.
+    :param append: Add to an existing collection, skipping the files it already holds.
+    :param jobs: Number of parsing processes. None uses one per CPU core.
+    :param extensions: File extensions to scan (case insensitive), or None for every file.
+    :return: Dict with the number of files, patches found, patches added and collection size.
+    """
+    if extensions is not None:
+        extensions = {e.lower() for e in extensions}
+    collection = PatchCollection(output, append)
+    files = [f for f in find_files(paths, extensions)
+             if os.path.abspath(f) != os.path.abspath(output) and not collection.is_packed(f)]
+    print("Processing {} files. Please wait . . .".format(len(files)))
+
+    n_found = 0
+    n_added = 0
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            # map() keeps the file order, so the collection does not depend on the number of jobs.
+            for i, (filename, patches) in enumerate(zip(files, pool.map(parse_file, files, chunksize=16))):
+                n_found += patches.shape[0]
+                n_added += collection.add(filename, patches)
+                if(i % 500 == 0 and i != 0):
+                    print("Processed {} files.".format(i))
+    finally:
+        collection.close()
+
+    print("Processed {} patches. {} similar patches filtered.".format(n_found, n_found - n_added))
+    print("Compiled patch dataset contains {} patches.".format(collection.npatches))
+    return {'files': len(files), 'found': n_found, 'added': n_added, 'patches': collection.npatches}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack DX7 sysex patches into a dx7pytorch collection.')
+    parser.add_argument('paths', nargs='+', help='Sysex files or directories, scanned recursively.')
+    parser.add_argument('-o', '--output', default='collection.bin', help='Collection file (default: collection.bin).')
+    parser.add_argument('-a', '--append', action='store_true',
+                        help='Add new files to an existing collection instead of overwriting it.')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Parsing processes (default: one per core).')
+    parser.add_argument('--all-files', action='store_true', help='Scan every file, not only *.syx.')
+    args = parser.parse_args()
+
+    pack(args.paths, args.output, args.append, args.jobs, None if args.all_files else ('.syx',))
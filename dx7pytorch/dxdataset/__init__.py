@@ -1,4 +1,28 @@
-from .dxdataset import DXDataset
+import importlib
 
-__all__ = ["DXDataset"]
-__version__ = "0.1"
\ No newline at end of file
+# Exports are imported on first use, so the numpy-only modules of this package
+# (e.g. dx7pytorch.dxdataset.patchindex) do not pull in torch.
+_EXPORTS = {
+    "DXDataset": ".dxdataset",
+    "dx_collate": ".dxdataset",
+    "dx_worker_init": ".dxdataset",
+    "DXStream": ".dxstream",
+    "DXFeatureStore": ".featurestore",
+    "export_features": ".featurestore",
+    "PatchIndex": ".patchindex",
+}
+
+__all__ = ["DXDataset", "DXStream", "DXFeatureStore", "dx_collate", "dx_worker_init", "export_features", "PatchIndex"]
+__version__ = "0.1"
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
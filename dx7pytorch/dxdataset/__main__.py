@@ -0,0 +1,40 @@
+'''
+Export a DXDataset to a feature store. See featurestore.py.
+
+    python -m dx7pytorch.dxdataset collection.bin out_dir [--feature int16] [--compress 6] ...
+'''
+
+import argparse
+
+from .dxdataset import DXDataset
+from .featurestore import FEATURES, export_features
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render a DXDataset into a feature store.')
+    parser.add_argument('collection', help='Patch collection.')
+    parser.add_argument('directory', help='Output directory.')
+    parser.add_argument('--sample-rate', type=int, default=16000)
+    parser.add_argument('--notes', type=int, nargs='+', default=[60])
+    parser.add_argument('--velocities', type=int, nargs='+', default=[100])
+    parser.add_argument('--note-on-len', type=int, default=16000)
+    parser.add_argument('--note-off-len', type=int, default=16000)
+    parser.add_argument('--filter', default=None, help="Patch filter: 'all_ratio' or 'all_fixed'.")
+    parser.add_argument('--subsample', type=float, default=None, help='Subsample ratio of the patches.')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--num-threads', type=int, default=1)
+    parser.add_argument('--feature', choices=FEATURES, default='float32')
+    parser.add_argument('--compress', type=int, default=None, help='zlib level of the records (1-9).')
+    parser.add_argument('--shard-size', type=int, default=4096)
+    parser.add_argument('--return-length', action='store_true', help='Also store note lengths.')
+    parser.add_argument('--n-mels', type=int, default=80)
+    parser.add_argument('--n-fft', type=int, default=1024)
+    parser.add_argument('--hop-length', type=int, default=256)
+    args = parser.parse_args()
+
+    dataset = DXDataset(args.sample_rate, args.collection, args.notes, args.velocities,
+                        args.note_on_len, args.note_off_len, subsample_ratio=args.subsample,
+                        random_seed=args.seed, filter_function=args.filter, num_threads=args.num_threads,
+                        return_length=args.return_length)
+    export_features(dataset, args.directory, args.feature, args.compress, args.shard_size,
+                    n_fft=args.n_fft, hop_length=args.hop_length, n_mels=args.n_mels)
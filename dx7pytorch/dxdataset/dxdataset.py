@@ -1,10 +1,89 @@
 import torch
 from torch import dtype as torch_dtype
 from torch.utils import data
+from torch.utils.data import default_collate
 import numpy as np
-from dx7pytorch.dxsynth import DX7_VOICE_SIZE_PACKED, DXSynth
+from dx7pytorch.dxsynth import DX7_VOICE_SIZE_PACKED, DXSynth, RenderCache, note_lengths, unpack_patches
+from dx7pytorch.dxsynth.renderstats import SharedStats, stats_from_vector, stats_to_vector
+from .patchbank import PatchBank
+from .patchindex import PatchIndex
+import contextlib
+import hashlib
+import json
+import os
 from os import path
 
+# Bump when the cache layout or the synthesizer output changes.
+CACHE_VERSION = 2
+# Number of items rendered per native call while building the cache.
+CACHE_CHUNK_SIZE = 1024
+
+
+def filter_get_all_op_ratio(patch):
+    # Check that all OP work in OSC MODE = ratio = 0.
+    # Is done verifying each OSC MODE BIT for every patch. Accepts a single
+    # (128,) patch or an (N,128) array, returning one bool per patch.
+    # OP6 ratio data is at byte 15, next OPs follow every 17 bytes.
+    osc_mode = np.asarray(patch)[..., 15:102:17] & 0x01
+    return np.all(osc_mode == 0x00, axis=-1)
+
+
+def filter_get_all_op_fixed(patch):
+    # Check that all OP work in OSC MODE = fixed = 1.
+    osc_mode = np.asarray(patch)[..., 15:102:17] & 0x01
+    return np.all(osc_mode == 0x01, axis=-1)
+
+
+def filter_allpass(patch):
+    return np.ones(np.shape(patch)[:-1], dtype=bool)
+
+
+def get_filter(filter_function):
+    # Selects a patch filter function. Available: 'all_ratio' and 'all_fixed'. Anything else keeps every patch.
+    if(filter_function == 'all_ratio'):
+        return filter_get_all_op_ratio
+    elif(filter_function == 'all_fixed'):
+        return filter_get_all_op_fixed
+    return filter_allpass
+
+
+def map_collection(collection):
+    # Memory-map a patch collection as an (N,128) array. A trailing partial patch is ignored.
+    bulk_patches = np.memmap(path.abspath(collection), dtype=np.uint8, mode='r')
+    n_patches = len(bulk_patches) // DX7_VOICE_SIZE_PACKED
+    return bulk_patches[:n_patches * DX7_VOICE_SIZE_PACKED].reshape((n_patches, DX7_VOICE_SIZE_PACKED))
+
+
+class DXBatch(list):
+    """Items of a batch rendered by DXDataset.__getitems__. The collated batch is kept in .batch."""
+
+    def __init__(self, items, batch):
+        super().__init__(items)
+        self.batch = batch
+
+
+def dx_collate(items):
+    """
+    DataLoader collate_fn for DXDataset. Batches rendered by __getitems__ are returned as they
+    are, without stacking the items again. Anything else goes through default_collate.
+    """
+    batch = getattr(items, 'batch', None)
+    if(batch is not None):
+        return batch
+    return default_collate(items)
+
+
+def dx_worker_init(worker_id):
+    """
+    DataLoader worker_init_fn for DXDataset. Creates the synthesizer of the worker when it
+    starts instead of on its first item. Workers create their own either way; none is
+    inherited from the parent process.
+    """
+    dataset = data.get_worker_info().dataset
+    if(hasattr(dataset, 'init_worker')):
+        dataset.init_worker()
+
+
 class DXDataset(data.Dataset):
     """DX7 sound patch dataset."""
 
@@ -15,7 +94,19 @@ class DXDataset(data.Dataset):
             subsample_ratio=None,
             random_seed=None,
             filter_function=None,
-            debug=False,):
+            debug=False,
+            num_threads=1,
+            cache_dir=None,
+            cache_dtype='float32',
+            render_cache_bytes=None,
+            render_cache_shared=False,
+            pin_memory=False,
+            return_length=False,
+            silence_threshold=0.0,
+            profile=False,
+            output_buffers=None,
+            dedup_tolerance=None,
+            predecode=False,):
         """
         Args:
             sample_rate (int): Sample frequency of synthesizer.
@@ -32,176 +123,380 @@ class DXDataset(data.Dataset):
             filter_function (string): Selects a patch filter function. Available: 'all_ratio' and 'all_fixed'.
             debug (Bool): Enables verbose output.
             
+            num_threads (int): Number of threads the synthesizer renders batches with. None uses all cores.
+            cache_dir (string): If set, the whole dataset is rendered once into a memory-mapped
+                audio cache in this directory and items are served from it.
+            cache_dtype (string): Audio cache sample format. Available: 'float32' and 'int16'.
+            render_cache_bytes (int): If set, keep up to this many bytes of recently rendered
+                items in RAM. Each DataLoader worker gets its own cache.
+            render_cache_shared (Bool): Share one render cache between DataLoader workers
+                through shared memory instead.
+            pin_memory (Bool): Render batches from __getitems__ into page-locked memory, when CUDA is available.
+                Only in the main process: batches of DataLoader workers reach it through an unpinned shared
+                memory copy, and pinning would start CUDA in every worker. Use DataLoader(pin_memory=True) there.
+            return_length (Bool): Add a 'length' key to items: one past the last sample whose magnitude
+                is above silence_threshold, so silent tails can be trimmed or weighted.
+            silence_threshold (float): Magnitude at or below which samples count as silent.
+            profile (Bool): Count render stats in every DataLoader worker, see stats() and profile().
+            output_buffers (int): If set, __getitems__ renders into a ring of this many reusable (optionally
+                pinned) audio tensors instead of allocating one per batch. A batch is overwritten
+                output_buffers batches later, so it must be consumed (or copied) by then. Only in the main
+                process: DataLoader workers share their batches with it and may run prefetch_factor batches
+                ahead, so they always render into new tensors.
+            dedup_tolerance (float): If set, drop near-duplicate patches after filtering: a patch is dropped when
+                an earlier kept one lies within this distance (see PatchIndex). 0 drops identical parameters.
+            predecode (Bool): Decode every patch for the synth once, when loading, and start each render from
+                its decoded form instead of unpacking and decoding the patch again (see decode_patches).
+                Costs 148 shared bytes per patch; saves a share of the setup of every note, which matters
+                for short notes.
+            
         """
         np.random.seed(random_seed)
         self.debug = debug
         
-        #Instantiate Synthesizer
-        self.synth = DXSynth(sampling_frequency=sample_rate)
+        self.render_cache = None
+        if(render_cache_bytes is not None):
+            self.render_cache = RenderCache(render_cache_bytes, shared=render_cache_shared,
+                                            nsamples=note_on_len + note_off_len)
+        
+        # The synthesizer is created on first use, by each process that renders (see synth).
+        self.num_threads = num_threads
+        self._synth = None
+        self._synth_pid = None
+        self._synth_render_cache = None
+        self.stats_enabled = profile
         
         print("dx7pytorch: FM Synthesizer for deep learning. Loading dataset . . . ")
         
-        patch_file = path.abspath(collection)
+        # Map the collection and keep only the selected patches in RAM, to minimize disk access.
+        bulk_patches = map_collection(collection)
+        n_patches = bulk_patches.shape[0]
+        if(self.debug): print("[DEBUG] Total patches: {}".format(n_patches))
         
-        # Open file list to process patches. 
-        # I think the easiest way is to store everythig in RAM, to minimize disk access.
-        self.patches = np.empty(0)
+        my_filter = get_filter(filter_function)
         
-        bulk_patches = np.fromfile(patch_file, dtype=np.uint8)
-        n_patches = int(len(bulk_patches)/DX7_VOICE_SIZE_PACKED)
-        if(self.debug): print("[DEBUG] Total patches: {}".format(n_patches))
+        if(self.debug):
+            for i in range(n_patches):
+                # Process Patch Name. Keep only names below 128 and decode to ascii.
+                patch_name = bulk_patches[i, 118:127]
+                patch_name = bytes(patch_name * (patch_name < 128)).decode('ascii')
+                print("Processing {}:{} ...".format(i,patch_name))
         
-        if(filter_function == 'all_ratio'):
-            my_filter = self.filter_get_all_op_ratio
-        elif(filter_function == 'all_fixed'):
-            my_filter = self.filter_get_all_op_fixed
-        else:
-            my_filter = self.filter_allpass
+        selected = np.flatnonzero(my_filter(bulk_patches))
+        if(dedup_tolerance is not None):
+            selected = selected[PatchIndex(bulk_patches[selected]).unique(dedup_tolerance)]
+            if(self.debug): print("[DEBUG] Patches after dedup: {}".format(selected.size))
+        if(subsample_ratio is not None):
+            # Same draws as one np.random.rand() per accepted patch.
+            selected = selected[np.random.rand(selected.size) < subsample_ratio]
         
-        for i in range(n_patches):
-            patch = bulk_patches[i*128:(i+1)*128]
-            
-            # Process Patch Name. Keep only names below 128 and decide to ascii.
-            patch_name = patch[118:127]
-            patch_name = patch_name * ( patch_name < 128)
-            patch_name = patch_name.tostring().decode('ascii')
-            
-            if(self.debug):
-                print("Processing {}:{} ...".format(i,patch_name),end='')
-            
-            if(my_filter(patch) == True):
-                if(subsample_ratio!= None):
-                    if(np.random.rand() < subsample_ratio):
-                        self.patches = np.append(self.patches,patch)
-                else:
-                    self.patches = np.append(self.patches,patch)
-
-        #Reshape patches
-        patch_byte_count = self.patches.size
-        n_patches = patch_byte_count // DX7_VOICE_SIZE_PACKED
-        self.patches = self.patches.reshape((n_patches, DX7_VOICE_SIZE_PACKED)).astype(np.uint8)
+        # Selected patches and their unpacked parameters, unpacked once and kept in shared
+        # memory: DataLoader workers map them instead of holding a copy each.
+        self.bank = PatchBank(bulk_patches[selected], decoded=predecode)
+        n_patches = len(self.bank)
         # Store synthesis parameters
         self.notes = np.asarray(valid_notes)
         self.velocities = np.asarray(valid_velocities)
         self.note_on_len = note_on_len
         self.note_off_len = note_off_len
+        self.sample_rate = sample_rate
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.return_length = return_length
+        self.silence_threshold = silence_threshold
+
+        self.cache = None
+        if(cache_dir is not None):
+            self.cache = self.open_cache(cache_dir, cache_dtype)
+        else:
+            # Items served from the disk cache never reach the synth, so only attach it here.
+            self._synth_render_cache = self.render_cache
+
+        self.shared_stats = None
+        # Counters this process last added to its stats slot, see record_stats().
+        self._published_stats = None
+        self._published_pid = None
+        if(profile):
+            self.shared_stats = SharedStats()
+
+        if(output_buffers is not None and output_buffers < 1):
+            raise ValueError("ERROR: output_buffers must be at least 1, got {}.".format(output_buffers))
+        self.output_buffers = output_buffers
+        self._index = None
+        self._buffers = [None] * (output_buffers or 0)
+        self._next_buffer = 0
+
         print("Starting with {} patches. \n\tnotes: {} \tvelocities: {} \n\
         sample_rate: {} Hz \tnote_on_len: {} \tnote_off_len: {}".format(n_patches,self.notes,self.velocities,sample_rate,self.note_on_len,self.note_off_len))
         
+    @property
+    def patches(self):
+        return self.bank.patches
+
+    @property
+    def parameters(self):
+        return self.bank.parameters
+
+    @property
+    def decoded(self):
+        # Decoded patches, or None without predecode.
+        return self.bank.decoded
+
+    def decoded_patches(self, idx_patch):
+        # Decoded form of some patches for render_batch, or None without predecode.
+        return None if self.decoded is None else self.decoded[idx_patch]
+
+    @property
+    def synth(self):
+        """
+        DXSynth of the calling process, created on first use. A DataLoader worker never
+        renders with (or frees) the native instances of its parent.
+        """
+        if(self._synth is None or self._synth_pid != os.getpid()):
+            self._synth = DXSynth(sampling_frequency=self.sample_rate, num_threads=self.num_threads,
+                                  render_cache=self._synth_render_cache)
+            if(self.stats_enabled):
+                self._synth.enable_stats()
+            self._synth_pid = os.getpid()
+        return self._synth
+
+    def nearest(self, parameters, k=1):
+        """
+        Find the dataset patches closest to some parameter vectors, e.g. model predictions.
+
+        :param parameters: (Q, 145) or (Q, 155) array of unpacked parameters, or one vector.
+        :param k: Number of patches per query.
+        :return: (Q, k) distances and (Q, k) indices into self.patches, nearest first.
+        """
+        if(self._index is None):
+            self._index = PatchIndex(parameters=self.parameters)
+        return self._index.query(parameters, k)
+
+    def init_worker(self):
+        # Create the synthesizer of this process now. Used by dx_worker_init.
+        return self.synth
+
+    def __getstate__(self):
+        # Processes receiving a copy of the dataset create their own synthesizer.
+        state = self.__dict__.copy()
+        state['_synth'] = None
+        state['_synth_pid'] = None
+        state['_buffers'] = [None] * len(self._buffers)
+        state['_index'] = None
+        return state
+
     def __len__(self):
         n_notes = self.notes.size
         n_velocities = self.velocities.size
         n_patches = self.patches.shape[0]
         return n_notes * n_velocities * n_patches
 
-    def __getitem__(self, idx: int):
-        # Obtain patch number,note and velocity from idx
+    def split_index(self, idx):
+        # Obtain patch number,note and velocity from idx (an int or an array of them)
         n_notes = self.notes.size
         n_velocities = self.velocities.size
-        n_patches = self.patches.shape[0]
         idx_note = idx % (n_notes)
         idx //= (n_notes)
         idx_velocity =  idx % (n_velocities)
         idx //= (n_velocities)
         idx_patch = idx
+        return idx_patch, idx_note, idx_velocity
+
+    def __getitem__(self, idx: int):
+        idx_patch, idx_note, idx_velocity = self.split_index(idx)
         
         if(self.debug): print("idx_patch {} idx_note {} idx_velocity {} ".format(idx_patch,idx_note,idx_velocity))
-        patch = self.patches[idx_patch:idx_patch+1,:] #Wrapper expects array with 2D shape
         note = self.notes[idx_note]
         velocity = self.velocities[idx_velocity]
-        x = self.synth.synthesize(patch,note,velocity,self.note_on_len,self.note_off_len)
-        y = self.unpack_packed_patch(patch[0])
-        y = np.asarray(y,dtype=np.float32)
-        #Extract name
-        z = y[145:155]
+        if(self.cache is not None):
+            x = self.cache[idx:idx+1]
+            if(x.dtype == np.int16):
+                x = x.astype(np.float32) / 32767.0
+            if(self.return_length):
+                length = note_lengths(x, self.silence_threshold)[0]
+        else:
+            patch = self.patches[idx_patch:idx_patch+1,:] #Wrapper expects array with 2D shape
+            x, length = self.synth.render_batch(patch, note, velocity, self.note_on_len, self.note_off_len,
+                                                return_length=True, silence_threshold=self.silence_threshold,
+                                                decoded=self.decoded_patches(slice(idx_patch, idx_patch+1)))
+            length = length[0]
+            self.record_stats()
+        #Extract name. Items get copies: the bank is shared and read only.
+        z = self.parameters[idx_patch, 145:155].copy()
         #REMOVE PATCH NAME AND OP ON/OFF
-        y = y[0:145]
-        return {'audio': x, 'patch': y,'name': z,'note': note, 'velocity': velocity}
+        y = self.parameters[idx_patch, 0:145].copy()
+        item = {'audio': x, 'patch': y,'name': z,'note': note, 'velocity': velocity}
+        if(self.return_length):
+            item['length'] = length
+        return item
     
+    def __getitems__(self, indices):
+        """
+        Render a whole DataLoader batch in one call, straight into a single tensor.
+        Use dx_collate as collate_fn to get that tensor without copying it again.
+        """
+        idx = np.array(indices, dtype=np.int64)
+        idx_patch, idx_note, idx_velocity = self.split_index(idx.copy())
+        nsamples = self.note_on_len + self.note_off_len
+
+        audio = self.output_buffer(idx.size, nsamples)
+        x = audio.numpy().reshape((idx.size, nsamples))
+        if(self.cache is not None):
+            if(self.cache.dtype == np.int16):
+                x[:] = self.cache[idx].astype(np.float32) / 32767.0
+            else:
+                np.take(self.cache, idx, axis=0, out=x)
+            if(self.return_length):
+                length = note_lengths(x, self.silence_threshold)
+        else:
+            _, length = self.synth.render_batch(self.patches[idx_patch], self.notes[idx_note],
+                                                self.velocities[idx_velocity],
+                                                self.note_on_len, self.note_off_len, out=audio,
+                                                return_length=True, silence_threshold=self.silence_threshold,
+                                                decoded=self.decoded_patches(idx_patch))
+            self.record_stats()
+
+        parameters = self.parameters[idx_patch]
+        batch = {'audio': audio,
+                 'patch': torch.from_numpy(np.ascontiguousarray(parameters[:, 0:145])),
+                 'name': torch.from_numpy(np.ascontiguousarray(parameters[:, 145:155])),
+                 'note': torch.from_numpy(self.notes[idx_note]),
+                 'velocity': torch.from_numpy(self.velocities[idx_velocity])}
+        if(self.return_length):
+            batch['length'] = torch.from_numpy(length)
+        items = [{key: value[i] for key, value in batch.items()} for i in range(idx.size)]
+        return DXBatch(items, batch)
+
+    def output_buffer(self, batch_size, nsamples):
+        # (batch_size, 1, nsamples) audio tensor of a batch: a new one, or the next one of the ring.
+        in_worker = data.get_worker_info() is not None
+        if(self.output_buffers is None or in_worker):
+            return torch.empty((batch_size, 1, nsamples), dtype=torch.float32,
+                               pin_memory=self.pin_memory and not in_worker)
+        k = self._next_buffer
+        self._next_buffer = (k + 1) % self.output_buffers
+        buffer = self._buffers[k]
+        if(buffer is None or buffer.shape[0] < batch_size):
+            buffer = torch.empty((batch_size, 1, nsamples), dtype=torch.float32, pin_memory=self.pin_memory)
+            self._buffers[k] = buffer
+        return buffer[0:batch_size]
+
+    def record_stats(self):
+        # Add what this process rendered since it last published to its slot: slot 0 is the main
+        # process, slot k + 1 worker k. The synth of a new process starts counting from zero.
+        if(self.shared_stats is None):
+            return
+        stats = stats_to_vector(self.synth.stats())
+        if(self._published_pid != os.getpid()):
+            self._published_stats = np.zeros_like(stats)
+            self._published_pid = os.getpid()
+        worker = data.get_worker_info()
+        if(self.shared_stats.add(0 if worker is None else worker.id + 1, stats - self._published_stats)):
+            self._published_stats = stats
+
+    def stats(self):
+        """
+        Render stats of the main process and of every DataLoader worker, as of their last render.
+        Workers count across epochs: the workers of a new epoch add to the slots of the previous ones.
+        Needs profile=True.
+
+        :return: Dict with 'total' and 'workers', which maps 'main' or a worker id to the
+            stats of that process, as returned by DXSynth.stats().
+        """
+        return self._stats_from_table(self._read_stats())
+
+    @contextlib.contextmanager
+    def profile(self):
+        """
+        Measure the renders of all DataLoader workers done inside a with block:
+
+            with dataset.profile() as stats:
+                for batch in loader: ...
+
+        On exit, stats holds the same keys as stats(), counting only those renders.
+        """
+        before = self._read_stats()
+        stats = {}
+        try:
+            yield stats
+        finally:
+            stats.update(self._stats_from_table(self._read_stats() - before))
+
+    def _read_stats(self):
+        if(self.shared_stats is None):
+            raise RuntimeError("ERROR: Render stats need a DXDataset created with profile=True.")
+        return self.shared_stats.read()
+
+    def _stats_from_table(self, table):
+        workers = {}
+        for slot in np.flatnonzero(table.any(axis=1)):
+            workers['main' if slot == 0 else int(slot) - 1] = stats_from_vector(table[slot])
+        return {'total': stats_from_vector(table.sum(axis=0)), 'workers': workers}
+
+    def cache_key(self, cache_dtype):
+        # Anything that changes the rendered audio must be part of the key.
+        settings = json.dumps({
+            'version': CACHE_VERSION,
+            'sample_rate': self.sample_rate,
+            'notes': self.notes.tolist(),
+            'velocities': self.velocities.tolist(),
+            'note_on_len': self.note_on_len,
+            'note_off_len': self.note_off_len,
+            'dtype': cache_dtype,
+        }, sort_keys=True)
+        key = hashlib.sha1(self.patches.tobytes())
+        key.update(settings.encode('ascii'))
+        return key.hexdigest()
+
+    def open_cache(self, cache_dir, cache_dtype='float32'):
+        """
+        Open the audio cache of this dataset in cache_dir, rendering it first if it does not exist.
+        The cache is a .npy file holding one row of audio per dataset index.
+        """
+        if(cache_dtype not in ('float32', 'int16')):
+            raise ValueError("ERROR: cache_dtype should be 'float32' or 'int16', got {}.".format(cache_dtype))
+        nsamples = self.note_on_len + self.note_off_len
+        cache_file = path.join(path.abspath(cache_dir), "dx7pytorch-{}.npy".format(self.cache_key(cache_dtype)))
+
+        if(not path.exists(cache_file)):
+            os.makedirs(path.dirname(cache_file), exist_ok=True)
+            # Render into a temporary file so an interrupted run never leaves a partial cache behind.
+            tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+            cache = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=np.dtype(cache_dtype),
+                                              shape=(len(self), nsamples))
+            print("dx7pytorch: Rendering {} items to audio cache {} . . .".format(len(self), cache_file))
+            for start in range(0, len(self), CACHE_CHUNK_SIZE):
+                end = min(start + CACHE_CHUNK_SIZE, len(self))
+                idx_patch, idx_note, idx_velocity = self.split_index(np.arange(start, end))
+                if(cache.dtype == np.float32):
+                    out = cache[start:end]
+                else:
+                    out = None
+                x = self.synth.render_batch(self.patches[idx_patch], self.notes[idx_note],
+                                            self.velocities[idx_velocity],
+                                            self.note_on_len, self.note_off_len, out=out,
+                                            decoded=self.decoded_patches(idx_patch))
+                if(cache.dtype == np.int16):
+                    cache[start:end] = np.round(np.clip(x, -1.0, 1.0) * 32767.0)
+            cache.flush()
+            del cache
+            os.replace(tmp_file, cache_file)
+
+        # Copy-on-write mapping: items are zero-copy and still writable for torch.
+        cache = np.load(cache_file, mmap_mode='c')
+        if(cache.shape != (len(self), nsamples) or cache.dtype != np.dtype(cache_dtype)):
+            raise ValueError("ERROR: Audio cache {} has unexpected shape {} or dtype {}.".format(cache_file, cache.shape, cache.dtype))
+        return cache
+
     def filter_get_all_op_ratio(self,patch):
-        # Check that all OP work in OSC MODE = ratio = 0.
-        # Is done verifying each OSC MODE BIT for every patch.
-        idx = 15 # OP6 ratio data is at byte 15
-        check = np.uint8(0x00)
-        for i in range(6):
-            check = ( check | patch[idx] ) & 0x01
-            idx +=17 #Advance next OP
-
-        if(check == 0x00):
-            return True
-
-        return False
+        return filter_get_all_op_ratio(patch)
     
     def filter_get_all_op_fixed(self,patch):
-        # Check that all OP work in OSC MODE = ratio = 0.
-        # Is done verifying each OSC MODE BIT for every patch.
-        idx = 15 # OP6 ratio data is at byte 15
-        check = np.uint8(0x00)
-        for i in range(6):
-            check = ( check | (not (patch[idx] & 0x01 ) ) ) & 0x01
-            idx +=17 #Advance next OP
-
-        if(check == 0x00):
-            return True
-        
-        return False
+        return filter_get_all_op_fixed(patch)
+
     def filter_allpass(self,patch):
-        return True
+        return filter_allpass(patch)
 
-    # Nice unpacking method extracted from https://github.com/bwhitman/learnfm
     def unpack_packed_patch(self,p):
-        # Input is a 128 byte thing from compact.bin
-        # Output is a 156 byte thing that the synth knows about
-        o = [0]*156
-        for op in range(6):
-            o[op*21:op*21 + 11] = p[op*17:op*17+11]
-            leftrightcurves = p[op*17+11]
-            o[op * 21 + 11] = leftrightcurves & 3
-            o[op * 21 + 12] = (leftrightcurves >> 2) & 3
-            detune_rs = p[op * 17 + 12]
-            o[op * 21 + 13] = detune_rs & 7
-            o[op * 21 + 20] = detune_rs >> 3
-            kvs_ams = p[op * 17 + 13]
-            o[op * 21 + 14] = kvs_ams & 3
-            o[op * 21 + 15] = kvs_ams >> 2
-            o[op * 21 + 16] = p[op * 17 + 14]
-            fcoarse_mode = p[op * 17 + 15]
-            o[op * 21 + 17] = fcoarse_mode & 1
-            o[op * 21 + 18] = fcoarse_mode >> 1
-            o[op * 21 + 19] = p[op * 17 + 16]
-    
-        o[126:126+9] = p[102:102+9]
-        oks_fb = p[111]
-        o[135] = oks_fb & 7
-        o[136] = oks_fb >> 3
-        o[137:137+4] = p[112:112+4]
-        lpms_lfw_lks = p[116]
-        o[141] = lpms_lfw_lks & 1
-        o[142] = (lpms_lfw_lks >> 1) & 7
-        o[143] = lpms_lfw_lks >> 4
-        o[144:144+11] = p[117:117+11]
-        o[155] = 0x3f #Seems that OP ON/OFF they are always on. Ignore.
-
-        # Clamp the unpacked patches to a known max. 
-        maxes =  [
-            99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc6
-            3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
-            99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc5
-            3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
-            99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc4
-            3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
-            99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc3
-            3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
-            99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc2
-            3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
-            99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc1
-            3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
-            99, 99, 99, 99, 99, 99, 99, 99, # pitch eg rate & level 
-            31, 7, 1, 99, 99, 99, 99, 1, 5, 7, 48, # algorithm etc
-            126, 126, 126, 126, 126, 126, 126, 126, 126, 126, # name
-            127 # operator on/off
-        ]
-        for i in range(156):
-            if(o[i] > maxes[i]): o[i] = maxes[i]
-            if(o[i] < 0): o[i] = 0
-        return o
+        # Input is a 128 byte thing from compact.bin, or an (N,128) array of them.
+        # Output is a 156 byte thing that the synth knows about (one row per patch).
+        return unpack_patches(p)
@@ -0,0 +1,161 @@
+import queue
+import threading
+
+import numpy as np
+import torch
+from torch.utils import data
+from dx7pytorch.dxsynth import DXSynth, pack_patches, unpack_patches
+from dx7pytorch.dxsynth.dxsynth import DX7_VOICE_MAXES, DX7_VOICE_PARAMETERS
+from .dxdataset import get_filter, map_collection
+
+
+class DXStream(data.IterableDataset):
+    """Endless stream of random DX7 notes drawn from a patch collection."""
+
+    def __init__(self, sample_rate:int,
+            collection:str, valid_notes, valid_velocities,
+            note_on_len:int,
+            note_off_len:int,
+            filter_function=None,
+            perturbation=None,
+            random_seed=0,
+            chunk_size=64,
+            prefetch=2,
+            rank=None,
+            world_size=None,
+            num_threads=1,):
+        """
+        Args:
+            sample_rate (int): Sample frequency of synthesizer.
+            collection (string): Path to dataset patch collection.
+            valid_notes: Allowed MIDI notes we synthesize.
+            valid_velocities: Allowed MIDI velocities we can synthesize.
+
+            note_on_len  (int): Number of samples to synthesize on note_on.
+            note_off_len (int): Number of samples to synthesize on note_off.
+
+            filter_function (string): Selects a patch filter function. Available: 'all_ratio' and 'all_fixed'.
+            perturbation (float): If set, add gaussian noise with this standard deviation (as a fraction
+                of each parameter's range) to the 145 parameters of every drawn patch.
+            random_seed (int): Seeds the random generator of every shard, together with the epoch
+                (see set_epoch) and the number of iterations started since.
+
+            chunk_size (int): Number of notes rendered per native call.
+            prefetch (int): Number of rendered chunks kept ready ahead of the consumer.
+            rank (int): Rank of this process. Defaults to the torch.distributed rank, or 0.
+            world_size (int): Number of processes. Defaults to the torch.distributed world size, or 1.
+            num_threads (int): Number of threads the synthesizer renders chunks with.
+
+        """
+        if(rank is None or world_size is None):
+            distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+            if(rank is None):
+                rank = torch.distributed.get_rank() if distributed else 0
+            if(world_size is None):
+                world_size = torch.distributed.get_world_size() if distributed else 1
+        if(not 0 <= rank < world_size):
+            raise ValueError("ERROR: rank {} is out of range for world_size {}.".format(rank, world_size))
+        if(chunk_size < 1 or prefetch < 1):
+            raise ValueError("ERROR: chunk_size and prefetch must be at least 1.")
+
+        bulk_patches = map_collection(collection)
+        self.patches = np.array(bulk_patches[get_filter(filter_function)(bulk_patches)], dtype=np.uint8)
+        self.notes = np.asarray(valid_notes)
+        self.velocities = np.asarray(valid_velocities)
+        self.note_on_len = note_on_len
+        self.note_off_len = note_off_len
+        self.sample_rate = sample_rate
+        self.perturbation = perturbation
+        self.random_seed = random_seed
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+        self.rank = rank
+        self.world_size = world_size
+        self.num_threads = num_threads
+        self.epoch = 0
+        self.iteration = 0
+
+    def set_epoch(self, epoch):
+        """
+        Draw the notes of another epoch, as DistributedSampler.set_epoch. Call it before iterating
+        the DataLoader of every epoch so each one draws different notes, and a given epoch always
+        the same ones.
+
+        Without it, every iterator started by the same process (the main one, or a persistent
+        worker, which does not see later set_epoch calls) still draws new notes, but they then
+        depend on how many iterators that process started before.
+        """
+        self.epoch = epoch
+        self.iteration = 0
+
+    def shard(self):
+        """
+        Patches and random generator of the calling DataLoader worker on this rank.
+        Shards are disjoint and only depend on random_seed, rank, world_size and num_workers.
+        The generator also depends on the epoch and on the iterators started since set_epoch.
+        """
+        worker = data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker is None else (worker.id, worker.num_workers)
+        shard = self.rank * num_workers + worker_id
+        nshards = self.world_size * num_workers
+        patches = self.patches[shard::nshards]
+        if(patches.shape[0] == 0):
+            raise ValueError("ERROR: {} patches are not enough for {} shards.".format(self.patches.shape[0], nshards))
+        rng = np.random.default_rng([self.random_seed, self.epoch, self.iteration, shard, nshards])
+        self.iteration += 1
+        return patches, rng
+
+    def render_chunk(self, synth, patches, rng):
+        n = self.chunk_size
+        packed = patches[rng.integers(patches.shape[0], size=n)]
+        parameters = unpack_patches(packed).astype(np.float32)
+        if(self.perturbation is not None):
+            limits = DX7_VOICE_MAXES[0:DX7_VOICE_PARAMETERS].astype(np.float32)
+            noise = rng.normal(0.0, self.perturbation, size=(n, DX7_VOICE_PARAMETERS)) * limits
+            parameters[:, 0:DX7_VOICE_PARAMETERS] = np.clip(np.round(parameters[:, 0:DX7_VOICE_PARAMETERS] + noise),
+                                                            0, limits)
+        # Render the parameters handed out: unpacking clamps out of range bytes of some patches,
+        # which the synthesizer would read differently.
+        packed = pack_patches(parameters)
+        notes = self.notes[rng.integers(self.notes.size, size=n)]
+        velocities = self.velocities[rng.integers(self.velocities.size, size=n)]
+        audio = synth.render_batch(packed, notes, velocities, self.note_on_len, self.note_off_len)
+        return audio, parameters, notes, velocities
+
+    def __iter__(self):
+        patches, rng = self.shard()
+        # Each worker renders with its own native instances.
+        synth = DXSynth(sampling_frequency=self.sample_rate, num_threads=self.num_threads)
+        chunks = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def put(chunk):
+            # Give up once the consumer has gone away, instead of blocking on a full queue.
+            while not stop.is_set():
+                try:
+                    chunks.put(chunk, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def producer():
+            try:
+                while not stop.is_set():
+                    put(self.render_chunk(synth, patches, rng))
+            except Exception as error:
+                put(error)
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if(isinstance(chunk, Exception)):
+                    raise chunk
+                audio, parameters, notes, velocities = chunk
+                for i in range(audio.shape[0]):
+                    yield {'audio': audio[i:i+1], 'patch': parameters[i, 0:145], 'name': parameters[i, 145:155],
+                           'note': notes[i], 'velocity': velocities[i]}
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,289 @@
+'''
+Feature store: render a DXDataset once into sharded files and train from them.
+
+    python -m dx7pytorch.dxdataset dataset/collection.bin features/ \
+        --notes 48 60 72 --velocities 100 --feature int16 --compress 6
+
+A store is a directory with:
+    manifest.json       Settings and shard list. Written last: a store without it is incomplete.
+    shard-NNNNN.bin     One record per item: its audio feature, zlib-compressed if requested.
+    shard-NNNNN.npz     Index of the shard: record offsets, the 145 parameters, names,
+                        notes and velocities (and note lengths) of its items.
+
+DXFeatureStore reads it back with the item layout of DXDataset, without calling the synth.
+'''
+
+import json
+import os
+import zlib
+from os import path
+
+import numpy as np
+import torch
+from torch.utils import data
+from .dxdataset import DXBatch, DXDataset
+
+FEATURE_STORE_VERSION = 1
+FEATURES = ('float32', 'int16', 'logmel')
+# Added to mel energies before the log.
+LOGMEL_FLOOR = 1e-6
+
+
+def mel_filterbank(sample_rate, n_fft, n_mels):
+    """
+    :return: (n_mels, n_fft // 2 + 1) float32 matrix of triangular filters, equally spaced on the
+        HTK mel scale between 0 Hz and sample_rate / 2.
+    """
+    def to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+    def to_hz(mel):
+        return 700.0 * (10.0 ** (mel / 2595.0) - 1.0)
+
+    bins = np.linspace(0.0, sample_rate / 2.0, n_fft // 2 + 1)
+    edges = to_hz(np.linspace(0.0, to_mel(sample_rate / 2.0), n_mels + 2))
+    lower = (bins[np.newaxis, :] - edges[0:-2, np.newaxis]) / (edges[1:-1] - edges[0:-2])[:, np.newaxis]
+    upper = (edges[2:, np.newaxis] - bins[np.newaxis, :]) / (edges[2:] - edges[1:-1])[:, np.newaxis]
+    return np.maximum(0.0, np.minimum(lower, upper)).astype(np.float32)
+
+
+def log_mel(audio, sample_rate, n_fft=1024, hop_length=256, n_mels=80):
+    """
+    :param audio: (N, nsamples) float32 array.
+    :return: (N, n_mels, nsamples // hop_length + 1) float32 array of log mel energies.
+    """
+    spectrum = torch.stft(torch.as_tensor(audio), n_fft, hop_length, window=torch.hann_window(n_fft),
+                          center=True, return_complex=True).abs() ** 2
+    mel = torch.from_numpy(mel_filterbank(sample_rate, n_fft, n_mels)) @ spectrum
+    return torch.log(mel + LOGMEL_FLOOR).numpy()
+
+
+def encode_features(audio, feature, sample_rate, n_fft, hop_length, n_mels):
+    # Audio of a batch, as stored in the records.
+    if(feature == 'int16'):
+        return np.round(np.clip(audio, -1.0, 1.0) * 32767.0).astype(np.int16)
+    if(feature == 'logmel'):
+        return log_mel(audio, sample_rate, n_fft, hop_length, n_mels).astype(np.float16)
+    return audio.astype(np.float32)
+
+
+def export_features(dataset:DXDataset, directory:str,
+        feature='float32',
+        compress=None,
+        shard_size=4096,
+        batch_size=256,
+        n_fft=1024,
+        hop_length=256,
+        n_mels=80,):
+    """
+    Render every item of a dataset into a feature store.
+
+    Args:
+        dataset (DXDataset): Dataset to export, in index order.
+        directory (string): Output directory. Created if needed; an existing store is replaced.
+        feature (string): Stored audio. 'float32' and 'int16' keep the waveform, 'logmel' stores
+            float16 log mel spectrograms instead.
+        compress (int): If set, zlib level (1-9) every record is compressed with.
+        shard_size (int): Items per shard.
+        batch_size (int): Items rendered per native call.
+        n_fft, hop_length, n_mels (int): Log mel settings.
+
+    Returns:
+        Path of the manifest.
+    """
+    if(feature not in FEATURES):
+        raise ValueError("ERROR: feature should be one of {}, got {}.".format(FEATURES, feature))
+    if(shard_size < 1 or batch_size < 1):
+        raise ValueError("ERROR: shard_size and batch_size must be at least 1.")
+    os.makedirs(directory, exist_ok=True)
+    manifest_file = path.join(directory, 'manifest.json')
+    if(path.exists(manifest_file)):
+        os.remove(manifest_file)
+
+    shards = []
+    feature_shape = None
+    feature_dtype = None
+    print("dx7pytorch: Exporting {} items to feature store {} . . .".format(len(dataset), directory))
+    for shard_start in range(0, len(dataset), shard_size):
+        shard_end = min(shard_start + shard_size, len(dataset))
+        name = "shard-{:05d}".format(len(shards))
+        offsets = [0]
+        index = {'parameters': [], 'names': [], 'notes': [], 'velocities': [], 'lengths': []}
+        with open(path.join(directory, name + '.bin'), 'wb') as f:
+            for start in range(shard_start, shard_end, batch_size):
+                batch = dataset.__getitems__(list(range(start, min(start + batch_size, shard_end)))).batch
+                audio = batch['audio'].numpy()[:, 0, :]
+                features = encode_features(audio, feature, dataset.sample_rate, n_fft, hop_length, n_mels)
+                feature_shape = features.shape[1:]
+                feature_dtype = features.dtype
+                for record in features:
+                    record = record.tobytes()
+                    if(compress is not None):
+                        record = zlib.compress(record, compress)
+                    f.write(record)
+                    offsets.append(offsets[-1] + len(record))
+                # Parameters and names are integers below 128.
+                index['parameters'].append(batch['patch'].numpy().astype(np.uint8))
+                index['names'].append(batch['name'].numpy().astype(np.uint8))
+                index['notes'].append(batch['note'].numpy().astype(np.uint8))
+                index['velocities'].append(batch['velocity'].numpy().astype(np.uint8))
+                if('length' in batch):
+                    index['lengths'].append(batch['length'].numpy())
+        index = {key: np.concatenate(value) for key, value in index.items() if value}
+        np.savez(path.join(directory, name + '.npz'), offsets=np.array(offsets, dtype=np.int64), **index)
+        shards.append({'name': name, 'size': shard_end - shard_start})
+
+    manifest = {
+        'version': FEATURE_STORE_VERSION,
+        'size': len(dataset),
+        'sample_rate': dataset.sample_rate,
+        'note_on_len': dataset.note_on_len,
+        'note_off_len': dataset.note_off_len,
+        'feature': feature,
+        'feature_shape': list(feature_shape) if feature_shape is not None else None,
+        'feature_dtype': np.dtype(feature_dtype).str if feature_dtype is not None else None,
+        'compress': compress,
+        'n_fft': n_fft,
+        'hop_length': hop_length,
+        'n_mels': n_mels,
+        'has_length': dataset.return_length,
+        'shards': shards,
+    }
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest_file
+
+
+class DXFeatureStore(data.Dataset):
+    """
+    Items of a feature store written by export_features, read from disk in bulk.
+
+    Items have the keys of DXDataset items: 'audio' ((1, nsamples) float32 waveform) or, for
+    'logmel' stores, 'logmel' ((n_mels, frames) float32), plus 'patch', 'name', 'note',
+    'velocity' and, if exported, 'length'. Use dx_collate to get the batches of __getitems__.
+    """
+
+    def __init__(self, directory:str):
+        """
+        Args:
+            directory (string): Feature store directory.
+        """
+        self.directory = directory
+        with open(path.join(directory, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        if(self.manifest['version'] != FEATURE_STORE_VERSION):
+            raise ValueError("ERROR: Feature store {} has version {}, expected {}.".format(
+                directory, self.manifest['version'], FEATURE_STORE_VERSION))
+        self.feature = self.manifest['feature']
+        self.compress = self.manifest['compress'] is not None
+        self.sample_rate = self.manifest['sample_rate']
+        self.note_on_len = self.manifest['note_on_len']
+        self.note_off_len = self.manifest['note_off_len']
+        self.return_length = self.manifest['has_length']
+        if(self.manifest['size'] > 0):
+            self.feature_shape = tuple(self.manifest['feature_shape'])
+            self.feature_dtype = np.dtype(self.manifest['feature_dtype'])
+
+        # Indexes are small: load them all. Records are read on demand.
+        self.shard_names = [shard['name'] for shard in self.manifest['shards']]
+        self.offsets = []
+        index = {'parameters': [], 'names': [], 'notes': [], 'velocities': [], 'lengths': []}
+        for name in self.shard_names:
+            with np.load(path.join(directory, name + '.npz')) as shard:
+                self.offsets.append(shard['offsets'])
+                for key in index:
+                    if(key in shard):
+                        index[key].append(shard[key])
+        sizes = np.array([shard['size'] for shard in self.manifest['shards']], dtype=np.int64)
+        self.shard_of = np.repeat(np.arange(sizes.size), sizes)
+        self.record_of = np.arange(self.shard_of.size) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        self.parameters = np.concatenate(index['parameters']).astype(np.float32) if sizes.size else None
+        self.names = np.concatenate(index['names']).astype(np.float32) if sizes.size else None
+        self.notes = np.concatenate(index['notes']).astype(np.int64) if sizes.size else None
+        self.velocities = np.concatenate(index['velocities']).astype(np.int64) if sizes.size else None
+        self.lengths = np.concatenate(index['lengths']) if index['lengths'] else None
+        self.files = {}
+        self.files_pid = None
+
+    def __len__(self):
+        return self.manifest['size']
+
+    def __getstate__(self):
+        # Open files are not shared with other processes.
+        state = self.__dict__.copy()
+        state['files'] = {}
+        state['files_pid'] = None
+        return state
+
+    def _file(self, shard):
+        if(self.files_pid != os.getpid()):
+            self.files = {}
+            self.files_pid = os.getpid()
+        if(shard not in self.files):
+            self.files[shard] = open(path.join(self.directory, self.shard_names[shard] + '.bin'), 'rb', buffering=0)
+        return self.files[shard]
+
+    def _decode(self, record):
+        if(self.compress):
+            record = zlib.decompress(record)
+        return np.frombuffer(record, dtype=self.feature_dtype).reshape(self.feature_shape)
+
+    def read_features(self, idx):
+        """
+        :param idx: Array of item indices.
+        :return: (len(idx), *feature_shape) array of stored features, as float32. Waveforms are
+            returned as (len(idx), nsamples).
+        """
+        idx = np.asarray(idx, dtype=np.int64)
+        out = np.empty((idx.size,) + self.feature_shape, dtype=np.float32)
+        for shard in np.unique(self.shard_of[idx]):
+            positions = np.flatnonzero(self.shard_of[idx] == shard)
+            positions = positions[np.argsort(self.record_of[idx[positions]], kind='stable')]
+            records = self.record_of[idx[positions]]
+            offsets = self.offsets[shard]
+            f = self._file(shard)
+            # Consecutive records are read with a single call.
+            for run in np.split(np.arange(records.size), np.flatnonzero(np.diff(records) != 1) + 1):
+                first, last = records[run[0]], records[run[-1]]
+                f.seek(offsets[first])
+                buffer = f.read(offsets[last + 1] - offsets[first])
+                for j in run:
+                    start = offsets[records[j]] - offsets[first]
+                    out[positions[j]] = self._decode(buffer[start:start + offsets[records[j] + 1] - offsets[records[j]]])
+        if(self.feature == 'int16'):
+            out /= 32767.0
+        return out
+
+    def __getitem__(self, idx: int):
+        x = self.read_features([idx])
+        item = {'patch': self.parameters[idx], 'name': self.names[idx],
+                'note': self.notes[idx], 'velocity': self.velocities[idx]}
+        if(self.feature == 'logmel'):
+            item['logmel'] = x[0]
+        else:
+            item['audio'] = x
+        if(self.lengths is not None):
+            item['length'] = self.lengths[idx]
+        return item
+
+    def __getitems__(self, indices):
+        """
+        Read a whole DataLoader batch at once. Use dx_collate as collate_fn to get it without
+        stacking the items again.
+        """
+        idx = np.array(indices, dtype=np.int64)
+        x = torch.from_numpy(self.read_features(idx))
+        batch = {'logmel': x} if self.feature == 'logmel' else {'audio': x[:, np.newaxis, :]}
+        batch.update({'patch': torch.from_numpy(self.parameters[idx]),
+                      'name': torch.from_numpy(self.names[idx]),
+                      'note': torch.from_numpy(self.notes[idx]),
+                      'velocity': torch.from_numpy(self.velocities[idx])})
+        if(self.lengths is not None):
+            batch['length'] = torch.from_numpy(self.lengths[idx])
+        items = [{key: value[i] for key, value in batch.items()} for i in range(idx.size)]
+        return DXBatch(items, batch)
+
+    def __del__(self):
+        for f in getattr(self, 'files', {}).values():
+            f.close()
+
@@ -0,0 +1,86 @@
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+from dx7pytorch.dxsynth import DX7_VOICE_SIZE_PACKED, decode_patches, unpack_patches
+from dx7pytorch.dxsynth.dxsynth import DX7_VOICE_SIZE_DECODED, DX7_VOICE_SIZE_UNPACKED
+
+# Columns of the unpacked parameters: 145 parameters, 10 name characters and OP ON/OFF.
+BANK_PARAMETERS = DX7_VOICE_SIZE_UNPACKED + 1
+
+
+class PatchBank:
+    """
+    Packed patches of a dataset and their unpacked parameters, stored once in shared memory.
+
+    DataLoader workers forked or spawned from the creating process map the same pages
+    instead of holding a copy each, so memory use does not grow with num_workers.
+    """
+
+    def __init__(self, patches, decoded=False):
+        """
+        :param patches: (N, 128) array of packed patches.
+        :param decoded: Also keep the patches decoded for the synth (see decode_patches) in 'decoded'.
+        """
+        patches = np.ascontiguousarray(patches, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED))
+        self.npatches = patches.shape[0]
+        self.has_decoded = decoded
+        size = self.npatches * (DX7_VOICE_SIZE_PACKED + 4 * BANK_PARAMETERS
+                                + (DX7_VOICE_SIZE_DECODED if decoded else 0))
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.owner_pid = os.getpid()
+        self._map()
+        self.patches[:] = patches
+        self.parameters[:] = unpack_patches(patches)
+        if self.has_decoded:
+            self.decoded[:] = decode_patches(patches)
+        self._protect()
+
+    def _map(self):
+        patch_bytes = self.npatches * DX7_VOICE_SIZE_PACKED
+        parameter_bytes = 4 * self.npatches * BANK_PARAMETERS
+        self.patches = np.ndarray((self.npatches, DX7_VOICE_SIZE_PACKED), dtype=np.uint8,
+                                  buffer=self.shm.buf[:patch_bytes])
+        self.parameters = np.ndarray((self.npatches, BANK_PARAMETERS), dtype=np.float32,
+                                     buffer=self.shm.buf[patch_bytes:patch_bytes + parameter_bytes])
+        self.decoded = None
+        if self.has_decoded:
+            start = patch_bytes + parameter_bytes
+            self.decoded = np.ndarray((self.npatches, DX7_VOICE_SIZE_DECODED), dtype=np.uint8,
+                                      buffer=self.shm.buf[start:start + self.npatches * DX7_VOICE_SIZE_DECODED])
+
+    def _protect(self):
+        # The bank is read only once filled, in every process.
+        self.patches.flags.writeable = False
+        self.parameters.flags.writeable = False
+        if self.decoded is not None:
+            self.decoded.flags.writeable = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('patches', None)
+        state.pop('parameters', None)
+        state.pop('decoded', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+        self._protect()
+
+    def __len__(self):
+        return self.npatches
+
+    def __del__(self):
+        shm = getattr(self, 'shm', None)
+        if shm is not None:
+            self.patches = None
+            self.parameters = None
+            self.decoded = None
+            if self.owner_pid == os.getpid():
+                shm.unlink()
+            try:
+                shm.close()
+            except BufferError:
+                # Items still hold views of the bank. The mapping goes away with them.
+                pass
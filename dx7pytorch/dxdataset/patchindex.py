@@ -0,0 +1,152 @@
+import numpy as np
+from dx7pytorch.dxsynth import DX7_VOICE_SIZE_PACKED, unpack_patches
+from dx7pytorch.dxsynth.dxsynth import DX7_VOICE_MAXES, DX7_VOICE_PARAMETERS
+
+# Rows of the index compared with the queries at once.
+INDEX_BLOCK_SIZE = 4096
+# Rows compared at once while looking for near-duplicates. Small blocks keep the window of
+# candidates that follows each block narrow.
+NEIGHBOURS_BLOCK_SIZE = 256
+
+
+def patch_features(parameters):
+    """
+    :param parameters: (N, 145), (N, 155) or (N, 156) array of unpacked parameters, or one vector.
+    :return: (N, 145) float32 array of parameters scaled by their maximum, so each lies in [0, 1].
+    """
+    p = np.asarray(parameters, dtype=np.float32)
+    p = p.reshape((-1, p.shape[-1]))
+    if p.shape[1] < DX7_VOICE_PARAMETERS:
+        raise ValueError(f"ERROR: Expected at least {DX7_VOICE_PARAMETERS} parameters, got {p.shape[1]}.")
+    return p[:, 0:DX7_VOICE_PARAMETERS] / DX7_VOICE_MAXES[0:DX7_VOICE_PARAMETERS].astype(np.float32)
+
+
+class PatchIndex:
+    """
+    Nearest-neighbour index over the 145 parameters of a set of patches.
+
+    Distances are euclidean over parameters scaled to [0, 1] by their maximum (see
+    patch_features), so a parameter moved across its whole range counts as 1. Searches are
+    blocked brute force on top of a matrix product: on 30k patches a query takes a few
+    milliseconds, and batches of queries share the work.
+    """
+
+    def __init__(self, patches=None, parameters=None, block_size=INDEX_BLOCK_SIZE):
+        """
+        :param patches: (N, 128) array of packed patches.
+        :param parameters: Or, instead, (N, 145) or (N, 155) array of unpacked parameters.
+        :param block_size: Rows of the index compared with the queries at once.
+        """
+        if (patches is None) == (parameters is None):
+            raise ValueError("ERROR: PatchIndex needs either patches or parameters.")
+        if patches is not None:
+            parameters = unpack_patches(np.asarray(patches, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED)))
+        self.features = patch_features(parameters)
+        self.norms = np.einsum('ij,ij->i', self.features, self.features)
+        self.block_size = block_size
+
+    @classmethod
+    def from_collection(cls, collection, block_size=INDEX_BLOCK_SIZE):
+        """
+        :param collection: Path to a patch collection (collection.bin).
+        """
+        patches = np.fromfile(collection, dtype=np.uint8)
+        npatches = patches.size // DX7_VOICE_SIZE_PACKED
+        return cls(patches[:npatches * DX7_VOICE_SIZE_PACKED], block_size=block_size)
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    def _blocks(self, queries):
+        # Squared distances from the queries to every block of rows, as (start, (Q, block)) pairs.
+        query_norms = np.einsum('ij,ij->i', queries, queries)
+        for start in range(0, len(self), self.block_size):
+            end = min(start + self.block_size, len(self))
+            squared = query_norms[:, np.newaxis] - 2.0 * (queries @ self.features[start:end].T) + self.norms[start:end]
+            yield start, np.maximum(squared, 0.0)
+
+    def query(self, parameters, k=1):
+        """
+        Find the patches closest to some parameter vectors (e.g. model predictions).
+
+        :param parameters: (Q, 145) or (Q, 155) array of unpacked parameters, or one vector.
+        :param k: Number of neighbours per query.
+        :return: (Q, k) float32 distances and (Q, k) int64 indices, nearest first.
+        """
+        queries = patch_features(parameters)
+        k = min(k, len(self))
+        best = np.full((queries.shape[0], 0), np.inf, dtype=np.float32)
+        best_idx = np.zeros((queries.shape[0], 0), dtype=np.int64)
+        for start, squared in self._blocks(queries):
+            # Keep the k best of the candidates so far and of this block.
+            kb = min(k, squared.shape[1])
+            top = np.argpartition(squared, kb - 1, axis=1)[:, 0:kb]
+            best = np.concatenate([best, np.take_along_axis(squared, top, axis=1)], axis=1)
+            best_idx = np.concatenate([best_idx, top + start], axis=1)
+            if best.shape[1] > k:
+                keep = np.argpartition(best, k - 1, axis=1)[:, 0:k]
+                best = np.take_along_axis(best, keep, axis=1)
+                best_idx = np.take_along_axis(best_idx, keep, axis=1)
+        order = np.argsort(best, axis=1, kind='stable')
+        distances = np.sqrt(np.take_along_axis(best, order, axis=1))
+        return distances.astype(np.float32), np.take_along_axis(best_idx, order, axis=1)
+
+    def neighbours(self, tolerance):
+        """
+        :param tolerance: Largest distance between two patches considered near-duplicates.
+        :return: (i, j) int64 arrays of every pair of patches with i < j within tolerance.
+        """
+        if len(self) < 2:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        # Patches within tolerance are also within tolerance along any axis. Sorted along the
+        # principal axis, each block only needs comparing with the rows that follow it up to
+        # tolerance further along it.
+        centered = self.features - self.features.mean(axis=0)
+        axis = np.linalg.svd(centered[::max(1, len(self) // 4096)], full_matrices=False)[2][0]
+        projection = centered @ axis
+        order = np.argsort(projection, kind='stable')
+        projection = projection[order]
+        features = self.features[order]
+        norms = self.norms[order]
+        # Expanded float32 distances are off by up to ~1e-5 here: shortlist with some slack, then
+        # compute exact distances.
+        slack = (tolerance + 0.03) ** 2
+        first = []
+        second = []
+        for start in range(0, len(self), NEIGHBOURS_BLOCK_SIZE):
+            end = min(start + NEIGHBOURS_BLOCK_SIZE, len(self))
+            stop = np.searchsorted(projection, projection[end - 1] + tolerance + 1e-3, side='right')
+            squared = (norms[start:end, np.newaxis] - 2.0 * (features[start:end] @ features[start:stop].T)
+                       + norms[start:stop])
+            i, j = np.nonzero(squared <= slack)
+            i = i + start
+            j = j + start
+            pairs = i < j
+            i, j = i[pairs], j[pairs]
+            exact = np.sqrt(np.sum((features[i].astype(np.float64) - features[j]) ** 2, axis=1))
+            close = exact <= tolerance
+            first.append(order[i[close]])
+            second.append(order[j[close]])
+        if not first:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        first = np.concatenate(first)
+        second = np.concatenate(second)
+        return np.minimum(first, second).astype(np.int64), np.maximum(first, second).astype(np.int64)
+
+    def unique(self, tolerance=0.0):
+        """
+        Remove near-duplicates: a patch is kept unless an earlier kept patch lies within tolerance.
+
+        :param tolerance: Largest distance between near-duplicates. 0 only drops patches whose 145
+            parameters are identical (names are ignored).
+        :return: Sorted int64 indices of the kept patches.
+        """
+        i, j = self.neighbours(tolerance)
+        order = np.argsort(i, kind='stable')
+        i, j = i[order], j[order]
+        bounds = np.searchsorted(i, np.arange(len(self) + 1))
+        removed = np.zeros(len(self), dtype=bool)
+        for patch in np.unique(i):
+            if not removed[patch]:
+                removed[j[bounds[patch]:bounds[patch + 1]]] = True
+        return np.flatnonzero(~removed)
@@ -1,5 +1,11 @@
 from .dxsynth import DXSynth
 from .dxsynth import DX7_VOICE_SIZE_PACKED
+from .dxsynth import decode_patches, note_lengths, pack_patches, unpack_patches
+from .dxsynth import (EVENT_CONTROL_CHANGE, EVENT_NOTE_OFF, EVENT_NOTE_ON, EVENT_PITCH_BEND, TIMELINE_EVENT,
+                      timeline_events)
+from .rendercache import RenderCache
 
-__all__ = ["DXSynth, DX7_VOICE_SIZE_PACKED"]
-__version__ = "0.1"
\ No newline at end of file
+__all__ = ["DXSynth", "DX7_VOICE_SIZE_PACKED", "decode_patches", "note_lengths", "pack_patches", "unpack_patches", "RenderCache",
+           "EVENT_NOTE_ON", "EVENT_NOTE_OFF", "EVENT_PITCH_BEND", "EVENT_CONTROL_CHANGE", "TIMELINE_EVENT",
+           "timeline_events"]
+__version__ = "0.1"
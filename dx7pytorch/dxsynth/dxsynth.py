@@ -1,14 +1,118 @@
 import os
-import platform
+import sys
 import ctypes
+import contextlib
+import threading
 import numpy as np
-import numpy.ctypeslib as npct
-from ctypes import cdll
+from .rendercache import render_key
+from .renderstats import HexterStats, add_stats, empty_stats, stats_from_vector, stats_to_vector
 
 # dx7 sysex format: https://homepages.abdn.ac.uk/d.j.benson/pages/dx7/sysex-format.txt
 # Constants for DX7
 DX7_DUMP_SIZE_VOICE_BULK = 4096 + 8
 DX7_VOICE_SIZE_PACKED = 128
+DX7_VOICE_SIZE_UNPACKED = 155
+DX7_VOICE_PARAMETERS = 145
+# Bytes of a patch decoded by decode_patches (sizeof(dx7_voice_patch_t) in dx7_voice.h).
+DX7_VOICE_SIZE_DECODED = 148
+# Most notes hexter_render_batch_lanes renders side by side (DX7_VOICE_LANES in dx7_voice.h).
+DX7_VOICE_LANES = 8
+# Samples between control updates of the native core (HEXTER_NUGGET_SIZE in hexter.h).
+HEXTER_NUGGET_SIZE = 64
+# Default samples per block of DXSynth.stream.
+STREAM_BLOCK_SIZE = 4096
+# Most voices a timeline plays at once (HEXTER_MAX_POLYPHONY in hexter.h).
+HEXTER_MAX_POLYPHONY = 16
+
+# Event types of DXSynth.render_timeline (HEXTER_EVENT_* in hexter.c).
+EVENT_NOTE_ON = 0
+EVENT_NOTE_OFF = 1
+EVENT_PITCH_BEND = 2
+EVENT_CONTROL_CHANGE = 3
+# A timeline event, laid out as hexter_event_t: the sample it happens at, the pitch bend
+# (-8192 to 8191) or controller value, its type, note, velocity and controller number.
+TIMELINE_EVENT = np.dtype([('offset', '<u8'), ('value', '<i4'), ('type', 'u1'), ('note', 'u1'),
+                           ('velocity', 'u1'), ('cc', 'u1')], align=True)
+
+# Upper limit of every unpacked parameter (plus the trailing OP ON/OFF byte).
+DX7_VOICE_MAXES = np.array(
+    [99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99,  # osc6 ... osc1
+     3, 3, 7, 3, 7, 99, 1, 31, 99, 14] * 6
+    + [99, 99, 99, 99, 99, 99, 99, 99,            # pitch eg rate & level
+       31, 7, 1, 99, 99, 99, 99, 1, 5, 7, 48]     # algorithm etc
+    + [126] * 10                                  # name
+    + [127],                                      # operator on/off
+    dtype=np.uint8
+)
+
+
+def note_lengths(audio, silence_threshold=0.0):
+    """
+    Length of rendered notes once their silent tail is dropped.
+
+    :param audio: (N, nsamples) or (nsamples,) array of rendered audio.
+    :param silence_threshold: Samples whose magnitude is at most this value count as silent.
+    :return: One past the index of the last non-silent sample of every note (0 if all silent),
+        as an int64 array of shape (N,), or a scalar.
+    """
+    loud = np.abs(np.asarray(audio)) > silence_threshold
+    nsamples = loud.shape[-1]
+    last = nsamples - np.argmax(loud[..., ::-1], axis=-1)
+    return np.where(np.any(loud, axis=-1), last, 0).astype(np.int64)
+
+
+def timeline_events(offset, event_type, note=0, velocity=0, cc=0, value=0):
+    """
+    Build the events of a DXSynth.render_timeline timeline. Arguments are broadcast together, and
+    the events are sorted by offset (keeping the given order of simultaneous events):
+
+        events = timeline_events([0, 0, 8000, 12000, 16000, 16000],
+                                 [EVENT_NOTE_ON, EVENT_NOTE_ON, EVENT_CONTROL_CHANGE, EVENT_PITCH_BEND,
+                                  EVENT_NOTE_OFF, EVENT_NOTE_OFF],
+                                 note=[60, 64, 0, 0, 60, 64], velocity=100, cc=1, value=[0, 0, 127, 4096, 0, 0])
+
+    :param offset: Sample every event happens at.
+    :param event_type: EVENT_NOTE_ON, EVENT_NOTE_OFF, EVENT_PITCH_BEND or EVENT_CONTROL_CHANGE.
+    :param note: MIDI note of note events.
+    :param velocity: MIDI velocity of note events. A note on at velocity 0 is a note off.
+    :param cc: Controller number of control changes (e.g. 1 for the mod wheel).
+    :param value: Pitch bend (-8192 to 8191, 2 semitones at the extremes) or controller value (0 to 127).
+    :return: 1-D TIMELINE_EVENT array.
+    """
+    fields = np.broadcast_arrays(*(np.asarray(x).reshape(-1) for x in (offset, event_type, note, velocity, cc, value)))
+    events = np.empty(fields[0].shape, dtype=TIMELINE_EVENT)
+    for name, field in zip(('offset', 'type', 'note', 'velocity', 'cc', 'value'), fields):
+        events[name] = field
+    return events[np.argsort(events['offset'], kind='stable')]
+
+
+def output_array(out, ninstances, nsamples):
+    """
+    View a caller-supplied output buffer as the array the native core renders into, without copying.
+    The native core writes through its data pointer, so anything that does not match exactly is
+    rejected before rendering.
+
+    :param out: C-contiguous, writable float32 NumPy array or CPU torch.Tensor (pinned memory
+        included) of shape (N, nsamples) or (N, 1, nsamples).
+    :param ninstances: Number of notes N.
+    :param nsamples: Samples per note.
+    :return: (N, nsamples) float32 NumPy array sharing memory with out.
+    """
+    expected = f"a C-contiguous, writable float32 array or CPU tensor of shape {(ninstances, nsamples)} " \
+               f"or {(ninstances, 1, nsamples)}"
+    array = out
+    # Tensors are recognised by duck typing: torch is not a dependency of the synthesizer.
+    if type(out).__module__.split('.')[0] == 'torch':
+        if out.device.type != 'cpu' or str(out.dtype) != 'torch.float32' or out.requires_grad:
+            raise ValueError(f"ERROR: Output tensor must be {expected} without requires_grad, "
+                             f"got {out.dtype} {tuple(out.shape)} on {out.device}.")
+        array = out.numpy()
+    if not isinstance(array, np.ndarray):
+        raise ValueError(f"ERROR: Output buffer must be {expected}, got {type(out).__name__}.")
+    if (array.dtype != np.float32 or array.shape not in ((ninstances, nsamples), (ninstances, 1, nsamples))
+            or not array.flags['C_CONTIGUOUS'] or not array.flags['WRITEABLE']):
+        raise ValueError(f"ERROR: Output buffer must be {expected}, got {array.dtype} {array.shape}.")
+    return array.reshape((ninstances, nsamples))
 
 
 def open_bulk_patches(filename, selection=None):
@@ -34,63 +138,263 @@ def open_bulk_patches(filename, selection=None):
     return patches[selection, :]
 
 
-class DXSynth:
-    def __init__(self, sampling_frequency):
-        """
-        Initialize the DX7 Synth with the specified sampling frequency.
+def unpack_patches(patches):
+    """
+    Unpack packed patches into clamped synthesizer parameters.
 
-        :param sampling_frequency: The sampling frequency for the synthesizer.
-        """
-        # Determine the shared library path based on the OS
-        system = platform.system().lower()
-        lib_extension = {"windows": "dll", "darwin": "dylib"}.get(system, "so")
-        lib_name = f"dxcore.{lib_extension}"
+    Vectorized version of the learnfm unpacker (https://github.com/bwhitman/learnfm).
 
-        # Build the full path to the shared library
-        my_path = os.path.dirname(os.path.abspath(__file__))
-        dll_path = os.path.join(my_path, '../../', lib_name)
+    :param patches: (N, 128) or (128,) array of packed patches.
+    :return: (N, 156) or (156,) uint8 array: 145 parameters, 10 name characters
+        and the OP ON/OFF byte.
+    """
+    p = np.asarray(patches, dtype=np.uint8)
+    single = p.ndim == 1
+    p = p.reshape((-1, DX7_VOICE_SIZE_PACKED))
+    n = p.shape[0]
+
+    # Operators are stored OP6 first, 17 packed bytes to 21 parameters each.
+    p_op = p[:, 0:102].reshape((n, 6, 17))
+    o_op = np.empty((n, 6, 21), dtype=np.uint8)
+    o_op[:, :, 0:11] = p_op[:, :, 0:11]
+    o_op[:, :, 11] = p_op[:, :, 11] & 3
+    o_op[:, :, 12] = (p_op[:, :, 11] >> 2) & 3
+    o_op[:, :, 13] = p_op[:, :, 12] & 7
+    o_op[:, :, 14] = p_op[:, :, 13] & 3
+    o_op[:, :, 15] = p_op[:, :, 13] >> 2
+    o_op[:, :, 16] = p_op[:, :, 14]
+    o_op[:, :, 17] = p_op[:, :, 15] & 1
+    o_op[:, :, 18] = p_op[:, :, 15] >> 1
+    o_op[:, :, 19] = p_op[:, :, 16]
+    o_op[:, :, 20] = p_op[:, :, 12] >> 3
+
+    o = np.empty((n, DX7_VOICE_SIZE_UNPACKED + 1), dtype=np.uint8)
+    o[:, 0:126] = o_op.reshape((n, 126))
+    o[:, 126:135] = p[:, 102:111]
+    o[:, 135] = p[:, 111] & 7
+    o[:, 136] = p[:, 111] >> 3
+    o[:, 137:141] = p[:, 112:116]
+    o[:, 141] = p[:, 116] & 1
+    o[:, 142] = (p[:, 116] >> 1) & 7
+    o[:, 143] = p[:, 116] >> 4
+    o[:, 144:155] = p[:, 117:128]
+    o[:, 155] = 0x3f  # Seems that OP ON/OFF they are always on. Ignore.
+
+    # Clamp the unpacked patches to a known max.
+    np.minimum(o, DX7_VOICE_MAXES, out=o)
+    return o[0] if single else o
+
+
+def pack_patches(unpacked):
+    """
+    Pack synthesizer parameters into patches. Mirrors dx7_patch_pack in the native core.
 
-        if not os.path.exists(dll_path):
-            raise FileNotFoundError(f"Shared library not found at {dll_path}")
+    :param unpacked: (N, 145), (N, 155) or (N, 156) array of parameters, or a single
+        1-D parameter vector. Without a name, the name is left blank (zeros).
+    :return: (N, 128) or (128,) uint8 array of packed patches.
+    """
+    u = np.asarray(unpacked)
+    single = u.ndim == 1
+    u = u.reshape((-1, u.shape[-1]))
+    if u.shape[1] < DX7_VOICE_PARAMETERS:
+        raise ValueError(f"ERROR: Expected at least {DX7_VOICE_PARAMETERS} parameters, got {u.shape[1]}.")
+    n = u.shape[0]
+    if u.shape[1] < DX7_VOICE_SIZE_UNPACKED:
+        padded = np.zeros((n, DX7_VOICE_SIZE_UNPACKED), dtype=np.uint8)
+        padded[:, 0:u.shape[1]] = u
+        u = padded
+    else:
+        u = u[:, 0:DX7_VOICE_SIZE_UNPACKED].astype(np.uint8)
+
+    u_op = u[:, 0:126].reshape((n, 6, 21))
+    p_op = np.empty((n, 6, 17), dtype=np.uint8)
+    p_op[:, :, 0:11] = u_op[:, :, 0:11]
+    p_op[:, :, 11] = (u_op[:, :, 11] & 0x03) | ((u_op[:, :, 12] & 0x03) << 2)
+    p_op[:, :, 12] = (u_op[:, :, 13] & 0x07) | ((u_op[:, :, 20] & 0x0f) << 3)
+    p_op[:, :, 13] = (u_op[:, :, 14] & 0x03) | ((u_op[:, :, 15] & 0x07) << 2)
+    p_op[:, :, 14] = u_op[:, :, 16]
+    p_op[:, :, 15] = (u_op[:, :, 17] & 0x01) | ((u_op[:, :, 18] & 0x1f) << 1)
+    p_op[:, :, 16] = u_op[:, :, 19]
+
+    p = np.empty((n, DX7_VOICE_SIZE_PACKED), dtype=np.uint8)
+    p[:, 0:102] = p_op.reshape((n, 102))
+    p[:, 102:111] = u[:, 126:135]
+    p[:, 111] = (u[:, 135] & 0x07) | ((u[:, 136] & 0x01) << 3)
+    p[:, 112:116] = u[:, 137:141]
+    p[:, 116] = (u[:, 141] & 0x01) | ((u[:, 142] & 0x07) << 1) | ((u[:, 143] & 0x07) << 4)
+    p[:, 117:128] = u[:, 144:155]
+    return p[0] if single else p
+
+
+# Argument types of the native functions.
+_INSTANCE = ctypes.POINTER(ctypes.c_ubyte)
+_BYTES = ctypes.POINTER(ctypes.c_ubyte)
+_FLOATS = ctypes.POINTER(ctypes.c_float)
+_LENGTHS = ctypes.POINTER(ctypes.c_ulong)
+
+# Prototypes of the native functions: name -> (restype, argtypes).
+NATIVE_PROTOTYPES = {
+    'hexter_init': (_INSTANCE, [ctypes.c_long, _BYTES]),
+    'hexter_clean_and_exit': (None, [_INSTANCE]),
+    'synthesize': (None, [_INSTANCE, _FLOATS, ctypes.c_long, ctypes.c_long]),
+    'hexter_instance_note_on': (None, [_INSTANCE, ctypes.c_ubyte, ctypes.c_ubyte]),
+    'hexter_instance_note_off': (None, [_INSTANCE, ctypes.c_ubyte, ctypes.c_ubyte]),
+    'hexter_instance_select_program': (None, [_INSTANCE, ctypes.c_ubyte, ctypes.c_ubyte]),
+    'reset_synth': (None, [_INSTANCE]),
+    'hexter_render_batch': (None, [_INSTANCE, _BYTES, _BYTES, _BYTES, ctypes.c_ulong, ctypes.c_ulong,
+                                   _FLOATS, ctypes.c_ulong, _LENGTHS, ctypes.c_float]),
+    'hexter_render_batch_lanes': (None, [ctypes.POINTER(_INSTANCE), ctypes.c_ulong, _BYTES, _BYTES, _BYTES,
+                                         ctypes.c_ulong, ctypes.c_ulong, _FLOATS, ctypes.c_ulong, _LENGTHS,
+                                         ctypes.c_float]),
+    'hexter_decode_patches': (None, [_BYTES, ctypes.c_ulong, _BYTES]),
+    'hexter_render_batch_decoded': (None, [_INSTANCE, _BYTES, _BYTES, _BYTES, ctypes.c_ulong, ctypes.c_ulong,
+                                           _FLOATS, ctypes.c_ulong, _LENGTHS, ctypes.c_float]),
+    'hexter_render_batch_lanes_decoded': (None, [ctypes.POINTER(_INSTANCE), ctypes.c_ulong, _BYTES, _BYTES, _BYTES,
+                                                 ctypes.c_ulong, ctypes.c_ulong, _FLOATS, ctypes.c_ulong, _LENGTHS,
+                                                 ctypes.c_float]),
+    'hexter_stream_state_size': (ctypes.c_ulong, []),
+    'hexter_stream_start': (None, [_INSTANCE, ctypes.c_ulong, _BYTES, _BYTES, _BYTES, _BYTES, _BYTES]),
+    'hexter_stream_render': (None, [_INSTANCE, ctypes.c_ulong, _BYTES, _BYTES, ctypes.c_ulong,
+                                    ctypes.c_ulong, ctypes.c_ulong, _FLOATS, _BYTES]),
+    'hexter_render_batch_unpacked': (None, [_INSTANCE, _FLOATS, ctypes.c_ulong, _BYTES, _BYTES,
+                                            ctypes.c_ulong, ctypes.c_ulong, _FLOATS, ctypes.c_ulong,
+                                            _LENGTHS, ctypes.c_float]),
+    'hexter_render_timelines': (None, [_INSTANCE, _BYTES, ctypes.c_void_p, _LENGTHS, ctypes.c_ulong, ctypes.c_ulong,
+                                       ctypes.c_ulong, _FLOATS]),
+    'hexter_set_stats_enabled': (None, [_INSTANCE, ctypes.c_int]),
+    'hexter_get_stats': (ctypes.POINTER(HexterStats), [_INSTANCE]),
+    'hexter_reset_stats': (None, [_INSTANCE]),
+}
+
+_library = None
+_library_lock = threading.Lock()
+# Serializes hexter_init: synths may be created from several threads at once.
+_instance_lock = threading.Lock()
+
+
+def library_path():
+    """
+    :return: Path of the native synthesizer library (dxcore.so, .dylib or .dll).
+    """
+    lib_extension = {"win32": "dll", "darwin": "dylib"}.get(sys.platform, "so")
+    my_path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(my_path, '../../', f"dxcore.{lib_extension}")
 
-        # Load the shared library
-        self.lib = cdll.LoadLibrary(dll_path)
 
-        # Initialize the synthesizer library
-        hexter_init = self.lib.hexter_init
-        hexter_init.restype = ctypes.POINTER(ctypes.c_ubyte)
-        hexter_init.argtypes = [ctypes.c_long, ctypes.POINTER(ctypes.c_ubyte)]
+def load_library():
+    """
+    Load the native synthesizer library and declare its prototypes, once per process.
+    Every DXSynth shares the returned library.
 
-        # Define other library functions
-        self.do_run_synth = self.lib.synthesize
-        self.do_run_synth.argtypes = [ctypes.POINTER(ctypes.c_ubyte),
-                                      ctypes.POINTER(ctypes.c_float),
-                                      ctypes.c_long, ctypes.c_long]
+    :return: The ctypes.CDLL of the library.
+    """
+    global _library
+    if _library is None:
+        with _library_lock:
+            if _library is None:
+                dll_path = library_path()
+                if not os.path.exists(dll_path):
+                    raise FileNotFoundError(f"Shared library not found at {dll_path}")
+                lib = ctypes.CDLL(dll_path)
+                for name, (restype, argtypes) in NATIVE_PROTOTYPES.items():
+                    function = getattr(lib, name)
+                    function.restype = restype
+                    function.argtypes = argtypes
+                _library = lib
+    return _library
+
+
+def decode_patches(patches):
+    """
+    Decode packed patches once into the voice parameters the native core sets up every note
+    from, so render_batch(..., decoded=...) does not unpack and decode them again for every note.
 
-        self.do_note_on = self.lib.hexter_instance_note_on
-        self.do_note_on.argtypes = [ctypes.POINTER(ctypes.c_ubyte), ctypes.c_ubyte, ctypes.c_ubyte]
+    :param patches: (N, 128) array of packed patches.
+    :return: (N, 148) uint8 array of decoded patches, opaque to Python.
+    """
+    patches = np.ascontiguousarray(patches, dtype=np.uint8)
+    if patches.ndim != 2 or patches.shape[1] != DX7_VOICE_SIZE_PACKED:
+        raise ValueError(f"ERROR: Patches shape {patches.shape} is unexpected!")
+    decoded = np.empty((patches.shape[0], DX7_VOICE_SIZE_DECODED), dtype=np.uint8)
+    load_library().hexter_decode_patches(patches.ctypes.data_as(_BYTES), patches.shape[0],
+                                         decoded.ctypes.data_as(_BYTES))
+    return decoded
 
-        self.do_note_off = self.lib.hexter_instance_note_off
-        self.do_note_off.argtypes = [ctypes.POINTER(ctypes.c_ubyte), ctypes.c_ubyte, ctypes.c_ubyte]
 
-        self.do_program_change = self.lib.hexter_instance_select_program
-        self.do_program_change.argtypes = [ctypes.POINTER(ctypes.c_ubyte), ctypes.c_ubyte, ctypes.c_ubyte]
+class DXSynth:
+    def __init__(self, sampling_frequency, num_threads=1, render_cache=None, lanes=1):
+        """
+        Initialize the DX7 Synth with the specified sampling frequency.
 
+        :param sampling_frequency: The sampling frequency for the synthesizer.
+        :param num_threads: Number of native synth instances used to render batches in
+            parallel threads. None uses one per CPU core.
+        :param render_cache: Optional RenderCache. Batches only render the notes it misses.
+        :param lanes: Number of notes every thread renders side by side in render_batch, up to 8.
+            Notes are grouped by algorithm and run through the operators of all lanes at once,
+            which the compiler can vectorize. The audio is the same as with lanes=1.
+        """
+        # The library is loaded, and its prototypes declared, once per process.
+        self.lib = load_library()
+        self.do_run_synth = self.lib.synthesize
+        self.do_note_on = self.lib.hexter_instance_note_on
+        self.do_note_off = self.lib.hexter_instance_note_off
+        self.do_program_change = self.lib.hexter_instance_select_program
         self.do_reset = self.lib.reset_synth
-        self.do_reset.argtypes = [ctypes.POINTER(ctypes.c_ubyte)]
-
-        self.do_patch_pack = self.lib.dx7_patch_pack
-        self.do_patch_pack.argtypes = [ctypes.POINTER(ctypes.c_ubyte),
-                                       ctypes.POINTER(ctypes.c_ubyte), ctypes.c_ubyte]
-
-        # Patch buffer for patches
-        self.patch_buffer = np.ascontiguousarray(
-            np.zeros((128, DX7_VOICE_SIZE_PACKED), dtype=np.uint8)
-        )
+        self.do_render_batch = self.lib.hexter_render_batch
+        self.do_render_batch_lanes = self.lib.hexter_render_batch_lanes
+        self.do_set_stats_enabled = self.lib.hexter_set_stats_enabled
+        self.do_get_stats = self.lib.hexter_get_stats
+        self.do_reset_stats = self.lib.hexter_reset_stats
+        self.do_render_batch_unpacked = self.lib.hexter_render_batch_unpacked
+        self.do_render_batch_decoded = self.lib.hexter_render_batch_decoded
+        self.do_render_batch_lanes_decoded = self.lib.hexter_render_batch_lanes_decoded
+        self.do_stream_start = self.lib.hexter_stream_start
+        self.do_stream_render = self.lib.hexter_stream_render
+        self.do_render_timelines = self.lib.hexter_render_timelines
+
+        if sampling_frequency <= 0:
+            raise ValueError(f"ERROR: Sampling frequency must be positive, got {sampling_frequency}.")
+        self.sampling_frequency = sampling_frequency
+
+        if num_threads is None:
+            num_threads = os.cpu_count() or 1
+        if num_threads < 1:
+            raise ValueError(f"ERROR: num_threads must be at least 1, got {num_threads}.")
+        self.num_threads = num_threads
+        if not 1 <= lanes <= DX7_VOICE_LANES:
+            raise ValueError(f"ERROR: lanes must be between 1 and {DX7_VOICE_LANES}, got {lanes}.")
+        self.lanes = lanes
+        self.pool = None
+        self.render_cache = render_cache
+        self.stats_enabled = False
+        # Native instances belong to this process. A forked copy must not free them.
+        self.pid = os.getpid()
+
+        # One hexter instance (and patch buffer) per thread and lane. The first one also
+        # serves the step-by-step methods below.
+        self.patch_buffers = []
+        self.instances = []
+        for _ in range(num_threads * lanes):
+            instance, patch_buffer = self._create_instance()
+            self.patch_buffers.append(patch_buffer)
+            self.instances.append(instance)
+
+        self.patch_buffer = self.patch_buffers[0]
         self.patch_buffer_pointer = self.patch_buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte))
-
-        # Initialize hexter
-        self.instance = hexter_init(np.uint32(sampling_frequency), self.patch_buffer_pointer)
+        self.instance = self.instances[0]
+        # Instances of every thread, as the array of pointers hexter_render_batch_lanes takes.
+        self.lane_instances = [(ctypes.POINTER(ctypes.c_ubyte) * lanes)(*self.instances[k * lanes:(k + 1) * lanes])
+                               for k in range(num_threads)]
+
+    def _create_instance(self):
+        # A native instance, and the patch buffer it reads programs from (to be kept alive with it).
+        patch_buffer = np.zeros((128, DX7_VOICE_SIZE_PACKED), dtype=np.uint8)
+        with _instance_lock:
+            instance = self.lib.hexter_init(np.uint32(self.sampling_frequency), patch_buffer.ctypes.data_as(_BYTES))
+        if not instance:
+            raise MemoryError("ERROR: Could not create a hexter instance.")
+        return instance, patch_buffer
 
     def note_on(self, note, velocity):
         self.do_note_on(self.instance, note.astype(np.uint8), velocity.astype(np.uint8))
@@ -108,43 +412,393 @@ class DXSynth:
     def reset_synth(self):
         self.do_reset(self.instance)
 
+    def enable_stats(self, enabled=True):
+        """
+        Start or stop updating the render counters of every native instance.
+        While disabled (the default) they cost a single branch per 64-sample burst.
+        """
+        for instance in self.instances:
+            self.do_set_stats_enabled(instance, int(enabled))
+        self.stats_enabled = enabled
+
+    def reset_stats(self):
+        for instance in self.instances:
+            self.do_reset_stats(instance)
+
+    def stats(self):
+        """
+        Render counters accumulated by all native instances while stats were enabled.
+
+        :return: Dict with notes, program_changes, resets, nuggets (control updates),
+            samples_rendered, samples_skipped (left silent after every voice died),
+            render_seconds (voice loop), control_seconds (LFO and control updates), and the
+            (32,) arrays algorithm_samples and algorithm_seconds, indexed by algorithm - 1.
+        """
+        stats = empty_stats()
+        for instance in self.instances:
+            add_stats(stats, self.do_get_stats(instance).contents)
+        return stats
+
+    @contextlib.contextmanager
+    def profile(self):
+        """
+        Measure the renders done inside a with block:
+
+            with synth.profile() as stats:
+                synth.render_batch(...)
+
+        On exit, stats holds the counters of those renders only (see stats()).
+        """
+        enabled = self.stats_enabled
+        self.enable_stats()
+        before = stats_to_vector(self.stats())
+        stats = {}
+        try:
+            yield stats
+        finally:
+            stats.update(stats_from_vector(stats_to_vector(self.stats()) - before))
+            self.enable_stats(enabled)
+
     def pack_patch(self, in_patch):
-        packed = np.zeros(128, dtype=np.uint8)
-        unpacked = np.zeros(155, dtype=np.uint8)
-        unpacked[0:145] = in_patch
-        packed_pointer = packed.ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte))
-        unpacked_pointer = unpacked.ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte))
-        self.do_patch_pack(unpacked_pointer, packed_pointer, 0)
-        return packed
-
-    def synthesize(self, patches, notes, velocities, nsamples_noteon, nsamples_noteoff):
+        return pack_patches(np.asarray(in_patch)[0:DX7_VOICE_PARAMETERS])
+
+    def _prepare_jobs(self, patches, notes, velocities):
+        patches = np.ascontiguousarray(patches, dtype=np.uint8)
+        if patches.ndim != 2 or patches.shape[1] != DX7_VOICE_SIZE_PACKED:
+            raise ValueError(f"ERROR: Patches shape {patches.shape} is unexpected!")
+        notes, velocities = self._prepare_notes(notes, velocities, patches.shape[0])
+        return patches, notes, velocities
+
+    def _prepare_notes(self, notes, velocities, ninstances):
         notes = np.asarray(notes)
         velocities = np.asarray(velocities)
-        ninstances = patches.shape[0]
-
         if notes.size not in (1, ninstances):
             raise ValueError(f"ERROR: Notes shape {notes.size} is unexpected!")
         if velocities.size not in (1, ninstances):
             raise ValueError("ERROR: Velocity shape is unexpected!")
 
-        nsamples = nsamples_noteon + nsamples_noteoff
-        self.patch_buffer[0:ninstances, :] = patches
-
-        x = np.zeros((ninstances, nsamples), dtype=np.float32)
-        if notes.size == 1:
-            notes = np.tile(notes, ninstances)
-        if velocities.size == 1:
-            velocities = np.tile(velocities, ninstances)
+        notes = np.ascontiguousarray(np.broadcast_to(notes.reshape(-1), ninstances), dtype=np.uint8)
+        velocities = np.ascontiguousarray(np.broadcast_to(velocities.reshape(-1), ninstances), dtype=np.uint8)
+        return notes, velocities
 
-        for i in range(ninstances):
-            self.reset_synth()
-            self.program_change(i)
-            self.note_on(notes[i], velocities[i])
-            self.run_synth(x[i, :], 0, nsamples_noteon)
-            self.note_off(notes[i], velocities[i])
-            self.run_synth(x[i, :], nsamples_noteon, nsamples)
+    def _prepare_out(self, out, ninstances, nsamples):
+        # Returns the (N, nsamples) array the native core writes to, and what the caller gets back.
+        if out is None:
+            out = np.empty((ninstances, nsamples), dtype=np.float32)
+            return out, out
+        return output_array(out, ninstances, nsamples), out
 
-        return x
+    def render_batch(self, patches, notes, velocities, nsamples_noteon, nsamples_noteoff, out=None,
+                     return_length=False, silence_threshold=0.0, decoded=None):
+        """
+        Render one note per patch in a single native call.
+        Rendering of a note stops as soon as its voice is dead; the rest of it is left silent.
+
+        :param patches: (N, 128) array of packed patches.
+        :param notes: MIDI note per patch, or a single note for all of them.
+        :param velocities: MIDI velocity per patch, or a single velocity for all of them.
+        :param nsamples_noteon: Number of samples to render before note off.
+        :param nsamples_noteoff: Number of samples to render after note off.
+        :param out: Optional preallocated output, see output_array(). It may be a (pinned) torch.Tensor.
+        :param return_length: Also return the length of every note, see note_lengths().
+        :param silence_threshold: Magnitude at or below which samples count as silent for return_length.
+        :param decoded: Optional (N, 148) decode_patches() of the patches. Notes start from them instead of
+            unpacking and decoding every patch again; the audio is the same.
+        :return: out (or a new (N, nsamples) float32 array) with the rendered audio, and the (N,) int64 array
+            of note lengths if return_length is set.
+        """
+        patches, notes, velocities = self._prepare_jobs(patches, notes, velocities)
+        if decoded is not None:
+            decoded = np.ascontiguousarray(decoded, dtype=np.uint8)
+            if decoded.shape != (patches.shape[0], DX7_VOICE_SIZE_DECODED):
+                raise ValueError(f"ERROR: Decoded patches shape {decoded.shape} is unexpected!")
+        ninstances = patches.shape[0]
+        nsamples = nsamples_noteon + nsamples_noteoff
+        out, result = self._prepare_out(out, ninstances, nsamples)
+        lengths = np.zeros(ninstances, dtype=np.int64)
+
+        if self.render_cache is None:
+            self._render_jobs(patches, decoded, notes, velocities, nsamples_noteon, nsamples_noteoff, out,
+                              lengths, silence_threshold)
+            return (result, lengths) if return_length else result
+
+        keys = [render_key(patches[i], notes[i], velocities[i], nsamples_noteon, nsamples_noteoff,
+                           self.sampling_frequency)
+                for i in range(ninstances)]
+        hit = []
+        missed = []
+        for i, key in enumerate(keys):
+            audio = self.render_cache.get(key)
+            if audio is None:
+                missed.append(i)
+            else:
+                out[i] = audio
+                hit.append(i)
+        if missed:
+            missed = np.asarray(missed)
+            rendered = np.empty((missed.size, nsamples), dtype=np.float32)
+            rendered_lengths = np.zeros(missed.size, dtype=np.int64)
+            self._render_jobs(patches[missed], None if decoded is None else decoded[missed],
+                              notes[missed], velocities[missed],
+                              nsamples_noteon, nsamples_noteoff, rendered,
+                              rendered_lengths, silence_threshold)
+            out[missed] = rendered
+            lengths[missed] = rendered_lengths
+            for i, audio in zip(missed, rendered):
+                self.render_cache.put(keys[i], audio)
+        if return_length and hit:
+            lengths[hit] = note_lengths(out[hit], silence_threshold)
+        return (result, lengths) if return_length else result
+
+    def render_unpacked(self, parameters, notes, velocities, nsamples_noteon, nsamples_noteoff, out=None,
+                        return_length=False, silence_threshold=0.0):
+        """
+        Render one note per unpacked parameter vector, without packing them first.
+        Parameters are rounded and clamped to their valid range by the native core.
+
+        :param parameters: (N, 145) or (N, 155) array of parameters, as DXDataset returns them
+            in 'patch' (and 'name'). Any numeric dtype; floats are rounded to the nearest integer.
+        :param notes: MIDI note per patch, or a single note for all of them.
+        :param velocities: MIDI velocity per patch, or a single velocity for all of them.
+        :param nsamples_noteon: Number of samples to render before note off.
+        :param nsamples_noteoff: Number of samples to render after note off.
+        :param out: Optional preallocated output, see output_array(). It may be a (pinned) torch.Tensor.
+        :param return_length: Also return the length of every note, see note_lengths().
+        :param silence_threshold: Magnitude at or below which samples count as silent for return_length.
+        :return: out (or a new (N, nsamples) float32 array) with the rendered audio, and the (N,) int64 array
+            of note lengths if return_length is set.
+        """
+        parameters = np.ascontiguousarray(parameters, dtype=np.float32)
+        if parameters.ndim != 2 or parameters.shape[1] not in (DX7_VOICE_PARAMETERS, DX7_VOICE_SIZE_UNPACKED):
+            raise ValueError(f"ERROR: Parameters shape {parameters.shape} is unexpected!")
+        ninstances, nparameters = parameters.shape
+        notes, velocities = self._prepare_notes(notes, velocities, ninstances)
+        out, result = self._prepare_out(out, ninstances, nsamples_noteon + nsamples_noteoff)
+        native_lengths = np.zeros(ninstances, dtype=ctypes.c_ulong)
+
+        def render_shard(shard, start, end):
+            self.do_render_batch_unpacked(self.instances[shard * self.lanes],
+                                          parameters[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_float)),
+                                          nparameters,
+                                          notes[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)),
+                                          velocities[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)),
+                                          nsamples_noteon, nsamples_noteoff,
+                                          out[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_float)),
+                                          end - start,
+                                          native_lengths[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_ulong)),
+                                          silence_threshold)
+
+        self._run_shards(render_shard, ninstances)
+        return (result, native_lengths.astype(np.int64)) if return_length else result
+
+    def _render_jobs(self, patches, decoded, notes, velocities, nsamples_noteon, nsamples_noteoff, out,
+                     lengths, silence_threshold):
+        # Jobs and output buffer are already validated by render_batch. With decoded patches, the
+        # decoded variants of the native calls take them in place of the packed ones.
+        native_lengths = np.zeros(patches.shape[0], dtype=ctypes.c_ulong)
+        if decoded is None:
+            jobs, render_batch, render_batch_lanes = patches, self.do_render_batch, self.do_render_batch_lanes
+        else:
+            jobs, render_batch, render_batch_lanes = (decoded, self.do_render_batch_decoded,
+                                                      self.do_render_batch_lanes_decoded)
+
+        def render_shard(shard, start, end):
+            if self.lanes > 1:
+                render_batch_lanes(self.lane_instances[shard], self.lanes,
+                                   jobs[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)),
+                                   notes[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)),
+                                   velocities[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)),
+                                   nsamples_noteon, nsamples_noteoff,
+                                   out[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_float)),
+                                   end - start,
+                                   native_lengths[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_ulong)),
+                                   silence_threshold)
+                return
+            render_batch(self.instances[shard * self.lanes],
+                         jobs[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)),
+                         notes[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)),
+                         velocities[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)),
+                         nsamples_noteon, nsamples_noteoff,
+                         out[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_float)),
+                         end - start,
+                         native_lengths[start:end].ctypes.data_as(ctypes.POINTER(ctypes.c_ulong)),
+                         silence_threshold)
+
+        self._run_shards(render_shard, patches.shape[0])
+        lengths[:] = native_lengths
+
+    def _run_shards(self, render_shard, ninstances):
+        # Split jobs [0, ninstances) across the threads; render_shard gets the thread index.
+        # ctypes releases the GIL for the duration of the native call.
+        nshards = min(self.num_threads, ninstances)
+        if nshards <= 1:
+            render_shard(0, 0, ninstances)
+            return
+
+        if self.pool is None:
+            # Imported here: most processes never render in threads.
+            from concurrent.futures import ThreadPoolExecutor
+            self.pool = ThreadPoolExecutor(max_workers=self.num_threads)
+        bounds = np.linspace(0, ninstances, nshards + 1).astype(int)
+        shards = [self.pool.submit(render_shard, k, bounds[k], bounds[k + 1])
+                  for k in range(nshards)]
+        for shard in shards:
+            shard.result()
+
+    def stream(self, patches, notes, velocities, nsamples_noteon, nsamples_noteoff, block_size=STREAM_BLOCK_SIZE,
+               out=None, decoded=None):
+        """
+        Render notes block by block, so memory stays bounded however long they are (e.g. to compute
+        features over very long sustains, or to feed a real-time consumer):
+
+            for block in synth.stream(patches, 60, 100, 10 * 48000, 48000, block_size=1024):
+                ...
+
+        Put together, the blocks are the same audio as render_batch. Streams create no native
+        instances: between blocks, the state of every note is kept in a buffer of the stream
+        (hexter_stream_state_size() bytes per note), and the first instance of each thread renders
+        the notes of its share one after the other. Streams of one synth can be interleaved, but
+        not advanced from several threads at once, nor while render_batch runs. The render cache
+        and lanes are not used.
+
+        :param patches: (N, 128) array of packed patches, or a single (128,) patch (then N is 1).
+        :param notes: MIDI note per patch, or a single note for all of them.
+        :param velocities: MIDI velocity per patch, or a single velocity for all of them.
+        :param nsamples_noteon: Number of samples to render before note off.
+        :param nsamples_noteoff: Number of samples to render after note off.
+        :param block_size: Samples per block, a multiple of 64 (the control period of the native core).
+            The last block holds the remaining samples.
+        :param out: Optional (N, block_size) buffer, see output_array(). Every block is rendered into it
+            and it is yielded again (sliced to the samples of a shorter last block) instead of a new
+            array per block, so each block must be consumed before the next one is requested.
+        :param decoded: Optional (N, 148) decode_patches() of the patches, see render_batch.
+        :return: Generator of (N, block_size) float32 arrays, or of out.
+        """
+        if block_size <= 0 or block_size % HEXTER_NUGGET_SIZE != 0:
+            raise ValueError(f"ERROR: block_size must be a positive multiple of {HEXTER_NUGGET_SIZE}, got {block_size}.")
+        patches = np.asarray(patches)
+        if patches.ndim == 1:
+            patches = patches.reshape((1, -1))
+        patches, notes, velocities = self._prepare_jobs(patches, notes, velocities)
+        ninstances = patches.shape[0]
+        if decoded is not None:
+            decoded = np.ascontiguousarray(decoded, dtype=np.uint8)
+            if decoded.shape != (ninstances, DX7_VOICE_SIZE_DECODED):
+                raise ValueError(f"ERROR: Decoded patches shape {decoded.shape} is unexpected!")
+        array = None
+        if out is not None:
+            array = output_array(out, ninstances, block_size)
+        # Checked here, not on the first block: the blocks are rendered by a generator.
+        return self._stream_blocks(patches, decoded, notes, velocities, nsamples_noteon,
+                                   nsamples_noteon + nsamples_noteoff, block_size, array, out)
+
+    def _stream_blocks(self, patches, decoded, notes, velocities, nsamples_noteon, nsamples, block_size,
+                       array, out):
+        ninstances = patches.shape[0]
+        states = np.empty((ninstances, self.lib.hexter_stream_state_size()), dtype=np.uint8)
+
+        def start_shard(shard, first, last):
+            self.do_stream_start(self.instances[shard * self.lanes], last - first,
+                                 patches[first:last].ctypes.data_as(_BYTES),
+                                 None if decoded is None else decoded[first:last].ctypes.data_as(_BYTES),
+                                 notes[first:last].ctypes.data_as(_BYTES),
+                                 velocities[first:last].ctypes.data_as(_BYTES),
+                                 states[first:last].ctypes.data_as(_BYTES))
+
+        self._run_shards(start_shard, ninstances)
+        for start in range(0, nsamples, block_size):
+            end = min(start + block_size, nsamples)
+            # A shorter last block is rendered apart and copied to the front of out.
+            full = end - start == block_size
+            block = array if array is not None and full else np.empty((ninstances, end - start), dtype=np.float32)
+
+            def render_shard(shard, first, last):
+                self.do_stream_render(self.instances[shard * self.lanes], last - first,
+                                      notes[first:last].ctypes.data_as(_BYTES),
+                                      velocities[first:last].ctypes.data_as(_BYTES),
+                                      nsamples_noteon, start, end,
+                                      block[first:last].ctypes.data_as(_FLOATS),
+                                      states[first:last].ctypes.data_as(_BYTES))
+
+            self._run_shards(render_shard, ninstances)
+            if array is None:
+                yield block
+            elif full:
+                yield out
+            else:
+                array[:, 0:end - start] = block
+                yield out[..., 0:end - start]
+
+    def render_timeline(self, patches, events, nsamples, polyphony=HEXTER_MAX_POLYPHONY, out=None):
+        """
+        Play timelines of MIDI events, each on one patch with up to polyphony voices, in one native call
+        (split across the threads), e.g. to render phrases or chords instead of mixing single notes:
+
+            events = timeline_events([0, 4000, 8000, 16000], EVENT_NOTE_ON, note=[60, 64, 67, 72], velocity=100)
+            audio = synth.render_timeline(patch, events, 32000, polyphony=4)
+
+        Every timeline starts from a reset synth with its controllers at rest. Notes still sounding at
+        the last sample are cut. A note played past the polyphony steals a voice, as on the DX7 (which
+        has 16). The render cache and lanes are not used.
+
+        :param patches: (N, 128) array of packed patches, or a single (128,) patch (then N is 1).
+        :param events: List of N sorted TIMELINE_EVENT arrays (see timeline_events), or a single one
+            shared by every timeline. Events at or past nsamples are ignored.
+        :param nsamples: Number of samples per timeline.
+        :param polyphony: Most voices sounding at once, from 1 to HEXTER_MAX_POLYPHONY.
+        :param out: Optional preallocated output, see output_array().
+        :return: (N, nsamples) float32 array, or out.
+        """
+        patches = np.asarray(patches)
+        if patches.ndim == 1:
+            patches = patches.reshape((1, -1))
+        patches = np.ascontiguousarray(patches, dtype=np.uint8)
+        if patches.ndim != 2 or patches.shape[1] != DX7_VOICE_SIZE_PACKED:
+            raise ValueError(f"ERROR: Patches shape {patches.shape} is unexpected!")
+        ninstances = patches.shape[0]
+        if not 1 <= polyphony <= HEXTER_MAX_POLYPHONY:
+            raise ValueError(f"ERROR: polyphony must be between 1 and {HEXTER_MAX_POLYPHONY}, got {polyphony}.")
+        if isinstance(events, np.ndarray):
+            events = [events] * ninstances
+        if len(events) != ninstances:
+            raise ValueError(f"ERROR: Got {len(events)} timelines of events for {ninstances} patches.")
+        for timeline in events:
+            if timeline.dtype != TIMELINE_EVENT or timeline.ndim != 1:
+                raise ValueError(f"ERROR: Events must be 1-D TIMELINE_EVENT arrays, got {timeline.dtype}.")
+            if np.any(np.diff(timeline['offset'].astype(np.int64)) < 0):
+                raise ValueError("ERROR: Events must be sorted by offset.")
+        bounds = np.zeros(ninstances + 1, dtype=ctypes.c_ulong)
+        bounds[1:] = np.cumsum([timeline.size for timeline in events])
+        flat = np.ascontiguousarray(np.concatenate(events) if events else np.empty(0, dtype=TIMELINE_EVENT))
+        array, result = self._prepare_out(out, ninstances, nsamples)
+
+        def render_shard(shard, first, last):
+            self.do_render_timelines(self.instances[shard * self.lanes], patches[first:last].ctypes.data_as(_BYTES),
+                                     flat.ctypes.data, bounds[first:].ctypes.data_as(_LENGTHS), last - first,
+                                     polyphony, nsamples, array[first:last].ctypes.data_as(_FLOATS))
+
+        self._run_shards(render_shard, ninstances)
+        return result
+
+    def synthesize(self, patches, notes, velocities, nsamples_noteon, nsamples_noteoff, out=None):
+        return self.render_batch(patches, notes, velocities, nsamples_noteon, nsamples_noteoff, out=out)
+
+    def __getstate__(self):
+        # Native instances cannot cross processes: a synth sent to another process
+        # (e.g. a spawned DataLoader worker) creates its own.
+        return {'sampling_frequency': self.sampling_frequency, 'num_threads': self.num_threads,
+                'render_cache': self.render_cache, 'lanes': self.lanes,
+                'stats_enabled': self.stats_enabled}
+
+    def __setstate__(self, state):
+        self.__init__(state['sampling_frequency'], state['num_threads'], state['render_cache'], state['lanes'])
+        if state['stats_enabled']:
+            self.enable_stats()
 
     def __del__(self):
-        self.lib.hexter_clean_and_exit(self.instance)
+        if getattr(self, 'pid', None) != os.getpid():
+            return
+        if self.pool is not None:
+            self.pool.shutdown()
+        for instance in self.instances:
+            self.lib.hexter_clean_and_exit(instance)
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import struct
+from collections import OrderedDict
+
+import numpy as np
+
+# Bytes used in the shared table to identify the job stored in a slot.
+SHARED_DIGEST_SIZE = 16
+
+
+def render_key(patch, note, velocity, nsamples_noteon, nsamples_noteoff, sampling_frequency):
+    """
+    Build the cache key of one rendered note.
+
+    :param patch: Packed 128-byte patch.
+    :param note: MIDI note.
+    :param velocity: MIDI velocity.
+    :param nsamples_noteon: Number of samples rendered before note off.
+    :param nsamples_noteoff: Number of samples rendered after note off.
+    :param sampling_frequency: Sample rate of the synth, so synths at other rates can share a cache.
+    :return: Key as bytes.
+    """
+    return (np.ascontiguousarray(patch, dtype=np.uint8).tobytes()
+            + struct.pack('<BBQQQ', int(note), int(velocity), int(nsamples_noteon), int(nsamples_noteoff),
+                          int(sampling_frequency)))
+
+
+class RenderCache:
+    """
+    Size-bounded cache of rendered notes, keyed by render_key().
+
+    By default every process holds its own least-recently-used cache: a DataLoader
+    worker that inherits a cache starts from an empty one with zeroed counters.
+    With shared=True, entries live in a shared-memory table that all workers forked
+    (or spawned) from the creating process read and fill. That table is direct-mapped:
+    a new entry replaces whatever job hashed to the same slot.
+    """
+
+    def __init__(self, max_bytes, shared=False, nsamples=None):
+        """
+        :param max_bytes: Memory budget for cached audio, in bytes.
+        :param shared: Back the cache with shared memory instead of a per-process dict.
+        :param nsamples: Samples per rendered note. Required when shared, as slots have a fixed size.
+        """
+        if max_bytes <= 0:
+            raise ValueError(f"ERROR: max_bytes must be positive, got {max_bytes}.")
+        self.max_bytes = int(max_bytes)
+        self.shared = shared
+        self.nsamples = nsamples
+
+        self.shm = None
+        if shared:
+            if nsamples is None:
+                raise ValueError("ERROR: A shared RenderCache needs nsamples.")
+            slot_bytes = SHARED_DIGEST_SIZE + 4 * nsamples
+            self.nslots = self.max_bytes // slot_bytes
+            if self.nslots < 1:
+                raise ValueError(f"ERROR: max_bytes {max_bytes} does not fit a single {nsamples}-sample note.")
+            # Imported here: multiprocessing is slow to import and only shared caches need it.
+            import multiprocessing
+            from multiprocessing import shared_memory
+            self.shm = shared_memory.SharedMemory(create=True, size=self.nslots * slot_bytes)
+            self.owner_pid = os.getpid()
+            self.lock = multiprocessing.Lock()
+            self._map_shared()
+            self.digests[:] = 0
+
+        self._reset_local()
+
+    def _map_shared(self):
+        digest_bytes = self.nslots * SHARED_DIGEST_SIZE
+        self.digests = np.ndarray((self.nslots, SHARED_DIGEST_SIZE), dtype=np.uint8,
+                                  buffer=self.shm.buf[:digest_bytes])
+        self.audio = np.ndarray((self.nslots, self.nsamples), dtype=np.float32,
+                                buffer=self.shm.buf[digest_bytes:])
+
+    def _reset_local(self):
+        self.pid = os.getpid()
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _check_process(self):
+        # A forked worker inherits the parent's dict and counters: start afresh.
+        if self.pid != os.getpid():
+            self._reset_local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('entries', 'digests', 'audio'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.pid = None
+        self._check_process()
+        if self.shm is not None:
+            self._map_shared()
+
+    def _slot(self, key):
+        digest = hashlib.blake2b(key, digest_size=SHARED_DIGEST_SIZE).digest()
+        return int.from_bytes(digest[0:8], 'little') % self.nslots, np.frombuffer(digest, dtype=np.uint8)
+
+    def get(self, key):
+        """
+        Look up a rendered note.
+
+        :param key: Key from render_key().
+        :return: 1-D float32 array with the audio, or None. Do not modify it in place.
+        """
+        self._check_process()
+        if self.shared:
+            slot, digest = self._slot(key)
+            with self.lock:
+                if np.array_equal(self.digests[slot], digest):
+                    audio = self.audio[slot].copy()
+                else:
+                    audio = None
+        else:
+            audio = self.entries.get(key)
+            if audio is not None:
+                self.entries.move_to_end(key)
+
+        if audio is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return audio
+
+    def put(self, key, audio):
+        """
+        Store a rendered note, evicting least recently used ones to stay within the budget.
+
+        :param key: Key from render_key().
+        :param audio: 1-D float32 array with the audio.
+        """
+        self._check_process()
+        if self.shared:
+            if audio.shape != (self.nsamples,):
+                raise ValueError(f"ERROR: Shared RenderCache holds {self.nsamples}-sample notes, got {audio.shape}.")
+            slot, digest = self._slot(key)
+            with self.lock:
+                self.audio[slot] = audio
+                self.digests[slot] = digest
+            return
+
+        entry_bytes = audio.nbytes + len(key)
+        if entry_bytes > self.max_bytes:
+            return
+        if key in self.entries:
+            return
+        self.entries[key] = np.array(audio, dtype=np.float32)
+        self.nbytes += entry_bytes
+        while self.nbytes > self.max_bytes:
+            old_key, old_audio = self.entries.popitem(last=False)
+            self.nbytes -= old_audio.nbytes + len(old_key)
+
+    def clear(self):
+        """Drop every entry and zero the counters of this process."""
+        self._reset_local()
+        if self.shared:
+            with self.lock:
+                self.digests[:] = 0
+
+    def stats(self):
+        """
+        :return: Dict with hits, misses, entries and bytes held by this process.
+        """
+        self._check_process()
+        if self.shared:
+            with self.lock:
+                entries = int(np.count_nonzero(self.digests.any(axis=1)))
+            nbytes = self.shm.size
+        else:
+            entries = len(self.entries)
+            nbytes = self.nbytes
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': nbytes}
+
+    def __del__(self):
+        shm = getattr(self, 'shm', None)
+        if shm is not None:
+            self.digests = None
+            self.audio = None
+            shm.close()
+            if self.owner_pid == os.getpid():
+                shm.unlink()
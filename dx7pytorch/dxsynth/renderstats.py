@@ -0,0 +1,141 @@
+import ctypes
+import os
+import warnings
+
+import numpy as np
+
+# Number of algorithms the native counters are broken down by.
+STATS_ALGORITHMS = 32
+
+
+class HexterStats(ctypes.Structure):
+    """Render counters of one native instance. Mirrors hexter_stats_t in hexter_synth.h."""
+    _fields_ = [('notes', ctypes.c_uint64),
+                ('program_changes', ctypes.c_uint64),
+                ('resets', ctypes.c_uint64),
+                ('nuggets', ctypes.c_uint64),
+                ('samples_rendered', ctypes.c_uint64),
+                ('samples_skipped', ctypes.c_uint64),
+                ('render_seconds', ctypes.c_double),
+                ('control_seconds', ctypes.c_double),
+                ('algorithm_samples', ctypes.c_uint64 * STATS_ALGORITHMS),
+                ('algorithm_seconds', ctypes.c_double * STATS_ALGORITHMS)]
+
+
+# Scalar counters, in the order they are stored in a stats vector.
+STATS_COUNTERS = [name for name, _ in HexterStats._fields_[0:8]]
+STATS_VECTOR_SIZE = len(STATS_COUNTERS) + 2 * STATS_ALGORITHMS
+
+
+def empty_stats():
+    """
+    :return: Stats dict with every counter at zero.
+    """
+    return stats_from_vector(np.zeros(STATS_VECTOR_SIZE))
+
+
+def add_stats(stats, native):
+    """
+    Add the counters of a HexterStats to a stats dict, in place.
+
+    :param stats: Stats dict, as returned by empty_stats().
+    :param native: HexterStats of one instance.
+    """
+    for name in STATS_COUNTERS:
+        stats[name] += getattr(native, name)
+    stats['algorithm_samples'] += np.ctypeslib.as_array(native.algorithm_samples).astype(np.int64)
+    stats['algorithm_seconds'] += np.ctypeslib.as_array(native.algorithm_seconds)
+
+
+def stats_to_vector(stats):
+    """
+    :param stats: Stats dict.
+    :return: float64 vector of STATS_VECTOR_SIZE values holding the same counters.
+    """
+    return np.concatenate([[stats[name] for name in STATS_COUNTERS],
+                           stats['algorithm_samples'], stats['algorithm_seconds']]).astype(np.float64)
+
+
+def stats_from_vector(vector):
+    """
+    :param vector: Vector from stats_to_vector().
+    :return: Stats dict. Counts are ints (int64 arrays per algorithm), times are seconds.
+    """
+    n = len(STATS_COUNTERS)
+    stats = {name: (float(value) if name.endswith('_seconds') else int(value))
+             for name, value in zip(STATS_COUNTERS, vector[0:n])}
+    stats['algorithm_samples'] = np.asarray(vector[n:n + STATS_ALGORITHMS]).astype(np.int64)
+    stats['algorithm_seconds'] = np.array(vector[n + STATS_ALGORITHMS:n + 2 * STATS_ALGORITHMS], dtype=np.float64)
+    return stats
+
+
+class SharedStats:
+    """
+    Table of render stats in shared memory, one slot per process.
+
+    Every DataLoader worker (forked or spawned from the creating process) adds what its
+    synthesizer rendered since it last published to its own slot; the creating process reads
+    all of them. Slot 0 is the main process, slot k + 1 is worker k. Slots accumulate, so
+    workers created again every epoch (with counters starting from zero) add to the counts
+    of the workers they replace.
+    """
+
+    def __init__(self, nslots=65):
+        """
+        :param nslots: Number of slots: one for the main process plus one per worker.
+        """
+        if nslots < 1:
+            raise ValueError(f"ERROR: nslots must be at least 1, got {nslots}.")
+        # Imported here: multiprocessing is slow to import and plain DXSynth stats do not need it.
+        import multiprocessing
+        from multiprocessing import shared_memory
+        self.nslots = nslots
+        self.shm = shared_memory.SharedMemory(create=True, size=nslots * STATS_VECTOR_SIZE * 8)
+        self.owner_pid = os.getpid()
+        self.lock = multiprocessing.Lock()
+        self._map()
+        self.table[:] = 0.0
+
+    def _map(self):
+        self.table = np.ndarray((self.nslots, STATS_VECTOR_SIZE), dtype=np.float64, buffer=self.shm.buf)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('table', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+
+    def add(self, slot, vector):
+        """
+        Add counters to a slot. Slots beyond the table are dropped with a warning rather than
+        failing the worker that renders.
+
+        :param slot: 0 for the main process, worker id + 1 for DataLoader workers.
+        :param vector: Counters to add, as returned by stats_to_vector().
+        :return: Whether the counters were added.
+        """
+        if not 0 <= slot < self.nslots:
+            warnings.warn(f"Render stats slot {slot} is out of range for {self.nslots} slots; "
+                          f"the stats of that process are not recorded.", RuntimeWarning)
+            return False
+        with self.lock:
+            self.table[slot] += vector
+        return True
+
+    def read(self):
+        """
+        :return: (nslots, STATS_VECTOR_SIZE) copy of the table.
+        """
+        with self.lock:
+            return self.table.copy()
+
+    def __del__(self):
+        shm = getattr(self, 'shm', None)
+        if shm is not None:
+            self.table = None
+            shm.close()
+            if self.owner_pid == os.getpid():
+                shm.unlink()
@@ -34,6 +34,7 @@
 #include <stdio.h>
 #include <string.h>
 #include <math.h>
+#include <pthread.h>
 
 #include "hexter_types.h"
 #include "hexter_synth.h"
@@ -48,7 +49,7 @@ dx7_voice_new(void)
 {
     dx7_voice_t *voice;
 
-    voice = (dx7_voice_t *)malloc(sizeof(dx7_voice_t));
+    voice = (dx7_voice_t *)calloc(1, sizeof(dx7_voice_t));
     if (voice) {
         voice->status = DX7_VOICE_OFF;
     }
@@ -606,18 +607,84 @@ dx7_op_envelope_prepare(hexter_instance_t *instance, dx7_op_t *op,
     dx7_op_eg_set_phase(instance, &op->eg, 0);
 }
 
+/*
+ * dx7_rate_tables_get
+ *
+ * dx7pytorch: return the sample-rate dependent constants for sample_rate,
+ * computing them the first time that rate is seen. Instances may be created
+ * from several threads at once (ctypes releases the GIL), so the lookup and
+ * the insert both run under rate_tables_lock. Entries are never freed.
+ */
+static dx7_rate_tables_t *rate_tables = NULL;
+static pthread_mutex_t rate_tables_lock = PTHREAD_MUTEX_INITIALIZER;
+
+const dx7_rate_tables_t *
+dx7_rate_tables_get(float sample_rate)
+{
+    dx7_rate_tables_t *tables;
+    float duration;
+    int i;
+
+    pthread_mutex_lock(&rate_tables_lock);
+
+    for (tables = rate_tables; tables; tables = tables->next) {
+        if (tables->sample_rate == sample_rate) {
+            pthread_mutex_unlock(&rate_tables_lock);
+            return tables;
+        }
+    }
+
+    tables = (dx7_rate_tables_t *)malloc(sizeof(dx7_rate_tables_t));
+    if (!tables) {
+        pthread_mutex_unlock(&rate_tables_lock);
+        return NULL;
+    }
+
+    tables->sample_rate = sample_rate;
+
+    duration = dx7_voice_eg_rate_rise_duration[99] *
+               (dx7_voice_eg_rate_rise_percent[99] -
+                dx7_voice_eg_rate_rise_percent[0]);
+    tables->eg_max_slew = FLOAT_TO_FP(99.0f / (duration * sample_rate));
+
+    tables->nugget_rate = sample_rate / (float)HEXTER_NUGGET_SIZE;
+
+    tables->ramp_duration = lrintf(sample_rate * 0.006f);  /* 6ms ramp */
+
+    for (i = 0; i < 128; i++) {
+        tables->lfo_period[i] = lrintf(sample_rate / dx7_voice_lfo_frequency[i]);
+    }
+
+    for (i = 0; i < 100; i++) {
+        /* -FIX- Jamie's early approximation, replace when he has more data */
+        tables->lfo_delay_duration[0][i] =
+            lrintf(sample_rate *
+                   (0.00175338f * pow((float)i, 3.10454f) + 169.344f - 168.0f) /
+                   1000.0f);
+        tables->lfo_delay_duration[1][i] =
+            lrintf(sample_rate *
+                   (0.321877f * pow((float)i, 2.01163) + 494.201f - 168.0f) /
+                   1000.0f);
+    }
+
+    tables->next = rate_tables;
+    rate_tables = tables;
+
+    pthread_mutex_unlock(&rate_tables_lock);
+
+    return tables;
+}
+
 void
 dx7_eg_init_constants(hexter_instance_t *instance)
 {
-    float duration = dx7_voice_eg_rate_rise_duration[99] *
-                     (dx7_voice_eg_rate_rise_percent[99] -
-                      dx7_voice_eg_rate_rise_percent[0]);
+    const dx7_rate_tables_t *tables = instance->rate_tables;
 
-    instance->dx7_eg_max_slew = FLOAT_TO_FP(99.0f / (duration * instance->sample_rate));
+    instance->dx7_eg_max_slew = tables->eg_max_slew;
 
-    instance->nugget_rate = instance->sample_rate / (float)HEXTER_NUGGET_SIZE;
+    instance->nugget_rate = tables->nugget_rate;
 
-    instance->ramp_duration = lrintf(instance->sample_rate * 0.006f);  /* 6ms ramp */
+    instance->ramp_duration = tables->ramp_duration;
 }
 
 /* ===== pitch envelope functions ===== */
@@ -892,8 +959,7 @@ dx7_voice_recalculate_volume(hexter_instance_t *instance, dx7_voice_t *voice)
 static inline void
 dx7_lfo_set_speed(hexter_instance_t *instance)
 {
-    int32_t period = lrintf(instance->sample_rate /
-                            dx7_voice_lfo_frequency[instance->lfo_speed]);
+    int32_t period = instance->rate_tables->lfo_period[instance->lfo_speed];
 
     switch (instance->lfo_wave) {
       default:
@@ -962,7 +1028,7 @@ dx7_lfo_set_speed(hexter_instance_t *instance)
         break;
       case 5:  /* sample/hold */
         instance->lfo_phase = 0;
-        instance->lfo_value = FP_RAND();
+        instance->lfo_value = FP_RAND(&instance->rand_state);
         if (period >= (instance->ramp_duration * 4)) {
             instance->lfo_duration0 = period - instance->ramp_duration;
             instance->lfo_duration1 = instance->ramp_duration;
@@ -994,6 +1060,7 @@ dx7_lfo_reset(hexter_instance_t *instance)
     instance->lfo_wave = 1;
     instance->lfo_delay = 255;  /* force setup at first note on */
     instance->lfo_value_for_pitch = 0.0;
+    instance->lfo_target = INT_TO_FP(0);  /* read by the sample/hold wave before its first hold */
     dx7_lfo_set_speed(instance);
 }
 
@@ -1016,18 +1083,12 @@ dx7_lfo_set(hexter_instance_t *instance, dx7_voice_t *voice)
         instance->lfo_delay = voice->lfo_delay;
         if (voice->lfo_delay > 0) {
             instance->lfo_delay_value[0] = INT_TO_FP(0);
-            /* -FIX- Jamie's early approximation, replace when he has more data */
             instance->lfo_delay_duration[0] =
-                lrintf(instance->sample_rate *
-                       (0.00175338f * pow((float)voice->lfo_delay, 3.10454f) + 169.344f - 168.0f) /
-                       1000.0f);
+                instance->rate_tables->lfo_delay_duration[0][voice->lfo_delay];
             instance->lfo_delay_increment[0] = INT_TO_FP(0);
             instance->lfo_delay_value[1] = INT_TO_FP(0);
-            /* -FIX- Jamie's early approximation, replace when he has more data */
             instance->lfo_delay_duration[1] =
-                lrintf(instance->sample_rate *
-                       (0.321877f * pow((float)voice->lfo_delay, 2.01163) + 494.201f - 168.0f) /
-                       1000.0f);                                                 /* time from note-on until full on */
+                instance->rate_tables->lfo_delay_duration[1][voice->lfo_delay];  /* time from note-on until full on */
             instance->lfo_delay_duration[1] -= instance->lfo_delay_duration[0];  /* now time from end-of-delay until full */
             instance->lfo_delay_increment[1] = INT_TO_FP(1) / (dx7_sample_t)instance->lfo_delay_duration[1];
             instance->lfo_delay_value[2] = INT_TO_FP(1);
@@ -1156,7 +1217,7 @@ dx7_lfo_update(hexter_instance_t *instance, unsigned long sample_count)
                 } else {
                     instance->lfo_phase = 1;
                     instance->lfo_duration = instance->lfo_duration1;
-                    instance->lfo_target = FP_RAND();
+                    instance->lfo_target = FP_RAND(&instance->rand_state);
                     instance->lfo_increment = (instance->lfo_target - instance->lfo_value) /
                                                   (dx7_sample_t)instance->lfo_duration;
                 }
@@ -1330,7 +1391,13 @@ dx7_voice_calculate_runtime_parameters(hexter_instance_t *instance, dx7_voice_t*
 void
 dx7_voice_setup_note(hexter_instance_t *instance, dx7_voice_t *voice)
 {
-    dx7_voice_set_data(instance, voice);
+    if (instance->decoded_patch) {
+        /* dx7pytorch: the patch was decoded beforehand, see hexter_load_job() */
+        dx7_voice_patch_load(instance, voice, instance->decoded_patch);
+        instance->decoded_patch = NULL;
+    } else {
+        dx7_voice_set_data(instance, voice);
+    }
     hexter_instance_set_performance_data(instance);
     dx7_lfo_set(instance, voice);
     dx7_voice_calculate_runtime_parameters(instance, voice);
@@ -1345,63 +1412,130 @@ limit(int x, int min, int max)
 }
 
 /*
- * dx7_voice_set_data
+ * dx7_voice_patch_decode
+ *
+ * dx7pytorch: decode an unpacked patch into the voice parameters it sets
  */
 void
-dx7_voice_set_data(hexter_instance_t *instance, dx7_voice_t *voice)
+dx7_voice_patch_decode(const uint8_t *edit_buffer, dx7_voice_patch_t *patch)
 {
-    uint8_t *edit_buffer = instance->current_patch_buffer;
-    int compat059 = (instance->performance_buffer[0] & 0x01);  /* 0.5.9 compatibility */
     int i, j;
     double aux_feedbk;
 
     for (i = 0; i < MAX_DX7_OPERATORS; i++) {
-        uint8_t *eb_op = edit_buffer + ((5 - i) * 21);
+        const uint8_t *eb_op = edit_buffer + ((5 - i) * 21);
 
-        voice->op[i].output_level  = limit(eb_op[16], 0, 99);
+        patch->op[i].output_level  = limit(eb_op[16], 0, 99);
 
-        voice->op[i].osc_mode      = eb_op[17] & 0x01;
-        voice->op[i].coarse        = eb_op[18] & 0x1f;
-        voice->op[i].fine          = limit(eb_op[19], 0, 99);
-        voice->op[i].detune        = limit(eb_op[20], 0, 14);
+        patch->op[i].osc_mode      = eb_op[17] & 0x01;
+        patch->op[i].coarse        = eb_op[18] & 0x1f;
+        patch->op[i].fine          = limit(eb_op[19], 0, 99);
+        patch->op[i].detune        = limit(eb_op[20], 0, 14);
 
-        voice->op[i].level_scaling_bkpoint = limit(eb_op[ 8], 0, 99);
-        voice->op[i].level_scaling_l_depth = limit(eb_op[ 9], 0, 99);
-        voice->op[i].level_scaling_r_depth = limit(eb_op[10], 0, 99);
-        voice->op[i].level_scaling_l_curve = eb_op[11] & 0x03;
-        voice->op[i].level_scaling_r_curve = eb_op[12] & 0x03;
-        voice->op[i].rate_scaling          = eb_op[13] & 0x07;
-        voice->op[i].amp_mod_sens          = (compat059 ? 0 : eb_op[14] & 0x03);
-        voice->op[i].velocity_sens         = eb_op[15] & 0x07;
+        patch->op[i].level_scaling_bkpoint = limit(eb_op[ 8], 0, 99);
+        patch->op[i].level_scaling_l_depth = limit(eb_op[ 9], 0, 99);
+        patch->op[i].level_scaling_r_depth = limit(eb_op[10], 0, 99);
+        patch->op[i].level_scaling_l_curve = eb_op[11] & 0x03;
+        patch->op[i].level_scaling_r_curve = eb_op[12] & 0x03;
+        patch->op[i].rate_scaling          = eb_op[13] & 0x07;
+        patch->op[i].amp_mod_sens          = eb_op[14] & 0x03;
+        patch->op[i].velocity_sens         = eb_op[15] & 0x07;
 
         for (j = 0; j < 4; j++) {
-            voice->op[i].eg.base_rate[j]  = limit(eb_op[j], 0, 99);
-            voice->op[i].eg.base_level[j] = limit(eb_op[4 + j], 0, 99);
+            patch->op[i].base_rate[j]  = limit(eb_op[j], 0, 99);
+            patch->op[i].base_level[j] = limit(eb_op[4 + j], 0, 99);
         }
     }
 
     for (i = 0; i < 4; i++) {
-        voice->pitch_eg.rate[i]  = limit(edit_buffer[126 + i], 0, 99);
-        voice->pitch_eg.level[i] = limit(edit_buffer[130 + i], 0, 99);
+        patch->pitch_eg_rate[i]  = limit(edit_buffer[126 + i], 0, 99);
+        patch->pitch_eg_level[i] = limit(edit_buffer[130 + i], 0, 99);
     }
 
-    voice->algorithm = edit_buffer[134] & 0x1f;
+    patch->algorithm = edit_buffer[134] & 0x1f;
 
     aux_feedbk = (double)(edit_buffer[135] & 0x07) / (2.0 * M_PI) * 0.18 /* -FIX- feedback_scaling[voice->algorithm] */;
 
     /* the "99.0" here is because we're also using this multiplier to scale the
      * eg level from 0-99 to 0-1 */
-    voice->feedback_multiplier = DOUBLE_TO_FP(aux_feedbk / 99.0);
+    patch->feedback_multiplier = DOUBLE_TO_FP(aux_feedbk / 99.0);
+
+    patch->osc_key_sync = edit_buffer[136] & 0x01;
+
+    patch->lfo_speed    = limit(edit_buffer[137], 0, 99);
+    patch->lfo_delay    = limit(edit_buffer[138], 0, 99);
+    patch->lfo_pmd      = limit(edit_buffer[139], 0, 99);
+    patch->lfo_amd      = limit(edit_buffer[140], 0, 99);
+    patch->lfo_key_sync = edit_buffer[141] & 0x01;
+    patch->lfo_wave     = limit(edit_buffer[142], 0, 5);
+    patch->lfo_pms      = edit_buffer[143] & 0x07;
+
+    patch->transpose = limit(edit_buffer[144], 0, 48);
+}
+
+/*
+ * dx7_voice_patch_load
+ *
+ * dx7pytorch: set the patch parameters of a voice from a decoded patch
+ */
+void
+dx7_voice_patch_load(hexter_instance_t *instance, dx7_voice_t *voice,
+                     const dx7_voice_patch_t *patch)
+{
+    int compat059 = (instance->performance_buffer[0] & 0x01);  /* 0.5.9 compatibility */
+    int i, j;
 
-    voice->osc_key_sync = edit_buffer[136] & 0x01;
+    for (i = 0; i < MAX_DX7_OPERATORS; i++) {
+        voice->op[i].output_level  = patch->op[i].output_level;
+
+        voice->op[i].osc_mode      = patch->op[i].osc_mode;
+        voice->op[i].coarse        = patch->op[i].coarse;
+        voice->op[i].fine          = patch->op[i].fine;
+        voice->op[i].detune        = patch->op[i].detune;
+
+        voice->op[i].level_scaling_bkpoint = patch->op[i].level_scaling_bkpoint;
+        voice->op[i].level_scaling_l_depth = patch->op[i].level_scaling_l_depth;
+        voice->op[i].level_scaling_r_depth = patch->op[i].level_scaling_r_depth;
+        voice->op[i].level_scaling_l_curve = patch->op[i].level_scaling_l_curve;
+        voice->op[i].level_scaling_r_curve = patch->op[i].level_scaling_r_curve;
+        voice->op[i].rate_scaling          = patch->op[i].rate_scaling;
+        voice->op[i].amp_mod_sens          = (compat059 ? 0 : patch->op[i].amp_mod_sens);
+        voice->op[i].velocity_sens         = patch->op[i].velocity_sens;
 
-    voice->lfo_speed    = limit(edit_buffer[137], 0, 99);
-    voice->lfo_delay    = limit(edit_buffer[138], 0, 99);
-    voice->lfo_pmd      = limit(edit_buffer[139], 0, 99);
-    voice->lfo_amd      = limit(edit_buffer[140], 0, 99);
-    voice->lfo_key_sync = edit_buffer[141] & 0x01;
-    voice->lfo_wave     = limit(edit_buffer[142], 0, 5);
-    voice->lfo_pms      = (compat059 ? 0 : edit_buffer[143] & 0x07);
+        for (j = 0; j < 4; j++) {
+            voice->op[i].eg.base_rate[j]  = patch->op[i].base_rate[j];
+            voice->op[i].eg.base_level[j] = patch->op[i].base_level[j];
+        }
+    }
+
+    for (i = 0; i < 4; i++) {
+        voice->pitch_eg.rate[i]  = patch->pitch_eg_rate[i];
+        voice->pitch_eg.level[i] = patch->pitch_eg_level[i];
+    }
+
+    voice->algorithm = patch->algorithm;
+    voice->feedback_multiplier = patch->feedback_multiplier;
+    voice->osc_key_sync = patch->osc_key_sync;
+
+    voice->lfo_speed    = patch->lfo_speed;
+    voice->lfo_delay    = patch->lfo_delay;
+    voice->lfo_pmd      = patch->lfo_pmd;
+    voice->lfo_amd      = patch->lfo_amd;
+    voice->lfo_key_sync = patch->lfo_key_sync;
+    voice->lfo_wave     = patch->lfo_wave;
+    voice->lfo_pms      = (compat059 ? 0 : patch->lfo_pms);
+
+    voice->transpose = patch->transpose;
+}
+
+/*
+ * dx7_voice_set_data
+ */
+void
+dx7_voice_set_data(hexter_instance_t *instance, dx7_voice_t *voice)
+{
+    dx7_voice_patch_t patch;
 
-    voice->transpose = limit(edit_buffer[144], 0, 48);
+    dx7_voice_patch_decode(instance->current_patch_buffer, &patch);
+    dx7_voice_patch_load(instance, voice, &patch);
 }
@@ -35,6 +35,19 @@ struct _dx7_patch_t
     uint8_t data[128];  /* dx7_patch_t is packed patch data */
 };
 
+/* Per-instance pseudo-random generator (the sample/hold LFO uses it), so
+ * instances rendering on different threads neither share nor race on the
+ * global rand() state. */
+#define DX7_RAND_MAX  0x7fffffff
+#define DX7_RAND_SEED 1
+
+static inline int32_t
+dx7_rand(uint32_t *state)
+{
+    *state = *state * 1103515245u + 12345u;
+    return (int32_t)((*state >> 1) & DX7_RAND_MAX);
+}
+
 #ifndef HEXTER_USE_FLOATING_POINT
 
 #define FP_SHIFT         24
@@ -55,7 +68,7 @@ struct _dx7_patch_t
 #define FP_MULTIPLY(a, b)     ((int32_t)(((int64_t)(a) * (int64_t)(b)) >> FP_SHIFT))
 #define FP_DIVIDE_CEIL(n, d)  (((n) + (d) - 1) / (d))
 #define FP_ABS(x)             (abs(x))
-#define FP_RAND()             (rand() & FP_MASK)
+#define FP_RAND(_s)           (dx7_rand(_s) & FP_MASK)
 
 #else /* HEXTER_USE_FLOATING_POINT */
 
@@ -69,7 +82,7 @@ struct _dx7_patch_t
 #define FP_MULTIPLY(x, y)     ((x) * (y))
 #define FP_DIVIDE_CEIL(n, d)  (lrintf((n) / (d) + 0.5f));
 #define FP_ABS(x)             (fabsf(x))
-#define FP_RAND()             ((float)rand() / (float)RAND_MAX)
+#define FP_RAND(_s)           ((float)dx7_rand(_s) / (float)DX7_RAND_MAX)
 
 #endif /* ! HEXTER_USE_FLOATING_POINT */
 
@@ -240,6 +253,75 @@ struct _dx7_voice_t
     float            volume_target;
 };
 
+/*
+ * dx7_voice_patch_t
+ *
+ * dx7pytorch: a patch decoded once into the voice parameters
+ * dx7_voice_set_data() derives from the edit buffer, already clamped, so a
+ * note can start from it without unpacking the patch again. Amplitude and
+ * pitch modulation sensitivities are kept even in 0.5.9 compatibility mode;
+ * dx7_voice_patch_load() drops them then.
+ */
+struct _dx7_voice_patch_t
+{
+    dx7_sample_t feedback_multiplier;
+
+    struct {
+        uint8_t  base_rate[4];
+        uint8_t  base_level[4];
+        uint8_t  level_scaling_bkpoint;
+        uint8_t  level_scaling_l_depth;
+        uint8_t  level_scaling_r_depth;
+        uint8_t  level_scaling_l_curve;
+        uint8_t  level_scaling_r_curve;
+        uint8_t  rate_scaling;
+        uint8_t  amp_mod_sens;
+        uint8_t  velocity_sens;
+        uint8_t  output_level;
+        uint8_t  osc_mode;
+        uint8_t  coarse;
+        uint8_t  fine;
+        uint8_t  detune;
+    } op[MAX_DX7_OPERATORS];
+
+    uint8_t      pitch_eg_rate[4];
+    uint8_t      pitch_eg_level[4];
+    uint8_t      algorithm;
+    uint8_t      osc_key_sync;
+    uint8_t      lfo_speed;
+    uint8_t      lfo_delay;
+    uint8_t      lfo_pmd;
+    uint8_t      lfo_amd;
+    uint8_t      lfo_key_sync;
+    uint8_t      lfo_wave;
+    uint8_t      lfo_pms;
+    uint8_t      transpose;
+};
+
+/* dx7pytorch: bytes per decoded patch, mirrored by DX7_VOICE_SIZE_DECODED in dxsynth.py */
+#define DX7_VOICE_SIZE_DECODED  148
+
+/*
+ * dx7_rate_tables_t
+ *
+ * dx7pytorch: sample-rate dependent constants, computed once per sample rate
+ * and shared by every instance running at that rate.
+ */
+struct _dx7_rate_tables_t
+{
+    dx7_rate_tables_t *next;
+
+    float        sample_rate;
+    dx7_sample_t eg_max_slew;                  /* max op eg increment, in units per frame */
+    float        nugget_rate;                  /* nuggets per second */
+    int32_t      ramp_duration;                /* frames per ramp for mods and volume */
+    int32_t      lfo_period[128];              /* LFO period in frames, by LFO speed */
+    int32_t      lfo_delay_duration[2][100];   /* frames from note-on to end of LFO delay, and to full depth, by LFO delay */
+};
+
+/* dx7pytorch: number of voices dx7_voice_render_lanes() renders side by side */
+#define DX7_VOICE_LANES    8
+
 #define _PLAYING(voice)    ((voice)->status != DX7_VOICE_OFF)
 #define _ON(voice)         ((voice)->status == DX7_VOICE_ON)
 #define _SUSTAINED(voice)  ((voice)->status == DX7_VOICE_SUSTAINED)
@@ -272,6 +354,7 @@ void    dx7_op_eg_set_phase(hexter_instance_t *instance, dx7_op_eg_t *eg,
                             int phase);
 void    dx7_op_envelope_prepare(hexter_instance_t *instance, dx7_op_t *op,
                                 int transposed_note, int velocity);
+const dx7_rate_tables_t *dx7_rate_tables_get(float sample_rate);
 void    dx7_eg_init_constants(hexter_instance_t *instance);
 void    dx7_pitch_eg_set_increment(hexter_instance_t *instance,
                                    dx7_pitch_eg_t *eg, int new_rate,
@@ -303,11 +386,20 @@ void    dx7_voice_calculate_runtime_parameters(hexter_instance_t *instance,
                                                dx7_voice_t *voice);
 void    dx7_voice_setup_note(hexter_instance_t *instance, dx7_voice_t *voice);
 void    dx7_voice_set_data(hexter_instance_t *instance, dx7_voice_t *voice);
+void    dx7_voice_patch_decode(const uint8_t *edit_buffer, dx7_voice_patch_t *patch);
+void    dx7_voice_patch_load(hexter_instance_t *instance, dx7_voice_t *voice,
+                             const dx7_voice_patch_t *patch);
 
 /* dx7_voice_render.c */
 void    dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
                          LADSPA_Data *out, unsigned long sample_count,
                          int do_control_update);
+void    dx7_voice_render_control(hexter_instance_t *instance, dx7_voice_t *voice);
+
+/* dx7_voice_render_lanes.c */
+void    dx7_voice_render_lanes(hexter_instance_t **instances, dx7_voice_t **voices,
+                               int nlanes, unsigned long samples_done,
+                               unsigned long sample_count, int do_control_update);
 
 /* dx7_voice_tables.c */
 void    dx7_voice_init_tables(void);
@@ -37,149 +37,7 @@
 #include "hexter.h"
 #include "hexter_synth.h"
 #include "dx7_voice.h"
-
-static inline dx7_sample_t
-dx7_op_calculate_operator(dx7_sample_t eg_value, dx7_sample_t phase)
-{
-    //DEBUG_MESSAGE(-1,"| %f -> ",phase);
-    int32_t index;
-    dx7_sample_t mod_index, out;
-#ifdef HEXTER_USE_FLOATING_POINT
-    float frac;
-#endif /* HEXTER_USE_FLOATING_POINT */
-
-    /* use eg_value to look up the modulation index, with interpolation */
-#ifndef HEXTER_USE_FLOATING_POINT
-    index = FP_TO_INT(eg_value);
-    mod_index = dx7_voice_eg_ol_to_mod_index[index];
-    mod_index += FP_MULTIPLY(dx7_voice_eg_ol_to_mod_index[index + 1] - mod_index,
-                             eg_value & FP_MASK);
-#else /* HEXTER_USE_FLOATING_POINT */
-    index = lrintf(eg_value - 0.5f);
-    frac = eg_value - (float)index;
-    mod_index = dx7_voice_eg_ol_to_mod_index[index];
-    mod_index += (dx7_voice_eg_ol_to_mod_index[index + 1] - mod_index) * frac;
-#endif /* HEXTER_USE_FLOATING_POINT */
-
-    /* use phase to look up the oscillator output, with interpolation */
-#ifndef HEXTER_USE_FLOATING_POINT
-    index = ((uint32_t)phase >> FP_TO_SINE_SHIFT) & SINE_MASK;
-    out = dx7_voice_sin_table[index];
-    out += (((int64_t)(dx7_voice_sin_table[index + 1] - out) *
-             (int64_t)(phase & FP_TO_SINE_MASK)) >>
-            (FP_SHIFT + FP_TO_SINE_SHIFT));
-#else /* HEXTER_USE_FLOATING_POINT */
-    phase *= (float)SINE_SIZE;
-    index = lrintf(phase - 0.5f);
-    frac = phase - (float)index;
-    index &= SINE_MASK;
-    out = dx7_voice_sin_table[index];
-    //DEBUG_MESSAGE(-1,"\nphase: %f - idx: %d -> %f ",phase,index,out);
-    out += (dx7_voice_sin_table[index + 1] - out) * frac;
-#endif /* HEXTER_USE_FLOATING_POINT */
-    /* return the product of modulation index and oscillator output */
-    //DEBUG_MESSAGE(-1,"%f |",FP_MULTIPLY(mod_index, out));
-    return FP_MULTIPLY(mod_index, out);
-}
-
-static inline dx7_sample_t
-dx7_op_calculate_operator_saving_feedback(dx7_voice_t *voice, dx7_sample_t eg_value,
-                                          dx7_sample_t phase)
-{
-    int32_t index;
-    dx7_sample_t mod_index, out;
-#ifndef HEXTER_USE_FLOATING_POINT
-    int64_t out64;
-#else /* HEXTER_USE_FLOATING_POINT */
-    float frac;
-#endif /* HEXTER_USE_FLOATING_POINT */
-
-    /* use eg_value to look up the modulation index, with interpolation */
-#ifndef HEXTER_USE_FLOATING_POINT
-    index = FP_TO_INT(eg_value);
-    mod_index = dx7_voice_eg_ol_to_mod_index[index];
-    mod_index += FP_MULTIPLY(dx7_voice_eg_ol_to_mod_index[index + 1] - mod_index,
-                             eg_value & FP_MASK);
-#else /* HEXTER_USE_FLOATING_POINT */
-    index = lrintf(eg_value - 0.5f);
-    frac = eg_value - (float)index;
-    mod_index = dx7_voice_eg_ol_to_mod_index[index];
-    mod_index += (dx7_voice_eg_ol_to_mod_index[index + 1] - mod_index) * frac;
-#endif /* HEXTER_USE_FLOATING_POINT */
-
-    /* use phase to look up the oscillator output, with interpolation */
-#ifndef HEXTER_USE_FLOATING_POINT
-    index = ((uint32_t)phase >> FP_TO_SINE_SHIFT) & SINE_MASK;
-    out = dx7_voice_sin_table[index];
-    out64 = out +
-            (((int64_t)(dx7_voice_sin_table[index + 1] - out) *
-              (int64_t)(phase & FP_TO_SINE_MASK)) >>
-             (FP_SHIFT + FP_TO_SINE_SHIFT));
-#else /* HEXTER_USE_FLOATING_POINT */
-    phase *= (float)SINE_SIZE;
-    index = lrintf(phase - 0.5f);
-    frac = phase - (float)index;
-    index &= SINE_MASK;
-    out = dx7_voice_sin_table[index];
-    out += (dx7_voice_sin_table[index + 1] - out) * frac;
-#endif /* HEXTER_USE_FLOATING_POINT */
-
-    /* save that output, scaled by our eg level, feedback amount, and a
-     * constant, as our feedback modulation index */
-#ifndef HEXTER_USE_FLOATING_POINT
-    voice->feedback = (((out64 * (int64_t)eg_value) >> FP_SHIFT) *
-                       (int64_t)voice->feedback_multiplier) >> FP_SHIFT;
-#else /* HEXTER_USE_FLOATING_POINT */
-    voice->feedback = out * eg_value * voice->feedback_multiplier;
-#endif /* HEXTER_USE_FLOATING_POINT */
-
-    /* return the product of modulation index and oscillator output */
-#ifndef HEXTER_USE_FLOATING_POINT
-    return (int32_t)(((int64_t)mod_index * out64) >> FP_SHIFT);
-#else /* HEXTER_USE_FLOATING_POINT */
-    return mod_index * out;
-#endif /* HEXTER_USE_FLOATING_POINT */
-}
-
-static inline void
-dx7_op_eg_process(hexter_instance_t *instance, dx7_op_eg_t *eg)
-{
-    eg->value += eg->increment;
-
-    if (--eg->duration == 0) {
-
-        if (eg->mode != DX7_EG_RUNNING) {
-            eg->duration = -1;
-            return;
-        }
-
-        if (eg->in_precomp) {
-
-            eg->in_precomp = 0;
-            eg->duration = eg->postcomp_duration;
-            eg->increment = eg->postcomp_increment;
-
-        } else {
-
-            dx7_op_eg_set_next_phase(instance, eg);
-        }
-    }
-}
-
-static inline void
-dx7_op_eg_adjust(dx7_op_eg_t *eg)
-{
-    /* The constant in this next expression needs to be greater than
-     * 0.000815 * (32/99) * sample_rate to avoid interaction with envelope
-     * precompensation.  60 is safe to 192KHz. */
-    if (eg->duration > 60) {
-
-        if (eg->mode != DX7_EG_RUNNING)
-            return;
-
-        eg->increment = (eg->target - eg->value) / eg->duration;
-    }
-}
+#include "dx7_voice_render.h"
 
 static inline void
 dx7_pitch_eg_process(hexter_instance_t *instance, dx7_pitch_eg_t *eg)
@@ -249,22 +107,6 @@ dx7_voice_check_for_dead(dx7_voice_t *voice)
     return 1;
 }
 
-/* Test for bitwise equality of two floating-point numbers (single or double
- * precision). This little dance is needed on some platforms to avoid
- * comparisons between e.g. 64-bit double precision with 80-bit extended
- * precision values. Generally, testing for exact equality in floating point is
- * a bad idea, but here we're only concerned about whether a parameter changed
- * from it's previous value, not with the value itself.
- */
-static inline int
-float_equality(float a, float b)
-{
-    union { float f; uint32_t l; } ua, ub;
-    ua.f = a;
-    ub.f = b;
-    return ua.l == ub.l;
-}
-
 static inline int
 double_equality(double a, double b)
 {
@@ -285,7 +127,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
                  int do_control_update)
 {
     unsigned long       sample;
-    static dx7_sample_t ampmod[4] = { 0 };
+    dx7_sample_t        ampmod[4] = { 0 };
     dx7_sample_t        i;
     dx7_sample_t        output;
 
@@ -306,13 +148,6 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
             i = FP_MULTIPLY(voice->amp_mod_lfo_amd_value, voice->lfo_delay_value);
             i = voice->amp_mod_env_value +
                     FP_MULTIPLY(i + voice->amp_mod_lfo_mods_value, instance->lfo_buffer[sample]);
-#ifndef HEXTER_USE_FLOATING_POINT
-#define AMPMOD2_CONSTANT  (7726076 >> (24 - FP_SHIFT))  /* 0.460510 */
-#define AMPMOD1_CONSTANT  (3993950 >> (24 - FP_SHIFT))  /* 0.238058 */
-#else /* HEXTER_USE_FLOATING_POINT */
-#define AMPMOD2_CONSTANT  (0.460510f)
-#define AMPMOD1_CONSTANT  (0.238058f)
-#endif /* HEXTER_USE_FLOATING_POINT */
             ampmod[3] = i;
             ampmod[2] = FP_MULTIPLY(i, AMPMOD2_CONSTANT);
             ampmod[1] = FP_MULTIPLY(i, AMPMOD1_CONSTANT);
@@ -324,7 +159,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
                                                                           dx7_op_calculate_operator(voice->op[OP_5].eg.value - ampmod[voice->op[OP_5].amp_mod_sens],
                                                                                                     voice->op[OP_5].phase +
                                                                                                     /* -FIX- need to determine if amp mod is included in feedback, or after */
-                                                                                                    dx7_op_calculate_operator_saving_feedback(voice,
+                                                                                                    dx7_op_calculate_operator_saving_feedback(&voice->feedback, voice->feedback_multiplier,
                                                                                                                                               voice->op[OP_6].eg.value - ampmod[voice->op[OP_6].amp_mod_sens],
                                                                                                                                               voice->op[OP_6].phase +
                                                                                                                                               voice->feedback)))) +
@@ -382,7 +217,8 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       /* Now we'll use some macros to make it easier to read */
 #define op(_i, _p)     dx7_op_calculate_operator(voice->op[_i].eg.value - ampmod[voice->op[_i].amp_mod_sens], voice->op[_i].phase + _p)
-#define op_sfb(_i, _p) dx7_op_calculate_operator_saving_feedback(voice, voice->op[_i].eg.value - ampmod[voice->op[_i].amp_mod_sens], voice->op[_i].phase + _p)
+#define op_sfb(_i, _p) dx7_op_calculate_operator_saving_feedback(&voice->feedback, voice->feedback_multiplier, voice->op[_i].eg.value - ampmod[voice->op[_i].amp_mod_sens], voice->op[_i].phase + _p)
+#define FEEDBACK       voice->feedback
 
 #define RENDER \
         for (sample = 0; sample < sample_count; sample++) { \
@@ -448,12 +284,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 1: /* algorithm 2 */
 
-#define ALGORITHM { \
-            output = (                                             \
-                      op(OP_3, op(OP_4, op(OP_5, op(OP_6, 0)))) +  \
-                      op(OP_1, op_sfb(OP_2, voice->feedback))      \
-                     );                                            \
-        }
+#define ALGORITHM DX7_ALGORITHM_2
 
         RENDER;
         break;
@@ -461,12 +292,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 2: /* algorithm 3 */
 
-#define ALGORITHM { \
-            output = (                                                     \
-                      op(OP_4, op(OP_5, op_sfb(OP_6, voice->feedback))) +  \
-                      op(OP_1, op(OP_2, op(OP_3, 0)))                      \
-                     );                                                    \
-        }
+#define ALGORITHM DX7_ALGORITHM_3
 
         RENDER;
         break;
@@ -474,12 +300,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 3: /* algorithm 4 */
 
-#define ALGORITHM { \
-            output = (                                                     \
-                      op_sfb(OP_4, op(OP_5, op(OP_6, voice->feedback))) +  \
-                      op(OP_1, op(OP_2, op(OP_3, 0)))                      \
-                     );                                                    \
-        }
+#define ALGORITHM DX7_ALGORITHM_4
 
         RENDER;
         break;
@@ -487,13 +308,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 4: /* algorithm 5 */
 
-#define ALGORITHM { \
-            output = (                                           \
-                      op(OP_5, op_sfb(OP_6, voice->feedback)) +  \
-                      op(OP_3, op(OP_4, 0)) +                    \
-                      op(OP_1, op(OP_2, 0))                      \
-                     );                                          \
-        }
+#define ALGORITHM DX7_ALGORITHM_5
 
         RENDER;
         break;
@@ -501,13 +316,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 5: /* algorithm 6 */
 
-#define ALGORITHM { \
-            output = (                                           \
-                      op_sfb(OP_5, op(OP_6, voice->feedback)) +  \
-                      op(OP_3, op(OP_4, 0)) +                    \
-                      op(OP_1, op(OP_2, 0))                      \
-                     );                                          \
-        }
+#define ALGORITHM DX7_ALGORITHM_6
 
         RENDER;
         break;
@@ -515,13 +324,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 6: /* algorithm 7 */
 
-#define ALGORITHM { \
-            output = (                                                    \
-                      op(OP_3, op(OP_5, op_sfb(OP_6, voice->feedback)) +  \
-                               op(OP_4, 0)) +                             \
-                      op(OP_1, op(OP_2, 0))                               \
-                     );                                                   \
-        }
+#define ALGORITHM DX7_ALGORITHM_7
 
         RENDER;
         break;
@@ -529,13 +332,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 7: /* algorithm 8 */
 
-#define ALGORITHM { \
-            output = (                                           \
-                      op(OP_3, op(OP_5, op(OP_6, 0)) +           \
-                               op_sfb(OP_4, voice->feedback)) +  \
-                      op(OP_1, op(OP_2, 0))                      \
-                     );                                          \
-        }
+#define ALGORITHM DX7_ALGORITHM_8
 
         RENDER;
         break;
@@ -543,13 +340,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 8: /* algorithm 9 */
 
-#define ALGORITHM { \
-            output = (                                         \
-                      op(OP_3, op(OP_5, op(OP_6, 0)) +         \
-                               op(OP_4, 0)) +                  \
-                      op(OP_1, op_sfb(OP_2, voice->feedback))  \
-                     );                                        \
-        }
+#define ALGORITHM DX7_ALGORITHM_9
 
         RENDER;
         break;
@@ -557,13 +348,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 9: /* algorithm 10 */
 
-#define ALGORITHM { \
-            output = (                                                   \
-                      op(OP_4, op(OP_6, 0) +                             \
-                               op(OP_5, 0)) +                            \
-                      op(OP_1, op(OP_2, op_sfb(OP_3, voice->feedback)))  \
-                     );                                                  \
-        }
+#define ALGORITHM DX7_ALGORITHM_10
 
         RENDER;
         break;
@@ -571,13 +356,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 10: /* algorithm 11 */
 
-#define ALGORITHM { \
-            output = (                                          \
-                      op(OP_4, op_sfb(OP_6, voice->feedback) +  \
-                               op(OP_5, 0)) +                   \
-                      op(OP_1, op(OP_2, op(OP_3, 0)))           \
-                     );                                         \
-        }
+#define ALGORITHM DX7_ALGORITHM_11
 
         RENDER;
         break;
@@ -585,14 +364,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 11: /* algorithm 12 */
 
-#define ALGORITHM { \
-            output = (                                         \
-                      op(OP_3, op(OP_6, 0) +                   \
-                               op(OP_5, 0) +                   \
-                               op(OP_4, 0)) +                  \
-                      op(OP_1, op_sfb(OP_2, voice->feedback))  \
-                     );                                        \
-        }
+#define ALGORITHM DX7_ALGORITHM_12
 
         RENDER;
         break;
@@ -600,14 +372,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 12: /* algorithm 13 */
 
-#define ALGORITHM { \
-            output = (                                          \
-                      op(OP_3, op_sfb(OP_6, voice->feedback) +  \
-                               op(OP_5, 0) +                    \
-                               op(OP_4, 0)) +                   \
-                      op(OP_1, op(OP_2, 0))                     \
-                     );                                         \
-        }
+#define ALGORITHM DX7_ALGORITHM_13
 
         RENDER;
         break;
@@ -615,13 +380,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 13: /* algorithm 14 */
 
-#define ALGORITHM { \
-            output = (                                                   \
-                      op(OP_3, op(OP_4, op_sfb(OP_6, voice->feedback) +  \
-                                        op(OP_5, 0))) +                  \
-                      op(OP_1, op(OP_2, 0))                              \
-                     );                                                  \
-        }
+#define ALGORITHM DX7_ALGORITHM_14
 
         RENDER;
         break;
@@ -629,13 +388,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 14: /* algorithm 15 */
 
-#define ALGORITHM { \
-            output = (                                         \
-                      op(OP_3, op(OP_4, op(OP_6, 0) +          \
-                                        op(OP_5, 0))) +        \
-                      op(OP_1, op_sfb(OP_2, voice->feedback))  \
-                     );                                        \
-        }
+#define ALGORITHM DX7_ALGORITHM_15
 
         RENDER;
         break;
@@ -643,11 +396,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 15: /* algorithm 16 */
 
-#define ALGORITHM { \
-            output = op(OP_1, op(OP_5, op_sfb(OP_6, voice->feedback)) +  \
-                              op(OP_3, op(OP_4, 0)) +                    \
-                              op(OP_2, 0));                              \
-        }
+#define ALGORITHM DX7_ALGORITHM_16
 
         RENDER;
         break;
@@ -655,11 +404,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 16: /* algorithm 17 */
 
-#define ALGORITHM { \
-            output = op(OP_1, op(OP_5, op(OP_6, 0)) +          \
-                              op(OP_3, op(OP_4, 0)) +          \
-                              op_sfb(OP_2, voice->feedback));  \
-        }
+#define ALGORITHM DX7_ALGORITHM_17
 
         RENDER;
         break;
@@ -667,11 +412,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 17: /* algorithm 18 */
 
-#define ALGORITHM { \
-            output = op(OP_1, op(OP_4, op(OP_5, op(OP_6, 0))) +  \
-                              op_sfb(OP_3, voice->feedback) +    \
-                              op(OP_2, 0));                      \
-        }
+#define ALGORITHM DX7_ALGORITHM_18
 
         RENDER;
         break;
@@ -679,14 +420,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 18: /* algorithm 19 */
 
-#define ALGORITHM { \
-            i = op_sfb(OP_6, voice->feedback);         \
-            output = (                                 \
-                      op(OP_5, i) +                    \
-                      op(OP_4, i) +                    \
-                      op(OP_1, op(OP_2, op(OP_3, 0)))  \
-                     );                                \
-        }
+#define ALGORITHM DX7_ALGORITHM_19
 
         RENDER;
         break;
@@ -694,15 +428,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 19: /* algorithm 20 */
 
-#define ALGORITHM { \
-            i = op_sfb(OP_3, voice->feedback);  \
-            output = (                          \
-                      op(OP_4, op(OP_6, 0) +    \
-                               op(OP_5, 0)) +   \
-                      op(OP_2, i) +             \
-                      op(OP_1, i)               \
-                     );                         \
-        }
+#define ALGORITHM DX7_ALGORITHM_20
 
         RENDER;
         break;
@@ -710,14 +436,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 20: /* algorithm 21 */
 
-#define ALGORITHM { \
-            i = op(OP_6, 0);                    \
-            output = op(OP_5, i) +              \
-                     op(OP_4, i);               \
-            i = op_sfb(OP_3, voice->feedback);  \
-            output += op(OP_2, i) +             \
-                      op(OP_1, i);              \
-        }
+#define ALGORITHM DX7_ALGORITHM_21
 
         RENDER;
         break;
@@ -725,15 +444,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 21: /* algorithm 22 */
 
-#define ALGORITHM { \
-            i = op_sfb(OP_6, voice->feedback);  \
-            output = (                          \
-                      op(OP_5, i) +             \
-                      op(OP_4, i) +             \
-                      op(OP_3, i) +             \
-                      op(OP_1, op(OP_2, 0))     \
-                     );                         \
-        }
+#define ALGORITHM DX7_ALGORITHM_22
 
         RENDER;
         break;
@@ -741,15 +452,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 22: /* algorithm 23 */
 
-#define ALGORITHM { \
-            i = op_sfb(OP_6, voice->feedback);  \
-            output = (                          \
-                      op(OP_5, i) +             \
-                      op(OP_4, i) +             \
-                      op(OP_2, op(OP_3, 0)) +   \
-                      op(OP_1, 0)               \
-                     );                         \
-        }
+#define ALGORITHM DX7_ALGORITHM_23
 
         RENDER;
         break;
@@ -757,16 +460,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 23: /* algorithm 24 */
 
-#define ALGORITHM { \
-            i = op_sfb(OP_6, voice->feedback);  \
-            output = (                          \
-                      op(OP_5, i) +             \
-                      op(OP_4, i) +             \
-                      op(OP_3, i) +             \
-                      op(OP_2, 0) +             \
-                      op(OP_1, 0)               \
-                     );                         \
-        }
+#define ALGORITHM DX7_ALGORITHM_24
 
         RENDER;
         break;
@@ -774,16 +468,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 24: /* algorithm 25 */
 
-#define ALGORITHM { \
-            i = op_sfb(OP_6, voice->feedback);  \
-            output = (                          \
-                      op(OP_5, i) +             \
-                      op(OP_4, i) +             \
-                      op(OP_3, 0) +             \
-                      op(OP_2, 0) +             \
-                      op(OP_1, 0)               \
-                     );                         \
-        }
+#define ALGORITHM DX7_ALGORITHM_25
 
         RENDER;
         break;
@@ -791,14 +476,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 25: /* algorithm 26 */
 
-#define ALGORITHM { \
-            output = (                                          \
-                      op(OP_4, op_sfb(OP_6, voice->feedback) +  \
-                               op(OP_5, 0)) +                   \
-                      op(OP_2, op(OP_3, 0)) +                   \
-                      op(OP_1, 0)                               \
-                     );                                         \
-        }
+#define ALGORITHM DX7_ALGORITHM_26
 
         RENDER;
         break;
@@ -806,14 +484,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 26: /* algorithm 27 */
 
-#define ALGORITHM { \
-            output = (                                           \
-                      op(OP_4, op(OP_6, 0) +                     \
-                               op(OP_5, 0)) +                    \
-                      op(OP_2, op_sfb(OP_3, voice->feedback)) +  \
-                      op(OP_1, 0)                                \
-                     );                                          \
-        }
+#define ALGORITHM DX7_ALGORITHM_27
 
         RENDER;
         break;
@@ -821,13 +492,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 27: /* algorithm 28 */
 
-#define ALGORITHM { \
-            output = (                                                     \
-                      op(OP_6, 0) +                                        \
-                      op(OP_3, op(OP_4, op_sfb(OP_5, voice->feedback))) +  \
-                      op(OP_1, op(OP_2, 0))                                \
-                     );                                                    \
-        }
+#define ALGORITHM DX7_ALGORITHM_28
 
         RENDER;
         break;
@@ -835,14 +500,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 28: /* algorithm 29 */
 
-#define ALGORITHM { \
-            output = (                                           \
-                      op(OP_5, op_sfb(OP_6, voice->feedback)) +  \
-                      op(OP_3, op(OP_4, 0)) +                    \
-                      op(OP_2, 0) +                              \
-                      op(OP_1, 0)                                \
-                     );                                          \
-        }
+#define ALGORITHM DX7_ALGORITHM_29
 
         RENDER;
         break;
@@ -850,14 +508,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 29: /* algorithm 30 */
 
-#define ALGORITHM { \
-            output = (                                                     \
-                      op(OP_6, 0) +                                        \
-                      op(OP_3, op(OP_4, op_sfb(OP_5, voice->feedback))) +  \
-                      op(OP_2, 0) +                                        \
-                      op(OP_1, 0)                                          \
-                     );                                                    \
-        }
+#define ALGORITHM DX7_ALGORITHM_30
 
         RENDER;
         break;
@@ -865,15 +516,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
       case 30: /* algorithm 31 */
 
-#define ALGORITHM { \
-            output = (                                           \
-                      op(OP_5, op_sfb(OP_6, voice->feedback)) +  \
-                      op(OP_4, 0) +                              \
-                      op(OP_3, 0) +                              \
-                      op(OP_2, 0) +                              \
-                      op(OP_1, 0)                                \
-                     );                                          \
-        }
+#define ALGORITHM DX7_ALGORITHM_31
 
         RENDER;
         break;
@@ -882,16 +525,7 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
       case 31: /* algorithm 32 */
       default: /* just in case */
 
-#define ALGORITHM { \
-            output = (                                 \
-                      op_sfb(OP_6, voice->feedback) +  \
-                      op(OP_5, 0) +                    \
-                      op(OP_4, 0) +                    \
-                      op(OP_3, 0) +                    \
-                      op(OP_2, 0) +                    \
-                      op(OP_1, 0)                      \
-                     );                                \
-        }
+#define ALGORITHM DX7_ALGORITHM_32
 
         RENDER;
         break;
@@ -899,64 +533,76 @@ dx7_voice_render(hexter_instance_t *instance, dx7_voice_t *voice,
 
 #undef op
 #undef op_sfb
+#undef FEEDBACK
     }
     /*DEBUG_MESSAGE(-1,"[EXIT FROM RENDER]. sample = %lu do_control_update = %d\n",sample,do_control_update);*/
-    if (do_control_update) {
-        double new_pitch;
+    if (do_control_update)
+        dx7_voice_render_control(instance, voice);
+}
 
-        /* do those things which should be done only once per control-
-         * calculation interval ("nugget"), such as voice check-for-dead,
-         * pitch envelope calculations, etc. */
+/*
+ * dx7_voice_render_control
+ *
+ * dx7pytorch: end-of-nugget control update of dx7_voice_render(), split out
+ * so the lane renderer can share it
+ */
+void
+dx7_voice_render_control(hexter_instance_t *instance, dx7_voice_t *voice)
+{
+    double new_pitch;
+
+    /* do those things which should be done only once per control-
+     * calculation interval ("nugget"), such as voice check-for-dead,
+     * pitch envelope calculations, etc. */
 
-        /* check if we've decayed to nothing, turn off voice if so */
-        if (dx7_voice_check_for_dead(voice))
-            return; /* we're dead now, so return */
+    /* check if we've decayed to nothing, turn off voice if so */
+    if (dx7_voice_check_for_dead(voice))
+        return; /* we're dead now, so return */
 
 #ifdef HEXTER_USE_FLOATING_POINT
-        /* wrap oscillator phases */
-        voice->op[OP_6].phase -= floorf(voice->op[OP_6].phase);
-        voice->op[OP_5].phase -= floorf(voice->op[OP_5].phase);
-        voice->op[OP_4].phase -= floorf(voice->op[OP_4].phase);
-        voice->op[OP_3].phase -= floorf(voice->op[OP_3].phase);
-        voice->op[OP_2].phase -= floorf(voice->op[OP_2].phase);
-        voice->op[OP_1].phase -= floorf(voice->op[OP_1].phase);
-
-        /*DEBUG_MESSAGE(-1,"\n[PH--CU] %f %f %f %f %f %f \n",voice->op[OP_1].phase,voice->op[OP_2].phase,voice->op[OP_3].phase,voice->op[OP_4].phase,voice->op[OP_5].phase,voice->op[OP_6].phase);*/
-        /*DEBUG_MESSAGE(-1,"[IN--CU] %f %f %f %f %f %f \n",voice->op[OP_1].phase_increment,voice->op[OP_2].phase_increment,voice->op[OP_3].phase_increment,voice->op[OP_4].phase_increment,voice->op[OP_5].phase_increment,voice->op[OP_6].phase_increment);*/
+    /* wrap oscillator phases */
+    voice->op[OP_6].phase -= floorf(voice->op[OP_6].phase);
+    voice->op[OP_5].phase -= floorf(voice->op[OP_5].phase);
+    voice->op[OP_4].phase -= floorf(voice->op[OP_4].phase);
+    voice->op[OP_3].phase -= floorf(voice->op[OP_3].phase);
+    voice->op[OP_2].phase -= floorf(voice->op[OP_2].phase);
+    voice->op[OP_1].phase -= floorf(voice->op[OP_1].phase);
+
+    /*DEBUG_MESSAGE(-1,"\n[PH--CU] %f %f %f %f %f %f \n",voice->op[OP_1].phase,voice->op[OP_2].phase,voice->op[OP_3].phase,voice->op[OP_4].phase,voice->op[OP_5].phase,voice->op[OP_6].phase);*/
+    /*DEBUG_MESSAGE(-1,"[IN--CU] %f %f %f %f %f %f \n",voice->op[OP_1].phase_increment,voice->op[OP_2].phase_increment,voice->op[OP_3].phase_increment,voice->op[OP_4].phase_increment,voice->op[OP_5].phase_increment,voice->op[OP_6].phase_increment);*/
 #endif /* HEXTER_USE_FLOATING_POINT */
 
-        /* update pitch envelope and portamento */
-        dx7_pitch_eg_process(instance, &voice->pitch_eg);
-        dx7_portamento_process(instance, &voice->portamento);
+    /* update pitch envelope and portamento */
+    dx7_pitch_eg_process(instance, &voice->pitch_eg);
+    dx7_portamento_process(instance, &voice->portamento);
 
-        /* update phase increments if pitch or tuning changed */
-        new_pitch = voice->pitch_eg.value + voice->portamento.value +
-                    instance->pitch_bend -
-                    instance->lfo_value_for_pitch *
-                        (voice->pitch_mod_depth_pmd * FP_TO_DOUBLE(voice->lfo_delay_value) +
-                         voice->pitch_mod_depth_mods);
-        if (!double_equality(voice->last_pitch, new_pitch) ||
-            !float_equality(voice->last_port_tuning, *instance->tuning)) {
+    /* update phase increments if pitch or tuning changed */
+    new_pitch = voice->pitch_eg.value + voice->portamento.value +
+                instance->pitch_bend -
+                instance->lfo_value_for_pitch *
+                    (voice->pitch_mod_depth_pmd * FP_TO_DOUBLE(voice->lfo_delay_value) +
+                     voice->pitch_mod_depth_mods);
+    if (!double_equality(voice->last_pitch, new_pitch) ||
+        !float_equality(voice->last_port_tuning, *instance->tuning)) {
 
-            dx7_voice_recalculate_freq_and_inc(instance, voice);
-        }
-
-        /* op envelope rounding correction */
-        dx7_op_eg_adjust(&voice->op[OP_6].eg);
-        dx7_op_eg_adjust(&voice->op[OP_5].eg);
-        dx7_op_eg_adjust(&voice->op[OP_4].eg);
-        dx7_op_eg_adjust(&voice->op[OP_3].eg);
-        dx7_op_eg_adjust(&voice->op[OP_2].eg);
-        dx7_op_eg_adjust(&voice->op[OP_1].eg);
-
-        /* mods and output volume */
-        if (!voice->amp_mod_env_duration)
-            voice->amp_mod_env_value = voice->amp_mod_env_target;
-        if (!voice->amp_mod_lfo_mods_duration)
-            voice->amp_mod_lfo_mods_value = voice->amp_mod_lfo_mods_target;
-        if (!voice->amp_mod_lfo_amd_duration)
-            voice->amp_mod_lfo_amd_value = voice->amp_mod_lfo_amd_target;
-        if (!voice->volume_duration)
-            voice->volume_value = voice->volume_target;
+        dx7_voice_recalculate_freq_and_inc(instance, voice);
     }
+
+    /* op envelope rounding correction */
+    dx7_op_eg_adjust(&voice->op[OP_6].eg);
+    dx7_op_eg_adjust(&voice->op[OP_5].eg);
+    dx7_op_eg_adjust(&voice->op[OP_4].eg);
+    dx7_op_eg_adjust(&voice->op[OP_3].eg);
+    dx7_op_eg_adjust(&voice->op[OP_2].eg);
+    dx7_op_eg_adjust(&voice->op[OP_1].eg);
+
+    /* mods and output volume */
+    if (!voice->amp_mod_env_duration)
+        voice->amp_mod_env_value = voice->amp_mod_env_target;
+    if (!voice->amp_mod_lfo_mods_duration)
+        voice->amp_mod_lfo_mods_value = voice->amp_mod_lfo_mods_target;
+    if (!voice->amp_mod_lfo_amd_duration)
+        voice->amp_mod_lfo_amd_value = voice->amp_mod_lfo_amd_target;
+    if (!voice->volume_duration)
+        voice->volume_value = voice->volume_target;
 }
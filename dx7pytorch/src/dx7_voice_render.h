@@ -0,0 +1,519 @@
+/* hexter DSSI software synthesizer plugin
+ *
+ * Copyright (C) 2004, 2009, 2011, 2018 Sean Bolton and others.
+ *
+ * This program is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU General Public License as
+ * published by the Free Software Foundation; either version 2 of
+ * the License, or (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be
+ * useful, but WITHOUT ANY WARRANTY; without even the implied
+ * warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+ * PURPOSE.  See the GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public
+ * License along with this program; if not, write to the Free
+ * Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+ * Boston, MA 02110-1301 USA.
+ */
+
+/* dx7pytorch: per-sample building blocks shared by the scalar voice renderer
+ * (dx7_voice_render.c) and the multi-voice lane renderer
+ * (dx7_voice_render_lanes.c), so that both compute exactly the same thing. */
+
+#ifndef _DX7_VOICE_RENDER_H
+#define _DX7_VOICE_RENDER_H
+
+#include <stdint.h>
+#include <math.h>
+
+#include "hexter_types.h"
+#include "hexter_synth.h"
+#include "dx7_voice.h"
+
+#ifndef HEXTER_USE_FLOATING_POINT
+#define AMPMOD2_CONSTANT  (7726076 >> (24 - FP_SHIFT))  /* 0.460510 */
+#define AMPMOD1_CONSTANT  (3993950 >> (24 - FP_SHIFT))  /* 0.238058 */
+#else /* HEXTER_USE_FLOATING_POINT */
+#define AMPMOD2_CONSTANT  (0.460510f)
+#define AMPMOD1_CONSTANT  (0.238058f)
+#endif /* HEXTER_USE_FLOATING_POINT */
+
+static inline dx7_sample_t
+dx7_op_calculate_operator(dx7_sample_t eg_value, dx7_sample_t phase)
+{
+    //DEBUG_MESSAGE(-1,"| %f -> ",phase);
+    int32_t index;
+    dx7_sample_t mod_index, out;
+#ifdef HEXTER_USE_FLOATING_POINT
+    float frac;
+#endif /* HEXTER_USE_FLOATING_POINT */
+
+    /* use eg_value to look up the modulation index, with interpolation */
+#ifndef HEXTER_USE_FLOATING_POINT
+    index = FP_TO_INT(eg_value);
+    mod_index = dx7_voice_eg_ol_to_mod_index[index];
+    mod_index += FP_MULTIPLY(dx7_voice_eg_ol_to_mod_index[index + 1] - mod_index,
+                             eg_value & FP_MASK);
+#else /* HEXTER_USE_FLOATING_POINT */
+    index = lrintf(eg_value - 0.5f);
+    frac = eg_value - (float)index;
+    mod_index = dx7_voice_eg_ol_to_mod_index[index];
+    mod_index += (dx7_voice_eg_ol_to_mod_index[index + 1] - mod_index) * frac;
+#endif /* HEXTER_USE_FLOATING_POINT */
+
+    /* use phase to look up the oscillator output, with interpolation */
+#ifndef HEXTER_USE_FLOATING_POINT
+    index = ((uint32_t)phase >> FP_TO_SINE_SHIFT) & SINE_MASK;
+    out = dx7_voice_sin_table[index];
+    out += (((int64_t)(dx7_voice_sin_table[index + 1] - out) *
+             (int64_t)(phase & FP_TO_SINE_MASK)) >>
+            (FP_SHIFT + FP_TO_SINE_SHIFT));
+#else /* HEXTER_USE_FLOATING_POINT */
+    phase *= (float)SINE_SIZE;
+    index = lrintf(phase - 0.5f);
+    frac = phase - (float)index;
+    index &= SINE_MASK;
+    out = dx7_voice_sin_table[index];
+    //DEBUG_MESSAGE(-1,"\nphase: %f - idx: %d -> %f ",phase,index,out);
+    out += (dx7_voice_sin_table[index + 1] - out) * frac;
+#endif /* HEXTER_USE_FLOATING_POINT */
+    /* return the product of modulation index and oscillator output */
+    //DEBUG_MESSAGE(-1,"%f |",FP_MULTIPLY(mod_index, out));
+    return FP_MULTIPLY(mod_index, out);
+}
+
+static inline dx7_sample_t
+dx7_op_calculate_operator_saving_feedback(dx7_sample_t *feedback, dx7_sample_t feedback_multiplier,
+                                          dx7_sample_t eg_value, dx7_sample_t phase)
+{
+    int32_t index;
+    dx7_sample_t mod_index, out;
+#ifndef HEXTER_USE_FLOATING_POINT
+    int64_t out64;
+#else /* HEXTER_USE_FLOATING_POINT */
+    float frac;
+#endif /* HEXTER_USE_FLOATING_POINT */
+
+    /* use eg_value to look up the modulation index, with interpolation */
+#ifndef HEXTER_USE_FLOATING_POINT
+    index = FP_TO_INT(eg_value);
+    mod_index = dx7_voice_eg_ol_to_mod_index[index];
+    mod_index += FP_MULTIPLY(dx7_voice_eg_ol_to_mod_index[index + 1] - mod_index,
+                             eg_value & FP_MASK);
+#else /* HEXTER_USE_FLOATING_POINT */
+    index = lrintf(eg_value - 0.5f);
+    frac = eg_value - (float)index;
+    mod_index = dx7_voice_eg_ol_to_mod_index[index];
+    mod_index += (dx7_voice_eg_ol_to_mod_index[index + 1] - mod_index) * frac;
+#endif /* HEXTER_USE_FLOATING_POINT */
+
+    /* use phase to look up the oscillator output, with interpolation */
+#ifndef HEXTER_USE_FLOATING_POINT
+    index = ((uint32_t)phase >> FP_TO_SINE_SHIFT) & SINE_MASK;
+    out = dx7_voice_sin_table[index];
+    out64 = out +
+            (((int64_t)(dx7_voice_sin_table[index + 1] - out) *
+              (int64_t)(phase & FP_TO_SINE_MASK)) >>
+             (FP_SHIFT + FP_TO_SINE_SHIFT));
+#else /* HEXTER_USE_FLOATING_POINT */
+    phase *= (float)SINE_SIZE;
+    index = lrintf(phase - 0.5f);
+    frac = phase - (float)index;
+    index &= SINE_MASK;
+    out = dx7_voice_sin_table[index];
+    out += (dx7_voice_sin_table[index + 1] - out) * frac;
+#endif /* HEXTER_USE_FLOATING_POINT */
+
+    /* save that output, scaled by our eg level, feedback amount, and a
+     * constant, as our feedback modulation index */
+#ifndef HEXTER_USE_FLOATING_POINT
+    *feedback = (((out64 * (int64_t)eg_value) >> FP_SHIFT) *
+                 (int64_t)feedback_multiplier) >> FP_SHIFT;
+#else /* HEXTER_USE_FLOATING_POINT */
+    *feedback = out * eg_value * feedback_multiplier;
+#endif /* HEXTER_USE_FLOATING_POINT */
+
+    /* return the product of modulation index and oscillator output */
+#ifndef HEXTER_USE_FLOATING_POINT
+    return (int32_t)(((int64_t)mod_index * out64) >> FP_SHIFT);
+#else /* HEXTER_USE_FLOATING_POINT */
+    return mod_index * out;
+#endif /* HEXTER_USE_FLOATING_POINT */
+}
+
+/* called when the current envelope segment has run out of frames */
+static inline void
+dx7_op_eg_end_segment(hexter_instance_t *instance, dx7_op_eg_t *eg)
+{
+    if (eg->mode != DX7_EG_RUNNING) {
+        eg->duration = -1;
+        return;
+    }
+
+    if (eg->in_precomp) {
+
+        eg->in_precomp = 0;
+        eg->duration = eg->postcomp_duration;
+        eg->increment = eg->postcomp_increment;
+
+    } else {
+
+        dx7_op_eg_set_next_phase(instance, eg);
+    }
+}
+
+static inline void
+dx7_op_eg_process(hexter_instance_t *instance, dx7_op_eg_t *eg)
+{
+    eg->value += eg->increment;
+
+    if (--eg->duration == 0)
+        dx7_op_eg_end_segment(instance, eg);
+}
+
+static inline void
+dx7_op_eg_adjust(dx7_op_eg_t *eg)
+{
+    /* The constant in this next expression needs to be greater than
+     * 0.000815 * (32/99) * sample_rate to avoid interaction with envelope
+     * precompensation.  60 is safe to 192KHz. */
+    if (eg->duration > 60) {
+
+        if (eg->mode != DX7_EG_RUNNING)
+            return;
+
+        eg->increment = (eg->target - eg->value) / eg->duration;
+    }
+}
+
+/* Test for bitwise equality of two floating-point numbers (single or double
+ * precision). This little dance is needed on some platforms to avoid
+ * comparisons between e.g. 64-bit double precision with 80-bit extended
+ * precision values. Generally, testing for exact equality in floating point is
+ * a bad idea, but here we're only concerned about whether a parameter changed
+ * from it's previous value, not with the value itself.
+ */
+static inline int
+float_equality(float a, float b)
+{
+    union { float f; uint32_t l; } ua, ub;
+    ua.f = a;
+    ub.f = b;
+    return ua.l == ub.l;
+}
+
+/*
+ * Algorithms
+ *
+ * Each DX7_ALGORITHM_n sets 'output' to the sum of the carriers of algorithm
+ * n, possibly using 'i' as a temporary. The includer defines op(_i, _p), which
+ * renders operator _i with phase modulation _p, op_sfb(_i, _p), which does the
+ * same and saves the feedback, and FEEDBACK, the saved feedback.
+ */
+
+/* algorithm 1 */
+#define DX7_ALGORITHM_1 { \
+            output = (                                                        \
+                      op(OP_3, op(OP_4, op(OP_5, op_sfb(OP_6, FEEDBACK)))) +  \
+                      op(OP_1, op(OP_2, 0))                                   \
+                     );                                                       \
+        }
+
+/* algorithm 2 */
+#define DX7_ALGORITHM_2 { \
+            output = (                                             \
+                      op(OP_3, op(OP_4, op(OP_5, op(OP_6, 0)))) +  \
+                      op(OP_1, op_sfb(OP_2, FEEDBACK))             \
+                     );                                            \
+        }
+
+/* algorithm 3 */
+#define DX7_ALGORITHM_3 { \
+            output = (                                              \
+                      op(OP_4, op(OP_5, op_sfb(OP_6, FEEDBACK))) +  \
+                      op(OP_1, op(OP_2, op(OP_3, 0)))               \
+                     );                                             \
+        }
+
+/* algorithm 4 */
+#define DX7_ALGORITHM_4 { \
+            output = (                                              \
+                      op_sfb(OP_4, op(OP_5, op(OP_6, FEEDBACK))) +  \
+                      op(OP_1, op(OP_2, op(OP_3, 0)))               \
+                     );                                             \
+        }
+
+/* algorithm 5 */
+#define DX7_ALGORITHM_5 { \
+            output = (                                    \
+                      op(OP_5, op_sfb(OP_6, FEEDBACK)) +  \
+                      op(OP_3, op(OP_4, 0)) +             \
+                      op(OP_1, op(OP_2, 0))               \
+                     );                                   \
+        }
+
+/* algorithm 6 */
+#define DX7_ALGORITHM_6 { \
+            output = (                                    \
+                      op_sfb(OP_5, op(OP_6, FEEDBACK)) +  \
+                      op(OP_3, op(OP_4, 0)) +             \
+                      op(OP_1, op(OP_2, 0))               \
+                     );                                   \
+        }
+
+/* algorithm 7 */
+#define DX7_ALGORITHM_7 { \
+            output = (                                             \
+                      op(OP_3, op(OP_5, op_sfb(OP_6, FEEDBACK)) +  \
+                               op(OP_4, 0)) +                      \
+                      op(OP_1, op(OP_2, 0))                        \
+                     );                                            \
+        }
+
+/* algorithm 8 */
+#define DX7_ALGORITHM_8 { \
+            output = (                                    \
+                      op(OP_3, op(OP_5, op(OP_6, 0)) +    \
+                               op_sfb(OP_4, FEEDBACK)) +  \
+                      op(OP_1, op(OP_2, 0))               \
+                     );                                   \
+        }
+
+/* algorithm 9 */
+#define DX7_ALGORITHM_9 { \
+            output = (                                  \
+                      op(OP_3, op(OP_5, op(OP_6, 0)) +  \
+                               op(OP_4, 0)) +           \
+                      op(OP_1, op_sfb(OP_2, FEEDBACK))  \
+                     );                                 \
+        }
+
+/* algorithm 10 */
+#define DX7_ALGORITHM_10 { \
+            output = (                                            \
+                      op(OP_4, op(OP_6, 0) +                      \
+                               op(OP_5, 0)) +                     \
+                      op(OP_1, op(OP_2, op_sfb(OP_3, FEEDBACK)))  \
+                     );                                           \
+        }
+
+/* algorithm 11 */
+#define DX7_ALGORITHM_11 { \
+            output = (                                   \
+                      op(OP_4, op_sfb(OP_6, FEEDBACK) +  \
+                               op(OP_5, 0)) +            \
+                      op(OP_1, op(OP_2, op(OP_3, 0)))    \
+                     );                                  \
+        }
+
+/* algorithm 12 */
+#define DX7_ALGORITHM_12 { \
+            output = (                                  \
+                      op(OP_3, op(OP_6, 0) +            \
+                               op(OP_5, 0) +            \
+                               op(OP_4, 0)) +           \
+                      op(OP_1, op_sfb(OP_2, FEEDBACK))  \
+                     );                                 \
+        }
+
+/* algorithm 13 */
+#define DX7_ALGORITHM_13 { \
+            output = (                                   \
+                      op(OP_3, op_sfb(OP_6, FEEDBACK) +  \
+                               op(OP_5, 0) +             \
+                               op(OP_4, 0)) +            \
+                      op(OP_1, op(OP_2, 0))              \
+                     );                                  \
+        }
+
+/* algorithm 14 */
+#define DX7_ALGORITHM_14 { \
+            output = (                                            \
+                      op(OP_3, op(OP_4, op_sfb(OP_6, FEEDBACK) +  \
+                                        op(OP_5, 0))) +           \
+                      op(OP_1, op(OP_2, 0))                       \
+                     );                                           \
+        }
+
+/* algorithm 15 */
+#define DX7_ALGORITHM_15 { \
+            output = (                                   \
+                      op(OP_3, op(OP_4, op(OP_6, 0) +    \
+                                        op(OP_5, 0))) +  \
+                      op(OP_1, op_sfb(OP_2, FEEDBACK))   \
+                     );                                  \
+        }
+
+/* algorithm 16 */
+#define DX7_ALGORITHM_16 { \
+            output = op(OP_1, op(OP_5, op_sfb(OP_6, FEEDBACK)) +  \
+                              op(OP_3, op(OP_4, 0)) +             \
+                              op(OP_2, 0));                       \
+        }
+
+/* algorithm 17 */
+#define DX7_ALGORITHM_17 { \
+            output = op(OP_1, op(OP_5, op(OP_6, 0)) +   \
+                              op(OP_3, op(OP_4, 0)) +   \
+                              op_sfb(OP_2, FEEDBACK));  \
+        }
+
+/* algorithm 18 */
+#define DX7_ALGORITHM_18 { \
+            output = op(OP_1, op(OP_4, op(OP_5, op(OP_6, 0))) +  \
+                              op_sfb(OP_3, FEEDBACK) +           \
+                              op(OP_2, 0));                      \
+        }
+
+/* algorithm 19 */
+#define DX7_ALGORITHM_19 { \
+            i = op_sfb(OP_6, FEEDBACK);                \
+            output = (                                 \
+                      op(OP_5, i) +                    \
+                      op(OP_4, i) +                    \
+                      op(OP_1, op(OP_2, op(OP_3, 0)))  \
+                     );                                \
+        }
+
+/* algorithm 20 */
+#define DX7_ALGORITHM_20 { \
+            i = op_sfb(OP_3, FEEDBACK);        \
+            output = (                         \
+                      op(OP_4, op(OP_6, 0) +   \
+                               op(OP_5, 0)) +  \
+                      op(OP_2, i) +            \
+                      op(OP_1, i)              \
+                     );                        \
+        }
+
+/* algorithm 21 */
+#define DX7_ALGORITHM_21 { \
+            i = op(OP_6, 0);             \
+            output = op(OP_5, i) +       \
+                     op(OP_4, i);        \
+            i = op_sfb(OP_3, FEEDBACK);  \
+            output += op(OP_2, i) +      \
+                      op(OP_1, i);       \
+        }
+
+/* algorithm 22 */
+#define DX7_ALGORITHM_22 { \
+            i = op_sfb(OP_6, FEEDBACK);      \
+            output = (                       \
+                      op(OP_5, i) +          \
+                      op(OP_4, i) +          \
+                      op(OP_3, i) +          \
+                      op(OP_1, op(OP_2, 0))  \
+                     );                      \
+        }
+
+/* algorithm 23 */
+#define DX7_ALGORITHM_23 { \
+            i = op_sfb(OP_6, FEEDBACK);        \
+            output = (                         \
+                      op(OP_5, i) +            \
+                      op(OP_4, i) +            \
+                      op(OP_2, op(OP_3, 0)) +  \
+                      op(OP_1, 0)              \
+                     );                        \
+        }
+
+/* algorithm 24 */
+#define DX7_ALGORITHM_24 { \
+            i = op_sfb(OP_6, FEEDBACK);  \
+            output = (                   \
+                      op(OP_5, i) +      \
+                      op(OP_4, i) +      \
+                      op(OP_3, i) +      \
+                      op(OP_2, 0) +      \
+                      op(OP_1, 0)        \
+                     );                  \
+        }
+
+/* algorithm 25 */
+#define DX7_ALGORITHM_25 { \
+            i = op_sfb(OP_6, FEEDBACK);  \
+            output = (                   \
+                      op(OP_5, i) +      \
+                      op(OP_4, i) +      \
+                      op(OP_3, 0) +      \
+                      op(OP_2, 0) +      \
+                      op(OP_1, 0)        \
+                     );                  \
+        }
+
+/* algorithm 26 */
+#define DX7_ALGORITHM_26 { \
+            output = (                                   \
+                      op(OP_4, op_sfb(OP_6, FEEDBACK) +  \
+                               op(OP_5, 0)) +            \
+                      op(OP_2, op(OP_3, 0)) +            \
+                      op(OP_1, 0)                        \
+                     );                                  \
+        }
+
+/* algorithm 27 */
+#define DX7_ALGORITHM_27 { \
+            output = (                                    \
+                      op(OP_4, op(OP_6, 0) +              \
+                               op(OP_5, 0)) +             \
+                      op(OP_2, op_sfb(OP_3, FEEDBACK)) +  \
+                      op(OP_1, 0)                         \
+                     );                                   \
+        }
+
+/* algorithm 28 */
+#define DX7_ALGORITHM_28 { \
+            output = (                                              \
+                      op(OP_6, 0) +                                 \
+                      op(OP_3, op(OP_4, op_sfb(OP_5, FEEDBACK))) +  \
+                      op(OP_1, op(OP_2, 0))                         \
+                     );                                             \
+        }
+
+/* algorithm 29 */
+#define DX7_ALGORITHM_29 { \
+            output = (                                    \
+                      op(OP_5, op_sfb(OP_6, FEEDBACK)) +  \
+                      op(OP_3, op(OP_4, 0)) +             \
+                      op(OP_2, 0) +                       \
+                      op(OP_1, 0)                         \
+                     );                                   \
+        }
+
+/* algorithm 30 */
+#define DX7_ALGORITHM_30 { \
+            output = (                                              \
+                      op(OP_6, 0) +                                 \
+                      op(OP_3, op(OP_4, op_sfb(OP_5, FEEDBACK))) +  \
+                      op(OP_2, 0) +                                 \
+                      op(OP_1, 0)                                   \
+                     );                                             \
+        }
+
+/* algorithm 31 */
+#define DX7_ALGORITHM_31 { \
+            output = (                                    \
+                      op(OP_5, op_sfb(OP_6, FEEDBACK)) +  \
+                      op(OP_4, 0) +                       \
+                      op(OP_3, 0) +                       \
+                      op(OP_2, 0) +                       \
+                      op(OP_1, 0)                         \
+                     );                                   \
+        }
+
+/* algorithm 32 */
+#define DX7_ALGORITHM_32 { \
+            output = (                          \
+                      op_sfb(OP_6, FEEDBACK) +  \
+                      op(OP_5, 0) +             \
+                      op(OP_4, 0) +             \
+                      op(OP_3, 0) +             \
+                      op(OP_2, 0) +             \
+                      op(OP_1, 0)               \
+                     );                         \
+        }
+
+#endif /* _DX7_VOICE_RENDER_H */
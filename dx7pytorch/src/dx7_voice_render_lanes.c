@@ -0,0 +1,353 @@
+/* dx7pytorch: multi-voice renderer for the hexter DX7 core
+ *
+ * This program is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU General Public License as
+ * published by the Free Software Foundation; either version 2 of
+ * the License, or (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be
+ * useful, but WITHOUT ANY WARRANTY; without even the implied
+ * warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+ * PURPOSE.  See the GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public
+ * License along with this program; if not, write to the Free
+ * Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+ * Boston, MA 02110-1301 USA.
+ */
+
+#ifdef HAVE_CONFIG_H
+#include <config.h>
+#endif
+
+#define _DEFAULT_SOURCE 1
+#define _ISOC99_SOURCE  1
+
+#include <stdint.h>
+#include <math.h>
+
+#include "hexter_types.h"
+#include "hexter.h"
+#include "hexter_synth.h"
+#include "dx7_voice.h"
+#include "dx7_voice_render.h"
+
+#define L DX7_VOICE_LANES
+
+/* Per-sample voice state, one column per lane. */
+typedef struct {
+    dx7_sample_t  phase[MAX_DX7_OPERATORS][L];
+    dx7_sample_t  phase_increment[MAX_DX7_OPERATORS][L];
+    dx7_sample_t  eg_value[MAX_DX7_OPERATORS][L];
+    dx7_sample_t  eg_increment[MAX_DX7_OPERATORS][L];
+    int32_t       eg_duration[MAX_DX7_OPERATORS][L];
+    int           amp_mod_sens[MAX_DX7_OPERATORS][L];
+
+    dx7_sample_t  feedback[L];
+    dx7_sample_t  feedback_multiplier[L];
+
+    dx7_sample_t  amp_mod_env_value[L];
+    dx7_sample_t  amp_mod_env_increment[L];
+    int32_t       amp_mod_env_duration[L];
+    dx7_sample_t  amp_mod_lfo_mods_value[L];
+    dx7_sample_t  amp_mod_lfo_mods_increment[L];
+    int32_t       amp_mod_lfo_mods_duration[L];
+    dx7_sample_t  amp_mod_lfo_amd_value[L];
+    dx7_sample_t  amp_mod_lfo_amd_increment[L];
+    int32_t       amp_mod_lfo_amd_duration[L];
+    dx7_sample_t  lfo_delay_value[L];
+    dx7_sample_t  lfo_delay_increment[L];
+    int32_t       lfo_delay_duration[L];
+    float         volume_value[L];
+    float         volume_increment[L];
+    int32_t       volume_duration[L];
+
+    const dx7_sample_t *lfo_buffer[L];
+    LADSPA_Data  *out[L];
+} dx7_lanes_t;
+
+static void
+dx7_lanes_load(dx7_lanes_t *s, int l, dx7_voice_t *voice, const dx7_sample_t *lfo_buffer,
+               LADSPA_Data *out)
+{
+    int o;
+
+    for (o = 0; o < MAX_DX7_OPERATORS; o++) {
+        s->phase[o][l]           = voice->op[o].phase;
+        s->phase_increment[o][l] = voice->op[o].phase_increment;
+        s->eg_value[o][l]        = voice->op[o].eg.value;
+        s->eg_increment[o][l]    = voice->op[o].eg.increment;
+        s->eg_duration[o][l]     = voice->op[o].eg.duration;
+        s->amp_mod_sens[o][l]    = voice->op[o].amp_mod_sens;
+    }
+    s->feedback[l]                   = voice->feedback;
+    s->feedback_multiplier[l]        = voice->feedback_multiplier;
+    s->amp_mod_env_value[l]          = voice->amp_mod_env_value;
+    s->amp_mod_env_increment[l]      = voice->amp_mod_env_increment;
+    s->amp_mod_env_duration[l]       = voice->amp_mod_env_duration;
+    s->amp_mod_lfo_mods_value[l]     = voice->amp_mod_lfo_mods_value;
+    s->amp_mod_lfo_mods_increment[l] = voice->amp_mod_lfo_mods_increment;
+    s->amp_mod_lfo_mods_duration[l]  = voice->amp_mod_lfo_mods_duration;
+    s->amp_mod_lfo_amd_value[l]      = voice->amp_mod_lfo_amd_value;
+    s->amp_mod_lfo_amd_increment[l]  = voice->amp_mod_lfo_amd_increment;
+    s->amp_mod_lfo_amd_duration[l]   = voice->amp_mod_lfo_amd_duration;
+    s->lfo_delay_value[l]            = voice->lfo_delay_value;
+    s->lfo_delay_increment[l]        = voice->lfo_delay_increment;
+    s->lfo_delay_duration[l]         = voice->lfo_delay_duration;
+    s->volume_value[l]               = voice->volume_value;
+    s->volume_increment[l]           = voice->volume_increment;
+    s->volume_duration[l]            = voice->volume_duration;
+    s->lfo_buffer[l]                 = lfo_buffer;
+    s->out[l]                        = out;
+}
+
+static void
+dx7_lanes_store(dx7_lanes_t *s, int l, dx7_voice_t *voice)
+{
+    int o;
+
+    for (o = 0; o < MAX_DX7_OPERATORS; o++) {
+        voice->op[o].phase        = s->phase[o][l];
+        voice->op[o].eg.value     = s->eg_value[o][l];
+        voice->op[o].eg.increment = s->eg_increment[o][l];
+        voice->op[o].eg.duration  = s->eg_duration[o][l];
+    }
+    voice->feedback                 = s->feedback[l];
+    voice->amp_mod_env_value        = s->amp_mod_env_value[l];
+    voice->amp_mod_env_duration     = s->amp_mod_env_duration[l];
+    voice->amp_mod_lfo_mods_value   = s->amp_mod_lfo_mods_value[l];
+    voice->amp_mod_lfo_mods_duration = s->amp_mod_lfo_mods_duration[l];
+    voice->amp_mod_lfo_amd_value    = s->amp_mod_lfo_amd_value[l];
+    voice->amp_mod_lfo_amd_duration = s->amp_mod_lfo_amd_duration[l];
+    voice->lfo_delay_value          = s->lfo_delay_value[l];
+    voice->lfo_delay_increment      = s->lfo_delay_increment[l];
+    voice->lfo_delay_duration       = s->lfo_delay_duration[l];
+    voice->volume_value             = s->volume_value[l];
+    voice->volume_duration          = s->volume_duration[l];
+}
+
+/*
+ * dx7_voice_render_lanes
+ *
+ * Render sample_count samples of up to DX7_VOICE_LANES voices that all use
+ * the same algorithm, into instances[l]->output + samples_done. Voice l
+ * belongs to instances[l], whose LFO must already be updated for this burst.
+ * Every lane goes through exactly the same arithmetic as dx7_voice_render(),
+ * so the output is bitwise identical; the voice state is kept as arrays over
+ * lanes, and each step of the sample loop runs across all lanes at once.
+ */
+void
+dx7_voice_render_lanes(hexter_instance_t **instances, dx7_voice_t **voices,
+                       int nlanes, unsigned long samples_done,
+                       unsigned long sample_count, int do_control_update)
+{
+    dx7_lanes_t   s;
+    dx7_sample_t  ampmod[4][L];
+    dx7_sample_t  i, output;
+    unsigned long sample;
+    int           l, o, seg;
+
+    if (nlanes > L)
+        nlanes = L;
+
+    for (l = 0; l < nlanes; l++) {
+        hexter_instance_t *instance = instances[l];
+        dx7_voice_t *voice = voices[l];
+
+        if (!float_equality(voice->last_port_volume, *instance->volume) ||
+            voice->last_cc_volume != instance->cc_volume)
+            dx7_voice_recalculate_volume(instance, voice);
+
+        dx7_lanes_load(&s, l, voice, instance->lfo_buffer, instance->output + samples_done);
+        ampmod[0][l] = INT_TO_FP(0);
+    }
+
+#define op(_i, _p)     dx7_op_calculate_operator(s.eg_value[_i][l] - ampmod[s.amp_mod_sens[_i][l]][l], s.phase[_i][l] + _p)
+#define op_sfb(_i, _p) dx7_op_calculate_operator_saving_feedback(&s.feedback[l], s.feedback_multiplier[l], s.eg_value[_i][l] - ampmod[s.amp_mod_sens[_i][l]][l], s.phase[_i][l] + _p)
+#define FEEDBACK       s.feedback[l]
+
+#define RENDER_LANES \
+        for (sample = 0; sample < sample_count; sample++) { \
+            /* calculate amplitude modulation amounts */ \
+            for (l = 0; l < nlanes; l++) { \
+                i = FP_MULTIPLY(s.amp_mod_lfo_amd_value[l], s.lfo_delay_value[l]); \
+                i = s.amp_mod_env_value[l] + \
+                        FP_MULTIPLY(i + s.amp_mod_lfo_mods_value[l], s.lfo_buffer[l][sample]); \
+                ampmod[3][l] = i; \
+                ampmod[2][l] = FP_MULTIPLY(i, AMPMOD2_CONSTANT); \
+                ampmod[1][l] = FP_MULTIPLY(i, AMPMOD1_CONSTANT); \
+            } \
+            for (l = 0; l < nlanes; l++) { \
+                ALGORITHM; \
+                s.out[l][sample] += FP_TO_FLOAT(output) * s.volume_value[l]; \
+            } \
+            /* update runtime parameters for next sample */ \
+            for (o = 0; o < MAX_DX7_OPERATORS; o++) \
+                for (l = 0; l < nlanes; l++) \
+                    s.phase[o][l] += s.phase_increment[o][l]; \
+            for (o = MAX_DX7_OPERATORS - 1; o >= 0; o--) { \
+                for (l = 0; l < nlanes; l++) { \
+                    s.eg_value[o][l] += s.eg_increment[o][l]; \
+                    s.eg_duration[o][l]--; \
+                } \
+                for (l = 0; l < nlanes; l++) { \
+                    if (s.eg_duration[o][l] == 0) { \
+                        dx7_op_eg_t *eg = &voices[l]->op[o].eg; \
+                        eg->value = s.eg_value[o][l]; \
+                        eg->increment = s.eg_increment[o][l]; \
+                        eg->duration = 0; \
+                        dx7_op_eg_end_segment(instances[l], eg); \
+                        s.eg_value[o][l] = eg->value; \
+                        s.eg_increment[o][l] = eg->increment; \
+                        s.eg_duration[o][l] = eg->duration; \
+                    } \
+                } \
+            } \
+            for (l = 0; l < nlanes; l++) { \
+                if (s.amp_mod_env_duration[l]) { \
+                    s.amp_mod_env_value[l] += s.amp_mod_env_increment[l]; \
+                    s.amp_mod_env_duration[l]--; \
+                } \
+                if (s.amp_mod_lfo_mods_duration[l]) { \
+                    s.amp_mod_lfo_mods_value[l] += s.amp_mod_lfo_mods_increment[l]; \
+                    s.amp_mod_lfo_mods_duration[l]--; \
+                } \
+                if (s.amp_mod_lfo_amd_duration[l]) { \
+                    s.amp_mod_lfo_amd_value[l] += s.amp_mod_lfo_amd_increment[l]; \
+                    s.amp_mod_lfo_amd_duration[l]--; \
+                } \
+                if (s.volume_duration[l]) { \
+                    s.volume_value[l] += s.volume_increment[l]; \
+                    s.volume_duration[l]--; \
+                } \
+            } \
+            for (l = 0; l < nlanes; l++) { \
+                if (s.lfo_delay_duration[l]) { \
+                    s.lfo_delay_value[l] += s.lfo_delay_increment[l]; \
+                    if (--s.lfo_delay_duration[l] == 0) { \
+                        seg = ++voices[l]->lfo_delay_segment; \
+                        s.lfo_delay_duration[l]  = instances[l]->lfo_delay_duration[seg]; \
+                        s.lfo_delay_value[l]     = instances[l]->lfo_delay_value[seg]; \
+                        s.lfo_delay_increment[l] = instances[l]->lfo_delay_increment[seg]; \
+                    } \
+                } \
+            } \
+        }
+
+#define LANES_CASE(_n) \
+      case (_n) - 1: \
+        RENDER_LANES; \
+        break;
+
+    switch (voices[0]->algorithm) {
+#define ALGORITHM DX7_ALGORITHM_1
+      LANES_CASE(1)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_2
+      LANES_CASE(2)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_3
+      LANES_CASE(3)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_4
+      LANES_CASE(4)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_5
+      LANES_CASE(5)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_6
+      LANES_CASE(6)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_7
+      LANES_CASE(7)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_8
+      LANES_CASE(8)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_9
+      LANES_CASE(9)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_10
+      LANES_CASE(10)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_11
+      LANES_CASE(11)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_12
+      LANES_CASE(12)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_13
+      LANES_CASE(13)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_14
+      LANES_CASE(14)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_15
+      LANES_CASE(15)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_16
+      LANES_CASE(16)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_17
+      LANES_CASE(17)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_18
+      LANES_CASE(18)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_19
+      LANES_CASE(19)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_20
+      LANES_CASE(20)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_21
+      LANES_CASE(21)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_22
+      LANES_CASE(22)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_23
+      LANES_CASE(23)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_24
+      LANES_CASE(24)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_25
+      LANES_CASE(25)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_26
+      LANES_CASE(26)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_27
+      LANES_CASE(27)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_28
+      LANES_CASE(28)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_29
+      LANES_CASE(29)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_30
+      LANES_CASE(30)
+#undef ALGORITHM
+#define ALGORITHM DX7_ALGORITHM_31
+      LANES_CASE(31)
+#undef ALGORITHM
+      default: /* just in case, as in dx7_voice_render() */
+#define ALGORITHM DX7_ALGORITHM_32
+      LANES_CASE(32)
+#undef ALGORITHM
+    }
+
+#undef LANES_CASE
+#undef RENDER_LANES
+#undef op
+#undef op_sfb
+#undef FEEDBACK
+
+    for (l = 0; l < nlanes; l++) {
+        dx7_lanes_store(&s, l, voices[l]);
+        if (do_control_update)
+            dx7_voice_render_control(instances[l], voices[l]);
+    }
+}
@@ -37,11 +37,13 @@
 #define _ISOC99_SOURCE  1
 
 #include <math.h>
+#include <pthread.h>
 
 #include "hexter_types.h"
 #include "dx7_voice.h"
 
-static int dx7_voice_tables_initialized = 0;
+/* dx7pytorch: instances may be created from several threads at once. */
+static pthread_once_t dx7_voice_tables_once = PTHREAD_ONCE_INIT;
 
 dx7_sample_t    dx7_voice_sin_table[SINE_SIZE + 1];
 
@@ -49,33 +51,33 @@ extern dx7_sample_t dx7_voice_eg_ol_to_mod_index_table[257]; /* forward */
 
 dx7_sample_t  *dx7_voice_eg_ol_to_mod_index = &dx7_voice_eg_ol_to_mod_index_table[128];
 
-void dx7_voice_init_tables(void) {
+static void dx7_voice_fill_tables(void) {
 
     int i;
     double f;
 
-    if (!dx7_voice_tables_initialized) {
-
-        for (i = 0; i <= SINE_SIZE; i++) {
+    for (i = 0; i <= SINE_SIZE; i++) {
 
-            /* observation of my TX7's output with oscillator sync on suggests
-             * it uses cosine */
-            f = cos((double)(i) / SINE_SIZE * (2 * M_PI));  /* index / index max * radian cycle */
-            dx7_voice_sin_table[i] = DOUBLE_TO_FP(f);
-        }
+        /* observation of my TX7's output with oscillator sync on suggests
+         * it uses cosine */
+        f = cos((double)(i) / SINE_SIZE * (2 * M_PI));  /* index / index max * radian cycle */
+        dx7_voice_sin_table[i] = DOUBLE_TO_FP(f);
+    }
 
 #ifndef HEXTER_USE_FLOATING_POINT
 #if FP_SHIFT != 24
-        /* Any fixed-point tables below are in s7.24 format.  Shift
-         * them to match FP_SHIFT. */
-        for (i = 0; i <= 256; i++) {
-            dx7_voice_eg_ol_to_mod_index_table[i] >>= (24 - FP_SHIFT);
-        }
+    /* Any fixed-point tables below are in s7.24 format.  Shift
+     * them to match FP_SHIFT. */
+    for (i = 0; i <= 256; i++) {
+        dx7_voice_eg_ol_to_mod_index_table[i] >>= (24 - FP_SHIFT);
+    }
 #endif
 #endif /* ! HEXTER_USE_FLOATING_POINT */
+}
 
-        dx7_voice_tables_initialized = 1;
-    }
+void dx7_voice_init_tables(void) {
+
+    pthread_once(&dx7_voice_tables_once, dx7_voice_fill_tables);
 }
 
 /* This table lists which operators of an algorithm are carriers.  Bit 0 (LSB)
@@ -30,6 +30,7 @@
 #include <stdlib.h>
 #include <stdio.h>
 #include <string.h>
+#include <math.h>
 
 #include "hexter_types.h"
 #include "hexter.h"
@@ -47,9 +48,26 @@
 static void hexter_activate(hexter_instance_t* handle)
 {
     hexter_instance_t *instance = (hexter_instance_t *)handle;
+    int i, j;
 
     hexter_instance_all_voices_off(instance);  /* stop all sounds immediately */
     instance->current_voices = 0;
+    if (instance->stats_enabled)
+        instance->stats.resets++;
+
+    /* dx7pytorch: clear everything a previous note could leave behind, so
+     * a render only depends on its own patch, note and velocity, and not on
+     * which instance (or thread) rendered it before. */
+    instance->nugget_remains = 0;
+    instance->rand_state = DX7_RAND_SEED;
+    instance->decoded_patch = NULL;
+    instance->stop_when_silent = 0;
+    for (i = 0; i < HEXTER_MAX_POLYPHONY; i++) {
+        instance->voice[i]->feedback = INT_TO_FP(0);
+        for (j = 0; j < MAX_DX7_OPERATORS; j++)
+            instance->voice[i]->op[j].phase = INT_TO_FP(0);
+    }
+
     dx7_lfo_reset(instance);
 }
 
@@ -119,6 +137,12 @@ hexter_instantiate(unsigned long sample_rate, dx7_patch_t * patch_buffer)
 
     instance->sample_rate = (float)sample_rate;
     instance->nugget_remains = 0;
+    instance->rate_tables = dx7_rate_tables_get(instance->sample_rate);
+    if (!instance->rate_tables) {
+        DEBUG_MESSAGE(-1, " hexter_instantiate: out of memory!\n");
+        hexter_cleanup(instance);
+        return NULL;
+    }
     dx7_eg_init_constants(instance);  /* depends on sample rate */
 
     instance->note_id = 0;
@@ -160,6 +184,15 @@ hexter_run_synth(hexter_instance_t* handle, unsigned long sample_count, unsigned
 
     while (samples_done < sample_count) {
 
+        /* dx7pytorch: once every voice is dead, the rest of the buffer stays
+         * silent. Batch renders start each job from a reset, so nothing
+         * after this point is observable. */
+        if (instance->stop_when_silent && !instance->current_voices) {
+            if (instance->stats_enabled)
+                instance->stats.samples_skipped += sample_count - samples_done;
+            break;
+        }
+
         if (!instance->nugget_remains)
             instance->nugget_remains = HEXTER_NUGGET_SIZE;
 
@@ -199,8 +232,10 @@ hexter_instance_t* hexter_init(unsigned long sample_rate,dx7_patch_t * patch_buf
     
     //printf("[DEBUG] dxcore.so: Library called. Attemping to create hexter instance . . .\n");
     
-    hexter_instance_t* instance = hexter_instantiate(16000,         //Sample rate.
+    hexter_instance_t* instance = hexter_instantiate(sample_rate,   //Sample rate.
                                                     patch_buffer);  //Patch buffer provided by Python.
+    if (!instance)
+        return NULL;
 
 
     //printf("[DEBUG] dxcore.so: Adding tuning, volume and output controls\n"); //They are set by LADSPA in original hexter.
@@ -235,6 +270,622 @@ void synthesize(hexter_instance_t* instance,LADSPA_Data* output_buffer,unsigned
     return;
     }
 
+/* Upper limit of every unpacked parameter, as in dx7pytorch/dxsynth/dxsynth.py. */
+static const uint8_t dx7_unpacked_max[DX7_VOICE_SIZE_UNPACKED] = {
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 3, 3, 7, 3, 7, 99, 1, 31, 99, 14,  /* op6 */
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 3, 3, 7, 3, 7, 99, 1, 31, 99, 14,  /* op5 */
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 3, 3, 7, 3, 7, 99, 1, 31, 99, 14,  /* op4 */
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 3, 3, 7, 3, 7, 99, 1, 31, 99, 14,  /* op3 */
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 3, 3, 7, 3, 7, 99, 1, 31, 99, 14,  /* op2 */
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 3, 3, 7, 3, 7, 99, 1, 31, 99, 14,  /* op1 */
+    99, 99, 99, 99, 99, 99, 99, 99,                                                /* pitch eg */
+    31, 7, 1, 99, 99, 99, 99, 1, 5, 7, 48,                                         /* algorithm etc */
+    126, 126, 126, 126, 126, 126, 126, 126, 126, 126                               /* name */
+};
+
+/** Play one note on the patch already loaded in current_patch_buffer.
+    Returns the length of the note: one past the last sample whose magnitude
+    is above silence_threshold, or 0 if the whole note is below it. */
+static unsigned long
+hexter_render_job(hexter_instance_t* instance, unsigned char note, unsigned char velocity,
+                  unsigned long note_on_len, unsigned long note_off_len, LADSPA_Data* output,
+                  float silence_threshold)
+{
+    unsigned long length = note_on_len + note_off_len;
+
+    instance->output = output;
+    instance->stop_when_silent = 1;
+    hexter_instance_note_on(instance, note, velocity);
+    hexter_run_synth(instance, note_on_len, 0);
+    hexter_instance_note_off(instance, note, velocity);
+    hexter_run_synth(instance, note_on_len + note_off_len, note_on_len);
+    instance->stop_when_silent = 0;
+
+    while (length > 0 && fabsf(output[length - 1]) <= silence_threshold)
+        length--;
+    return length;
+}
+
+/* dx7pytorch: decoded patches are handed to Python as rows of bytes */
+typedef char dx7_voice_patch_size_check[(sizeof(dx7_voice_patch_t) == DX7_VOICE_SIZE_DECODED) ? 1 : -1];
+
+/** Reset an instance and load the patch of job i: packed patch i, unpacked
+    here, or decoded patch i if decoded is not NULL (see
+    hexter_decode_patches), which the note then starts from directly. */
+static void
+hexter_load_job(hexter_instance_t* instance, dx7_patch_t* patches,
+                const dx7_voice_patch_t* decoded, unsigned long i)
+{
+    hexter_activate(instance);
+    instance->current_program = 0;
+    if (decoded) {
+        instance->decoded_patch = &decoded[i];
+        return;
+    }
+    dx7_patch_unpack(&patches[i], 0, instance->current_patch_buffer);
+    if (instance->stats_enabled)
+        instance->stats.program_changes++;
+}
+
+static void
+hexter_render_jobs(hexter_instance_t* instance, dx7_patch_t* patches, const dx7_voice_patch_t* decoded,
+                   unsigned char* notes, unsigned char* velocities,
+                   unsigned long note_on_len, unsigned long note_off_len,
+                   LADSPA_Data* output_buffer, unsigned long n_jobs,
+                   unsigned long* lengths, float silence_threshold)
+{
+    unsigned long nsamples = note_on_len + note_off_len;
+    unsigned long i, length;
+
+    for (i = 0; i < n_jobs; i++) {
+        hexter_load_job(instance, patches, decoded, i);
+        length = hexter_render_job(instance, notes[i], velocities[i], note_on_len, note_off_len,
+                                   output_buffer + i * nsamples, silence_threshold);
+        if (lengths)
+            lengths[i] = length;
+    }
+}
+
+/** Render a batch of independent notes in a single call.
+    Job i is reset, loaded with packed patch i, played for note_on_len samples
+    and released for note_off_len samples into row i of output_buffer, which
+    must hold n_jobs * (note_on_len + note_off_len) floats. Rendering of a job
+    stops as soon as its voice is dead; the rest of its row is left silent.
+    If lengths is not NULL, lengths[i] receives the length of job i as
+    returned by hexter_render_job. */
+void hexter_render_batch(hexter_instance_t* instance,
+                         dx7_patch_t* patches,
+                         unsigned char* notes,
+                         unsigned char* velocities,
+                         unsigned long note_on_len,
+                         unsigned long note_off_len,
+                         LADSPA_Data* output_buffer,
+                         unsigned long n_jobs,
+                         unsigned long* lengths,
+                         float silence_threshold)
+    {
+    hexter_render_jobs(instance, patches, NULL, notes, velocities, note_on_len, note_off_len,
+                       output_buffer, n_jobs, lengths, silence_threshold);
+    }
+
+/** Decode n packed patches once into the voice parameters every note on
+    them starts from: decoded receives n dx7_voice_patch_t, of
+    DX7_VOICE_SIZE_DECODED bytes each. */
+void hexter_decode_patches(dx7_patch_t* patches, unsigned long n, dx7_voice_patch_t* decoded)
+    {
+    uint8_t edit_buffer[DX7_VOICE_SIZE_UNPACKED];
+    unsigned long i;
+
+    for (i = 0; i < n; i++)
+        {
+        dx7_patch_unpack(&patches[i], 0, edit_buffer);
+        dx7_voice_patch_decode(edit_buffer, &decoded[i]);
+        }
+    }
+
+/** Same as hexter_render_batch, but job i starts from patch i decoded by
+    hexter_decode_patches instead of unpacking and decoding a packed patch. */
+void hexter_render_batch_decoded(hexter_instance_t* instance,
+                                 const dx7_voice_patch_t* decoded,
+                                 unsigned char* notes,
+                                 unsigned char* velocities,
+                                 unsigned long note_on_len,
+                                 unsigned long note_off_len,
+                                 LADSPA_Data* output_buffer,
+                                 unsigned long n_jobs,
+                                 unsigned long* lengths,
+                                 float silence_threshold)
+    {
+    hexter_render_jobs(instance, NULL, decoded, notes, velocities, note_on_len, note_off_len,
+                       output_buffer, n_jobs, lengths, silence_threshold);
+    }
+
+/** Same as hexter_render_batch, but patch i is given as row i of an unpacked
+    float parameter array with n_parameters columns (145 without name, or 155).
+    Parameters are rounded to the nearest integer and clamped to their range;
+    a missing name is left blank. */
+void hexter_render_batch_unpacked(hexter_instance_t* instance,
+                                  const float* parameters,
+                                  unsigned long n_parameters,
+                                  unsigned char* notes,
+                                  unsigned char* velocities,
+                                  unsigned long note_on_len,
+                                  unsigned long note_off_len,
+                                  LADSPA_Data* output_buffer,
+                                  unsigned long n_jobs,
+                                  unsigned long* lengths,
+                                  float silence_threshold)
+    {
+    unsigned long nsamples = note_on_len + note_off_len;
+    unsigned long i, j, length;
+    uint8_t *edit_buffer = instance->current_patch_buffer;
+    const float *row;
+    float value;
+
+    if (n_parameters > DX7_VOICE_SIZE_UNPACKED)
+        n_parameters = DX7_VOICE_SIZE_UNPACKED;
+
+    for (i = 0; i < n_jobs; i++)
+        {
+        hexter_activate(instance);
+        instance->current_program = 0;
+        if (instance->stats_enabled)
+            instance->stats.program_changes++;
+        row = parameters + i * n_parameters;
+        memset(edit_buffer, 0, DX7_VOICE_SIZE_UNPACKED);
+        for (j = 0; j < n_parameters; j++)
+            {
+            value = row[j];
+            if (!(value > 0.0f))        /* also catches NaN */
+                edit_buffer[j] = 0;
+            else if (value >= dx7_unpacked_max[j])
+                edit_buffer[j] = dx7_unpacked_max[j];
+            else
+                edit_buffer[j] = (uint8_t)lrintf(value);
+            }
+        length = hexter_render_job(instance, notes[i], velocities[i], note_on_len, note_off_len,
+                                   output_buffer + i * nsamples, silence_threshold);
+        if (lengths)
+            lengths[i] = length;
+        }
+
+    return;
+    }
+
+/** Render up to DX7_VOICE_LANES jobs side by side, one per instance, all
+    patches already unpacked into the instances. Follows the same burst
+    schedule as hexter_render_job on every lane, so each row is bitwise
+    identical to what hexter_render_batch produces. */
+static void
+hexter_render_lanes(hexter_instance_t** instances, unsigned long nlanes,
+                    unsigned char* notes, unsigned char* velocities,
+                    unsigned long note_on_len, unsigned long note_off_len,
+                    LADSPA_Data** outputs, unsigned long* lengths,
+                    float silence_threshold)
+{
+    unsigned long nsamples = note_on_len + note_off_len;
+    unsigned long samples_done = 0, nugget_remains = 0;
+    unsigned long burst_size, end, l, k, nplaying, nsame;
+    hexter_instance_t *playing_instances[DX7_VOICE_LANES], *same_instances[DX7_VOICE_LANES];
+    dx7_voice_t *playing[DX7_VOICE_LANES], *same[DX7_VOICE_LANES];
+    hexter_instance_t *instance;
+    dx7_voice_t *voice;
+    int do_control_update;
+    /* all lanes of a DXSynth have their stats enabled together */
+    int stats_enabled = instances[0]->stats_enabled;
+    double start = 0.0, stop;
+
+    for (l = 0; l < nlanes; l++) {
+        instances[l]->output = outputs[l];
+        memset(outputs[l], 0, sizeof(LADSPA_Data) * nsamples);
+        hexter_instance_note_on(instances[l], notes[l], velocities[l]);
+    }
+
+    while (samples_done < nsamples) {
+
+        if (samples_done == note_on_len)
+            for (l = 0; l < nlanes; l++)
+                hexter_instance_note_off(instances[l], notes[l], velocities[l]);
+
+        /* same burst size as hexter_run_synth */
+        if (!nugget_remains)
+            nugget_remains = HEXTER_NUGGET_SIZE;
+        end = samples_done < note_on_len ? note_on_len : nsamples;
+        burst_size = nugget_remains;
+        if (end - samples_done < burst_size)
+            burst_size = end - samples_done;
+        do_control_update = (burst_size == nugget_remains);
+
+        /* once released, stop as soon as every lane is dead */
+        if (samples_done >= note_on_len) {
+            for (l = 0; l < nlanes && !instances[l]->current_voices; l++)
+                ;
+            if (l == nlanes) {
+                if (stats_enabled)
+                    for (l = 0; l < nlanes; l++)
+                        instances[l]->stats.samples_skipped += nsamples - samples_done;
+                break;
+            }
+        }
+
+        nplaying = 0;
+        for (l = 0; l < nlanes; l++) {
+            instance = instances[l];
+            if (!instance->current_voices) {
+                if (stats_enabled)
+                    instance->stats.samples_skipped += burst_size;
+                continue;
+            }
+            if (stats_enabled) {
+                start = hexter_stats_clock();
+                instance->stats.samples_rendered += burst_size;
+                if (do_control_update)
+                    instance->stats.nuggets++;
+            }
+            dx7_lfo_update(instance, burst_size);
+            for (k = 0; k < instance->max_voices; k++) {
+                voice = instance->voice[k];
+                if (_PLAYING(voice)) {
+                    if (voice->mods_serial != instance->mods_serial) {
+                        dx7_voice_update_mod_depths(instance, voice);
+                        voice->mods_serial = instance->mods_serial;
+                    }
+                    playing_instances[nplaying] = instance;
+                    playing[nplaying++] = voice;
+                }
+            }
+            if (stats_enabled)
+                instance->stats.control_seconds += hexter_stats_clock() - start;
+        }
+
+        /* Lanes are grouped by algorithm by the caller, but a kernel call
+         * needs them to match exactly. */
+        while (nplaying) {
+            nsame = 0;
+            for (l = 0, k = 0; l < nplaying; l++) {
+                if (playing[l]->algorithm == playing[0]->algorithm) {
+                    same_instances[nsame] = playing_instances[l];
+                    same[nsame++] = playing[l];
+                } else {
+                    playing_instances[k] = playing_instances[l];
+                    playing[k++] = playing[l];
+                }
+            }
+            nplaying = k;
+            if (!stats_enabled) {
+                dx7_voice_render_lanes(same_instances, same, nsame, samples_done,
+                                       burst_size, do_control_update);
+                continue;
+            }
+            /* split the kernel time evenly between its lanes */
+            start = hexter_stats_clock();
+            dx7_voice_render_lanes(same_instances, same, nsame, samples_done,
+                                   burst_size, 0);
+            stop = hexter_stats_clock();
+            for (l = 0; l < nsame; l++) {
+                hexter_stats_t *stats = &same_instances[l]->stats;
+                stats->render_seconds += (stop - start) / nsame;
+                stats->algorithm_seconds[same[l]->algorithm & 0x1f] += (stop - start) / nsame;
+                stats->algorithm_samples[same[l]->algorithm & 0x1f] += burst_size;
+                if (do_control_update) {
+                    start = hexter_stats_clock();
+                    dx7_voice_render_control(same_instances[l], same[l]);
+                    stats->control_seconds += hexter_stats_clock() - start;
+                }
+            }
+        }
+
+        samples_done += burst_size;
+        nugget_remains -= burst_size;
+    }
+
+    for (l = 0; l < nlanes; l++) {
+        unsigned long length = nsamples;
+        while (length > 0 && fabsf(outputs[l][length - 1]) <= silence_threshold)
+            length--;
+        if (lengths)
+            lengths[l] = length;
+    }
+}
+
+static void
+hexter_render_jobs_lanes(hexter_instance_t** instances, unsigned long nlanes,
+                         dx7_patch_t* patches, const dx7_voice_patch_t* decoded,
+                         unsigned char* notes, unsigned char* velocities,
+                         unsigned long note_on_len, unsigned long note_off_len,
+                         LADSPA_Data* output_buffer, unsigned long n_jobs,
+                         unsigned long* lengths, float silence_threshold)
+{
+    unsigned long nsamples = note_on_len + note_off_len;
+    unsigned long i, l, n;
+    unsigned long jobs[DX7_VOICE_LANES], job_lengths[DX7_VOICE_LANES];
+    unsigned char lane_notes[DX7_VOICE_LANES], lane_velocities[DX7_VOICE_LANES];
+    LADSPA_Data *outputs[DX7_VOICE_LANES];
+    int algorithm, job_algorithm;
+
+    if (nlanes > DX7_VOICE_LANES)
+        nlanes = DX7_VOICE_LANES;
+    if (nlanes == 0)
+        return;
+
+    for (algorithm = 0; algorithm < 32; algorithm++) {
+        i = 0;
+        while (i < n_jobs) {
+            for (n = 0; n < nlanes && i < n_jobs; i++) {
+                if (decoded)
+                    job_algorithm = decoded[i].algorithm;
+                else
+                    job_algorithm = ((uint8_t *)&patches[i])[110] & 0x1f;
+                if (job_algorithm != algorithm)
+                    continue;
+                jobs[n] = i;
+                lane_notes[n] = notes[i];
+                lane_velocities[n] = velocities[i];
+                outputs[n] = output_buffer + i * nsamples;
+                hexter_load_job(instances[n], patches, decoded, i);
+                n++;
+            }
+            if (n == 0)
+                break;
+            hexter_render_lanes(instances, n, lane_notes, lane_velocities, note_on_len, note_off_len,
+                                outputs, job_lengths, silence_threshold);
+            if (lengths)
+                for (l = 0; l < n; l++)
+                    lengths[jobs[l]] = job_lengths[l];
+        }
+    }
+}
+
+/** Same as hexter_render_batch, rendering nlanes jobs at a time with one
+    instance per lane. Jobs are grouped by algorithm so that the voices
+    rendered side by side run the same operator graph. */
+void hexter_render_batch_lanes(hexter_instance_t** instances,
+                               unsigned long nlanes,
+                               dx7_patch_t* patches,
+                               unsigned char* notes,
+                               unsigned char* velocities,
+                               unsigned long note_on_len,
+                               unsigned long note_off_len,
+                               LADSPA_Data* output_buffer,
+                               unsigned long n_jobs,
+                               unsigned long* lengths,
+                               float silence_threshold)
+    {
+    hexter_render_jobs_lanes(instances, nlanes, patches, NULL, notes, velocities, note_on_len,
+                             note_off_len, output_buffer, n_jobs, lengths, silence_threshold);
+    }
+
+/** Same as hexter_render_batch_lanes, starting from patches decoded by
+    hexter_decode_patches. */
+void hexter_render_batch_lanes_decoded(hexter_instance_t** instances,
+                                       unsigned long nlanes,
+                                       const dx7_voice_patch_t* decoded,
+                                       unsigned char* notes,
+                                       unsigned char* velocities,
+                                       unsigned long note_on_len,
+                                       unsigned long note_off_len,
+                                       LADSPA_Data* output_buffer,
+                                       unsigned long n_jobs,
+                                       unsigned long* lengths,
+                                       float silence_threshold)
+    {
+    hexter_render_jobs_lanes(instances, nlanes, NULL, decoded, notes, velocities, note_on_len,
+                             note_off_len, output_buffer, n_jobs, lengths, silence_threshold);
+    }
+
+/* dx7pytorch: streamed notes do not own an instance. Between blocks, the
+ * state of each note (its instance fields and its voice) lives in a buffer
+ * of the caller, and is swapped into one of a few reused instances to
+ * render. Streams play one voice per instance, so only the first voice is
+ * kept; the others must be off. */
+#define HEXTER_STREAM_STATE_SIZE  (sizeof(hexter_instance_t) + sizeof(dx7_voice_t))
+
+/** Bytes of the state of one streamed note. */
+unsigned long hexter_stream_state_size(void)
+    {
+    return HEXTER_STREAM_STATE_SIZE;
+    }
+
+static void
+hexter_stream_save(const hexter_instance_t* instance, unsigned char* state)
+{
+    memcpy(state, instance, sizeof(hexter_instance_t));
+    memcpy(state + sizeof(hexter_instance_t), instance->voice[0], sizeof(dx7_voice_t));
+}
+
+static void
+hexter_stream_restore(hexter_instance_t* instance, const unsigned char* state)
+{
+    /* Keep what belongs to the instance itself: its voices, buffers,
+     * controls and stats. */
+    hexter_instance_t own = *instance;
+    dx7_voice_t *saved_voice;
+    dx7_voice_t *saved_mono_voice;
+    int i;
+
+    memcpy(instance, state, sizeof(hexter_instance_t));
+    /* Voice of the instance the state was saved from, to map mono_voice. */
+    saved_voice = instance->voice[0];
+    saved_mono_voice = instance->mono_voice;
+    instance->next = own.next;
+    instance->output = own.output;
+    instance->tuning = own.tuning;
+    instance->volume = own.volume;
+    instance->patches = own.patches;
+    instance->stats_enabled = own.stats_enabled;
+    instance->stats = own.stats;
+    for (i = 0; i < HEXTER_MAX_POLYPHONY; i++)
+        instance->voice[i] = own.voice[i];
+    memcpy(instance->voice[0], state + sizeof(hexter_instance_t), sizeof(dx7_voice_t));
+    instance->voice[0]->instance = instance;
+    instance->mono_voice = (saved_mono_voice && saved_mono_voice == saved_voice) ? instance->voice[0] : NULL;
+}
+
+/** Start n streamed notes on instance: note k is loaded with packed patch
+    k (or decoded patch k if decoded is not NULL), started, and its state
+    saved to states + k * hexter_stream_state_size(). Their samples are then
+    rendered block by block with hexter_stream_render. The instance is left
+    as it was. */
+void hexter_stream_start(hexter_instance_t* instance,
+                         unsigned long n,
+                         dx7_patch_t* patches,
+                         const dx7_voice_patch_t* decoded,
+                         unsigned char* notes,
+                         unsigned char* velocities,
+                         unsigned char* states)
+    {
+    unsigned char own[HEXTER_STREAM_STATE_SIZE];
+    unsigned long k;
+
+    hexter_stream_save(instance, own);
+    for (k = 0; k < n; k++)
+        {
+        hexter_load_job(instance, patches, decoded, k);
+        instance->stop_when_silent = 1;
+        hexter_instance_note_on(instance, notes[k], velocities[k]);
+        hexter_stream_save(instance, states + k * HEXTER_STREAM_STATE_SIZE);
+        }
+    hexter_stream_restore(instance, own);
+    }
+
+/** Render samples [start, end) of the n notes whose states hexter_stream_start
+    saved into row k of output, which must hold n * (end - start) floats, and
+    save their states again. Notes are released at sample note_on_len, so
+    consecutive blocks are bitwise identical to the rows hexter_render_batch
+    renders. The instance is left as it was. */
+void hexter_stream_render(hexter_instance_t* instance,
+                          unsigned long n,
+                          unsigned char* notes,
+                          unsigned char* velocities,
+                          unsigned long note_on_len,
+                          unsigned long start,
+                          unsigned long end,
+                          LADSPA_Data* output,
+                          unsigned char* states)
+    {
+    unsigned char own[HEXTER_STREAM_STATE_SIZE];
+    unsigned long nsamples = end - start;
+    unsigned long k;
+
+    hexter_stream_save(instance, own);
+    for (k = 0; k < n; k++)
+        {
+        hexter_stream_restore(instance, states + k * HEXTER_STREAM_STATE_SIZE);
+        instance->output = output + k * nsamples;
+        if (note_on_len >= start && note_on_len < end)
+            {
+            hexter_run_synth(instance, note_on_len - start, 0);
+            hexter_instance_note_off(instance, notes[k], velocities[k]);
+            hexter_run_synth(instance, nsamples, note_on_len - start);
+            }
+        else
+            hexter_run_synth(instance, nsamples, 0);
+        hexter_stream_save(instance, states + k * HEXTER_STREAM_STATE_SIZE);
+        }
+    hexter_stream_restore(instance, own);
+    }
+
+/* dx7pytorch: one event of a timeline, mirrored by TIMELINE_EVENT in
+ * dxsynth.py. Events are sorted by offset. */
+#define HEXTER_EVENT_NOTE_ON         0
+#define HEXTER_EVENT_NOTE_OFF        1
+#define HEXTER_EVENT_PITCH_BEND      2   /* value: -8192 - 8191 */
+#define HEXTER_EVENT_CONTROL_CHANGE  3   /* cc, value: 0 - 127 */
+
+typedef struct {
+    uint64_t offset;     /* sample the event happens at */
+    int32_t  value;
+    uint8_t  type;
+    uint8_t  note;
+    uint8_t  velocity;
+    uint8_t  cc;
+} hexter_event_t;
+
+typedef char hexter_event_size_check[(sizeof(hexter_event_t) == 16) ? 1 : -1];
+
+static void
+hexter_apply_event(hexter_instance_t* instance, const hexter_event_t* event)
+{
+    switch (event->type) {
+      case HEXTER_EVENT_NOTE_ON:
+        if (event->velocity)
+            hexter_instance_note_on(instance, event->note, event->velocity);
+        else  /* MIDI running status: note on at velocity 0 is a note off */
+            hexter_instance_note_off(instance, event->note, 64);
+        break;
+      case HEXTER_EVENT_NOTE_OFF:
+        hexter_instance_note_off(instance, event->note, event->velocity);
+        break;
+      case HEXTER_EVENT_PITCH_BEND:
+        hexter_instance_pitch_bend(instance, event->value);
+        break;
+      case HEXTER_EVENT_CONTROL_CHANGE:
+        hexter_instance_control_change(instance, event->cc, event->value);
+        break;
+    }
+}
+
+/** Render n timelines of nsamples each on instance, one after the other.
+    Timeline k plays packed patch k with up to polyphony voices, from reset
+    controllers, and its events are events[bounds[k]] to events[bounds[k + 1] - 1].
+    Events at or past nsamples are ignored. Row k of output, which must
+    hold n * nsamples floats, gets the mix of its voices. The instance is
+    left as it was. */
+void hexter_render_timelines(hexter_instance_t* instance,
+                             dx7_patch_t* patches,
+                             const hexter_event_t* events,
+                             const unsigned long* bounds,
+                             unsigned long n,
+                             unsigned long polyphony,
+                             unsigned long nsamples,
+                             LADSPA_Data* output)
+    {
+    unsigned char own[HEXTER_STREAM_STATE_SIZE];
+    unsigned long k, e, done, until;
+
+    if (polyphony < 1 || polyphony > HEXTER_MAX_POLYPHONY)
+        return;
+    hexter_stream_save(instance, own);
+    for (k = 0; k < n; k++)
+        {
+        instance->polyphony = polyphony;
+        instance->max_voices = polyphony;
+        hexter_load_job(instance, patches, NULL, k);
+        hexter_instance_init_controls(instance);
+        instance->output = output + k * nsamples;
+        e = bounds[k];
+        done = 0;
+        while (done < nsamples)
+            {
+            for (; e < bounds[k + 1] && events[e].offset <= done; e++)
+                hexter_apply_event(instance, &events[e]);
+            until = (e < bounds[k + 1] && events[e].offset < nsamples) ? events[e].offset : nsamples;
+            hexter_run_synth(instance, until, done);
+            done = until;
+            }
+        hexter_instance_all_voices_off(instance);
+        }
+    /* Back to one voice and the controllers the instance had. */
+    hexter_stream_restore(instance, own);
+    }
+
+/** Start (enabled != 0) or stop updating the stats of an instance. */
+void hexter_set_stats_enabled(hexter_instance_t* instance, int enabled)
+    {
+    instance->stats_enabled = enabled;
+    }
+
+/** Stats of an instance, updated in place while they are enabled. */
+hexter_stats_t* hexter_get_stats(hexter_instance_t* instance)
+    {
+    return &instance->stats;
+    }
+
+void hexter_reset_stats(hexter_instance_t* instance)
+    {
+    memset(&instance->stats, 0, sizeof(hexter_stats_t));
+    }
+
 void hexter_clean_and_exit(hexter_instance_t* instance)
     {
     free(instance->tuning);
@@ -76,7 +76,9 @@
 
 /* ==== end of debugging ==== */
 
-#define HEXTER_MAX_POLYPHONY      1
+/* dx7pytorch: batch renders play one voice per instance (the default);
+ * hexter_render_timelines raises it up to the 16 voices of a DX7. */
+#define HEXTER_MAX_POLYPHONY      16
 #define HEXTER_DEFAULT_POLYPHONY  1
 
 #define HEXTER_NUGGET_SIZE    64
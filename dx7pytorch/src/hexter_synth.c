@@ -290,6 +290,9 @@ hexter_instance_note_on(hexter_instance_t *instance, unsigned char key,
     if (key > 127 || velocity > 127)
         return;  /* MidiKeys 1.6b3 sends bad notes.... */
 
+    if (instance->stats_enabled)
+        instance->stats.notes++;
+
     if (instance->monophonic) {
 
         if (instance->mono_voice) {
@@ -831,6 +834,8 @@ hexter_instance_select_program(hexter_instance_t *instance, unsigned long bank,
 {
     /* no support for banks, so we just ignore the bank number */
     if (program >= 128) return;
+    if (instance->stats_enabled)
+        instance->stats.program_changes++;
     instance->current_program = program;
     if (instance->overlay_program == program) { /* edit buffer applies */
         memcpy(instance->current_patch_buffer, instance->overlay_patch_buffer, DX7_VOICE_SIZE_UNPACKED);
@@ -1030,6 +1035,52 @@ hexter_instance_handle_polyphony(hexter_instance_t *instance, const char *value)
     return NULL; /* success */
 }
 
+/*
+ * hexter_instance_render_voices_stats
+ *
+ * dx7pytorch: same as hexter_instance_render_voices(), timing the voice loop
+ * and the control updates separately into instance->stats.
+ */
+static void
+hexter_instance_render_voices_stats(hexter_instance_t *instance, unsigned long samples_done,
+                                    unsigned long sample_count, int do_control_update)
+{
+    hexter_stats_t *stats = &instance->stats;
+    unsigned long i;
+    dx7_voice_t* voice;
+    double start, rendered, end;
+
+    start = hexter_stats_clock();
+    dx7_lfo_update(instance, sample_count);
+    stats->control_seconds += hexter_stats_clock() - start;
+    stats->samples_rendered += sample_count;
+    if (do_control_update)
+        stats->nuggets++;
+
+    for (i = 0; i < instance->max_voices; i++) {
+        voice = instance->voice[i];
+
+        if (_PLAYING(voice)) {
+            start = hexter_stats_clock();
+            if (voice->mods_serial != instance->mods_serial) {
+                dx7_voice_update_mod_depths(instance, voice);
+                voice->mods_serial = instance->mods_serial;
+            }
+            rendered = hexter_stats_clock();
+            dx7_voice_render(instance, voice,
+                             instance->output + samples_done,
+                             sample_count, 0);
+            end = hexter_stats_clock();
+            stats->algorithm_samples[voice->algorithm & 0x1f] += sample_count;
+            stats->algorithm_seconds[voice->algorithm & 0x1f] += end - rendered;
+            stats->render_seconds += end - rendered;
+            if (do_control_update)
+                dx7_voice_render_control(instance, voice);
+            stats->control_seconds += (rendered - start) + (hexter_stats_clock() - end);
+        }
+    }
+}
+
 /*
  * hexter_instance_render_voices
  */
@@ -1040,6 +1091,12 @@ hexter_instance_render_voices(hexter_instance_t *instance, unsigned long samples
     unsigned long i;
     dx7_voice_t* voice;
 
+    if (instance->stats_enabled) {
+        hexter_instance_render_voices_stats(instance, samples_done, sample_count,
+                                            do_control_update);
+        return;
+    }
+
     /* update the LFO */
     dx7_lfo_update(instance, sample_count);
 
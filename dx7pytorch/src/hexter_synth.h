@@ -31,6 +31,9 @@
 //#include <ladspa.h>
 //#include <dssi.h>
 
+#include <stdint.h>
+#include <time.h>
+
 #include "hexter_types.h"
 #include "hexter.h"
 
@@ -39,6 +42,36 @@
 #define DSSP_MONO_MODE_ONCE 2
 #define DSSP_MONO_MODE_BOTH 3
 
+/*
+ * hexter_stats_t
+ *
+ * dx7pytorch: render counters of one instance. They are only updated while
+ * stats_enabled is set, so a disabled instance pays a single branch per burst.
+ * Mirrored by HexterStats in dx7pytorch/dxsynth/dxsynth.py.
+ */
+#define HEXTER_STATS_ALGORITHMS 32
+
+typedef struct {
+    uint64_t  notes;                 /* note ons */
+    uint64_t  program_changes;       /* patches loaded, by program change or batch render (not from decoded patches) */
+    uint64_t  resets;                /* hexter_activate() calls */
+    uint64_t  nuggets;               /* control updates */
+    uint64_t  samples_rendered;      /* samples rendered by the voice loop */
+    uint64_t  samples_skipped;       /* samples left silent because every voice was dead */
+    double    render_seconds;        /* time in the per-sample voice loop */
+    double    control_seconds;       /* time in LFO, mod depth and per-nugget control updates */
+    uint64_t  algorithm_samples[HEXTER_STATS_ALGORITHMS];
+    double    algorithm_seconds[HEXTER_STATS_ALGORITHMS];
+} hexter_stats_t;
+
+static inline double
+hexter_stats_clock(void)
+{
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (double)now.tv_sec + 1e-9 * (double)now.tv_nsec;
+}
+
 /*
  * hexter_instance_t
  */
@@ -53,6 +86,7 @@ struct _hexter_instance_t
     LADSPA_Data    *volume;
 
     float           sample_rate;
+    const dx7_rate_tables_t *rate_tables;  /* shared constants for this sample rate */
     float           nugget_rate;       /* nuggets per second */
     unsigned long   nugget_remains;
     int32_t         ramp_duration;     /* frames per ramp for mods and volume */
@@ -64,6 +98,7 @@ struct _hexter_instance_t
     int             monophonic;        /* true if operating in monophonic mode */
     int             max_voices;        /* current max polyphony, either requested polyphony above or 1 while in monophonic mode */
     int             current_voices;    /* count of currently playing voices */
+    int             stop_when_silent;  /* dx7pytorch: stop rendering once no voice is playing */
     dx7_voice_t    *mono_voice;
     unsigned char   last_key;          /* portamento starting key */
     signed char     held_keys[8];      /* for monophonic key tracking, an array of note-ons, most recently received first */
@@ -81,6 +116,7 @@ struct _hexter_instance_t
 
     int             current_program;
     uint8_t         current_patch_buffer[DX7_VOICE_SIZE_UNPACKED];  /* current unpacked patch in use */
+    const dx7_voice_patch_t *decoded_patch;  /* dx7pytorch: if set, the next note starts from it instead */
 
     int             overlay_program;   /* program to which 'configure edit_buffer' patch applies, or -1 */
     uint8_t         overlay_patch_buffer[DX7_VOICE_SIZE_UNPACKED];  /* 'configure edit_buffer' patch */
@@ -132,6 +168,10 @@ struct _hexter_instance_t
     int32_t         lfo_duration0;
     int32_t         lfo_duration1;
     dx7_sample_t    lfo_buffer[HEXTER_NUGGET_SIZE];
+    uint32_t        rand_state;               /* sample/hold LFO generator state */
+
+    int             stats_enabled;            /* dx7pytorch: update stats while set */
+    hexter_stats_t  stats;
 #ifdef HEXTER_DEBUG_CONTROL
     dx7_sample_t    feedback_mod;
 #endif
@@ -47,6 +47,8 @@ typedef struct _dx7_op_eg_t       dx7_op_eg_t;
 typedef struct _dx7_pitch_eg_t    dx7_pitch_eg_t;
 typedef struct _dx7_portamento_t  dx7_portamento_t;
 typedef struct _dx7_op_t          dx7_op_t;
+typedef struct _dx7_rate_tables_t  dx7_rate_tables_t;
+typedef struct _dx7_voice_patch_t  dx7_voice_patch_t;
 
 #ifndef HEXTER_USE_FLOATING_POINT
 #warning Note: using fixed point
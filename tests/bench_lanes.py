@@ -0,0 +1,37 @@
+'''
+Throughput of the multi-voice kernel (DXSynth lanes) against the scalar one.
+Renders the same notes with every lane count and checks that the audio is identical.
+
+Run from the repository root: python tests/bench_lanes.py
+'''
+
+import os
+import time
+
+import numpy as np
+from dx7pytorch.dxsynth import DXSynth, DX7_VOICE_SIZE_PACKED
+
+COLLECTION = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '../dataset/collection.bin')
+SAMPLE_RATE = 16000
+NPATCHES = 2000
+NOTE_ON, NOTE_OFF = 8000, 8000
+REPEATS = 3
+
+patches = np.fromfile(COLLECTION, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED))[0:NPATCHES]
+notes = np.random.RandomState(0).randint(24, 100, size=patches.shape[0])
+velocities = np.random.RandomState(1).randint(1, 128, size=patches.shape[0])
+
+reference = None
+for lanes in (1, 2, 4, 8):
+    synth = DXSynth(SAMPLE_RATE, lanes=lanes)
+    best = np.inf
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        audio = synth.render_batch(patches, notes, velocities, NOTE_ON, NOTE_OFF)
+        best = min(best, time.perf_counter() - start)
+    if reference is None:
+        reference = audio
+    assert np.array_equal(audio, reference), "lanes={} does not match the scalar kernel".format(lanes)
+    print("lanes={}: {:.3f}s, {:.1f} clips/s, {:.2f} Msamples/s".format(
+        lanes, best, patches.shape[0] / best, audio.size / best / 1e6))
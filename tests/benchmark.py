@@ -0,0 +1,199 @@
+'''
+dx7pytorch benchmark suite. Every measurement uses fixed seeds, so runs are comparable.
+
+Reports:
+    startup     import and first DXSynth() times of a fresh interpreter.
+    synth       samples/s and clips/s of DXSynth.synthesize across batch sizes, clip lengths
+                and algorithms.
+    init        DXDataset.__init__ time against collection size.
+    dataloader  end-to-end DataLoader throughput against num_workers.
+
+Run from the repository root:
+    python tests/benchmark.py                       # everything
+    python tests/benchmark.py synth --quick         # a shorter run of one section
+    python tests/benchmark.py --json results.json   # also save the numbers, e.g. to diff two runs
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.utils.data as data
+
+import dx7pytorch
+from dx7pytorch.dxdataset import DXDataset, dx_collate
+from dx7pytorch.dxsynth import DXSynth, DX7_VOICE_SIZE_PACKED
+
+COLLECTION = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '../dataset/collection.bin')
+SAMPLE_RATE = 16000
+SEED = 1234
+
+
+def load_patches():
+    return np.fromfile(COLLECTION, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED))
+
+
+def best_time(function, repeats):
+    # Best of several runs: the least disturbed by the rest of the machine.
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def quiet():
+    # DXDataset reports what it loads on stdout.
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+# Run in a fresh interpreter by bench_startup. Prints its timings as JSON.
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import dx7pytorch.dxsynth
+imported = time.perf_counter()
+torch_free = 'torch' not in sys.modules
+synth = dx7pytorch.dxsynth.DXSynth({sample_rate})
+first = time.perf_counter()
+dx7pytorch.dxsynth.DXSynth({sample_rate})
+second = time.perf_counter()
+from dx7pytorch.dxdataset import DXDataset
+dataset = time.perf_counter()
+print(json.dumps({{'import_dxsynth': imported - start, 'first_synth': first - imported,
+                  'next_synth': second - first, 'import_dxdataset': dataset - second,
+                  'dxsynth_torch_free': torch_free}}))
+"""
+
+
+def bench_startup(quick):
+    print("startup: fresh interpreter, best of {} runs".format(3 if quick else 10))
+    env = dict(os.environ)
+    # The child must import the same dx7pytorch as this process.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(dx7pytorch.__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([root] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+    runs = []
+    for _ in range(3 if quick else 10):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT.format(sample_rate=SAMPLE_RATE)], env=env,
+                                check=True, capture_output=True, text=True).stdout
+        run = json.loads(output.strip().splitlines()[-1])
+        run['process'] = time.perf_counter() - start
+        runs.append(run)
+    result = {key: min(run[key] for run in runs) for key in runs[0] if key != 'dxsynth_torch_free'}
+    result['dxsynth_torch_free'] = all(run['dxsynth_torch_free'] for run in runs)
+    for key in ('import_dxsynth', 'first_synth', 'next_synth', 'import_dxdataset', 'process'):
+        print("  {:<20} {:>8.1f} ms".format(key, result[key] * 1000))
+    print("  {:<20} {:>8}".format('dxsynth_torch_free', str(result['dxsynth_torch_free'])))
+    return result
+
+
+def bench_synth(quick):
+    patches = load_patches()
+    rng = np.random.RandomState(SEED)
+    synth = DXSynth(SAMPLE_RATE)
+    repeats = 1 if quick else 3
+    results = []
+
+    def run(label, batch, nsamples):
+        notes = rng.randint(36, 84, size=batch.shape[0])
+        velocities = rng.randint(40, 128, size=batch.shape[0])
+        seconds = best_time(lambda: synth.synthesize(batch, notes, velocities, nsamples // 2, nsamples // 2),
+                            repeats)
+        result = dict(label, seconds=seconds, clips_per_s=batch.shape[0] / seconds,
+                      samples_per_s=batch.shape[0] * nsamples / seconds)
+        results.append(result)
+        print("  {:<32} {:>10.1f} clips/s {:>8.2f} Msamples/s".format(
+            ' '.join('{}={}'.format(k, v) for k, v in label.items()),
+            result['clips_per_s'], result['samples_per_s'] / 1e6))
+
+    print("synth: DXSynth.synthesize at {} Hz".format(SAMPLE_RATE))
+    nsamples = SAMPLE_RATE
+    for batch_size in ((1, 16, 128) if quick else (1, 16, 128, 1024)):
+        batch = patches[rng.choice(patches.shape[0], size=batch_size, replace=False)]
+        run({'batch': batch_size, 'samples': nsamples}, batch, nsamples)
+
+    batch = patches[rng.choice(patches.shape[0], size=128, replace=False)]
+    for nsamples in ((4000, 32000) if quick else (1000, 4000, 16000, 64000)):
+        run({'batch': 128, 'samples': nsamples}, batch, nsamples)
+
+    algorithms = patches[:, 110] & 0x1f
+    for algorithm in ((0, 15, 31) if quick else range(32)):
+        candidates = np.flatnonzero(algorithms == algorithm)
+        batch = patches[rng.choice(candidates, size=64, replace=candidates.size < 64)]
+        run({'batch': 64, 'samples': 4000, 'algorithm': algorithm + 1}, batch, 4000)
+    return results
+
+
+def bench_init(quick):
+    patches = load_patches()
+    results = []
+    print("init: DXDataset.__init__ against collection size")
+    sizes = (1000, patches.shape[0]) if quick else (1000, 10000, patches.shape[0], 4 * patches.shape[0])
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            collection = os.path.join(directory, 'collection_{}.bin'.format(size))
+            np.resize(patches, (size, DX7_VOICE_SIZE_PACKED)).tofile(collection)
+
+            def init():
+                with quiet():
+                    DXDataset(SAMPLE_RATE, collection, (60,), (100,), 1000, 1000, random_seed=SEED,
+                              filter_function='all_ratio')
+
+            seconds = best_time(init, 1 if quick else 3)
+            results.append({'patches': size, 'seconds': seconds})
+            print("  patches={:<8} {:>8.3f} s".format(size, seconds))
+    return results
+
+
+def bench_dataloader(quick):
+    results = []
+    print("dataloader: DataLoader(batch_size=32, collate_fn=dx_collate) over 1 s notes")
+    with quiet():
+        dataset = DXDataset(SAMPLE_RATE, COLLECTION, (48, 60, 72), (100,), SAMPLE_RATE // 2, SAMPLE_RATE // 2,
+                            subsample_ratio=0.1, random_seed=SEED, filter_function='all_ratio')
+    nbatches = 10 if quick else 50
+    for num_workers in ((0, 2) if quick else (0, 1, 2, 4)):
+        loader = data.DataLoader(dataset, batch_size=32, shuffle=True, num_workers=num_workers,
+                                 collate_fn=dx_collate, generator=torch.Generator().manual_seed(SEED))
+        iterator = iter(loader)
+        next(iterator)  # Leave worker start-up out of the measurement.
+        start = time.perf_counter()
+        for _ in range(nbatches):
+            next(iterator)
+        seconds = time.perf_counter() - start
+        del iterator
+        results.append({'num_workers': num_workers, 'seconds': seconds,
+                        'items_per_s': nbatches * 32 / seconds})
+        print("  num_workers={:<3} {:>10.1f} items/s".format(num_workers, nbatches * 32 / seconds))
+    return results
+
+
+BENCHMARKS = {'startup': bench_startup, 'synth': bench_synth, 'init': bench_init, 'dataloader': bench_dataloader}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sections', nargs='*', help='Sections to run: {} (default: all).'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--quick', action='store_true', help='Fewer configurations and repeats.')
+    parser.add_argument('--json', help='Also write the results to this JSON file.')
+    args = parser.parse_args()
+    for name in args.sections:
+        if name not in BENCHMARKS:
+            parser.error("unknown section '{}'".format(name))
+
+    results = {}
+    for name in args.sections or BENCHMARKS:
+        results[name] = BENCHMARKS[name](args.quick)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,312 @@
+'''
+DXDataset tests. Run with pytest from the repository root.
+'''
+
+import os
+
+import numpy as np
+import pytest
+import torch
+from itertools import islice
+
+from dx7pytorch.dxdataset import (DXDataset, DXFeatureStore, DXStream, PatchIndex, dx_collate, dx_worker_init,
+                                  export_features)
+from dx7pytorch.dxsynth import DX7_VOICE_SIZE_PACKED, DXSynth, pack_patches, unpack_patches
+from dx7pytorch.dxsynth.dxsynth import DX7_VOICE_MAXES
+from dx7pytorch.dxsynth.renderstats import STATS_VECTOR_SIZE
+
+COLLECTION = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '../dataset/collection.bin')
+
+
+def select_reference(filter_bit, subsample_ratio, random_seed):
+    # Patch by patch selection, as DXDataset loaded collections before vectorizing it.
+    np.random.seed(random_seed)
+    patches = np.fromfile(COLLECTION, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED))
+    selected = []
+    for patch in patches:
+        osc_mode = [patch[15 + 17 * op] & 0x01 for op in range(6)]
+        if filter_bit is None or all(mode == filter_bit for mode in osc_mode):
+            if subsample_ratio is None or np.random.rand() < subsample_ratio:
+                selected.append(patch)
+    return np.array(selected, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED))
+
+
+def test_collection_loading_matches_reference():
+    for filter_function, filter_bit in (('all_ratio', 0), ('all_fixed', 1), (None, None)):
+        dataset = DXDataset(16000, COLLECTION, (60,), (100,), 64, 64,
+                            subsample_ratio=0.1, random_seed=1234,
+                            filter_function=filter_function)
+        expected = select_reference(filter_bit, 0.1, 1234)
+        np.testing.assert_array_equal(dataset.patches, expected)
+
+
+def test_getitem():
+    dataset = DXDataset(16000, COLLECTION, (48, 50), (100, 127), 256, 128,
+                        subsample_ratio=0.01, random_seed=1)
+    item = dataset[len(dataset) - 1]
+
+    assert item['audio'].shape == (1, 384)
+    assert item['patch'].shape == (145,)
+    assert item['name'].shape == (10,)
+    assert item['note'] == 50 and item['velocity'] == 127
+    np.testing.assert_array_equal(item['patch'], dataset.unpack_packed_patch(dataset.patches[-1])[0:145])
+    assert 'length' not in item
+
+    dataset = DXDataset(16000, COLLECTION, (48, 50), (100, 127), 256, 4000,
+                        subsample_ratio=0.01, random_seed=1, return_length=True)
+    lengths = [dataset[idx]['length'] for idx in range(len(dataset))]
+    assert 0 < min(lengths) and max(lengths) <= 4256 and min(lengths) < 4256
+    batch = dx_collate(dataset.__getitems__(list(range(len(dataset)))))
+    np.testing.assert_array_equal(batch['length'].numpy(), lengths)
+
+
+def test_audio_cache(tmp_path):
+    settings = dict(subsample_ratio=0.005, random_seed=3)
+    dataset = DXDataset(16000, COLLECTION, (40, 64), (90,), 320, 192, **settings)
+    cached = DXDataset(16000, COLLECTION, (40, 64), (90,), 320, 192, cache_dir=tmp_path, **settings)
+    cached16 = DXDataset(16000, COLLECTION, (40, 64), (90,), 320, 192, cache_dir=tmp_path,
+                         cache_dtype='int16', **settings)
+
+    assert len(list(tmp_path.iterdir())) == 2
+    for idx in range(len(dataset)):
+        expected = dataset[idx]['audio']
+        np.testing.assert_array_equal(cached[idx]['audio'], expected)
+        np.testing.assert_allclose(cached16[idx]['audio'], expected, atol=1.0 / 32767)
+
+    # Same settings reuse the cache, a different note_off_len gets its own.
+    DXDataset(16000, COLLECTION, (40, 64), (90,), 320, 192, cache_dir=tmp_path, **settings)
+    assert len(list(tmp_path.iterdir())) == 2
+    DXDataset(16000, COLLECTION, (40, 64), (90,), 320, 64, cache_dir=tmp_path, **settings)
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+def test_getitems_matches_per_item_batches():
+    dataset = DXDataset(16000, COLLECTION, (48, 50), (100, 127), 256, 128,
+                        subsample_ratio=0.01, random_seed=1)
+    indices = [5, 0, len(dataset) - 1, 17, 5]
+    expected = torch.utils.data.default_collate([dataset[idx] for idx in indices])
+
+    batch = dx_collate(dataset.__getitems__(indices))
+    for key in expected:
+        assert batch[key].dtype == expected[key].dtype and batch[key].shape == expected[key].shape, key
+        assert torch.equal(batch[key], expected[key]), key
+
+    # Through a DataLoader, with and without the batch-aware collate.
+    subset = torch.utils.data.Subset(dataset, indices)
+    for collate_fn in (None, dx_collate):
+        loader = torch.utils.data.DataLoader(subset, batch_size=len(indices), collate_fn=collate_fn)
+        batch = next(iter(loader))
+        assert torch.equal(batch['audio'], expected['audio'])
+
+
+def test_stream_is_deterministic_and_sharded():
+    streams = [DXStream(16000, COLLECTION, (48, 60), (100,), 256, 64, filter_function='all_fixed',
+                        chunk_size=8, rank=rank, world_size=2) for rank in (0, 1)]
+    items = list(islice(iter(streams[0]), 20))
+
+    # Every epoch draws other notes, and the same ones when it is repeated.
+    def notes(stream):
+        return [(item['note'], item['patch'].tobytes()) for item in islice(iter(stream), 20)]
+
+    assert notes(streams[0]) != [(item['note'], item['patch'].tobytes()) for item in items]
+    streams[0].set_epoch(1)
+    epoch = notes(streams[0])
+    streams[0].set_epoch(0)
+    again = list(islice(iter(streams[0]), 20))
+    for item, other in zip(items, again):
+        np.testing.assert_array_equal(item['audio'], other['audio'])
+    assert notes(streams[0]) != epoch
+    streams[0].set_epoch(1)
+    assert notes(streams[0]) == epoch
+
+    # So do the DataLoader workers, which get a copy of the stream every epoch.
+    loader = torch.utils.data.DataLoader(streams[1], batch_size=10, num_workers=2)
+    epochs = []
+    for epoch in (0, 1, 0):
+        streams[1].set_epoch(epoch)
+        batch = next(iter(loader))
+        epochs.append((batch['note'].tolist(), batch['patch'].numpy().tobytes()))
+    assert epochs[0] == epochs[2] != epochs[1]
+
+    # Rank 0 only draws from its half of the collection.
+    shard = unpack_patches(streams[0].patches[0::2])[:, 0:155]
+    other_shard = unpack_patches(streams[1].patches[1::2])[:, 0:155]
+    other_shard = other_shard[~np.any(np.all(other_shard[:, np.newaxis] == shard, axis=2), axis=1)]
+    for item in items:
+        parameters = np.concatenate([item['patch'], item['name']])
+        assert np.any(np.all(shard == parameters, axis=1))
+        assert not np.any(np.all(other_shard == parameters, axis=1))
+
+    # Audio is the render of the patch, note and velocity that come with it.
+    parameters = np.stack([np.concatenate([item['patch'], item['name']]) for item in items])
+    expected = DXSynth(16000).render_batch(pack_patches(parameters), [item['note'] for item in items],
+                                           100, 256, 64)
+    np.testing.assert_array_equal(np.concatenate([item['audio'] for item in items]), expected)
+
+
+def test_stream_perturbation():
+    stream = DXStream(16000, COLLECTION, (60,), (100,), 128, 64, perturbation=0.05, chunk_size=4)
+    items = list(islice(iter(stream), 12))
+    parameters = np.stack([np.concatenate([item['patch'], item['name']]) for item in items])
+
+    # Perturbed vectors stay valid and are what gets rendered.
+    np.testing.assert_array_equal(unpack_patches(pack_patches(parameters))[:, 0:155], parameters)
+    expected = DXSynth(16000).render_batch(pack_patches(parameters), 60, 100, 128, 64)
+    np.testing.assert_array_equal(np.concatenate([item['audio'] for item in items]), expected)
+
+
+def test_profile_dataloader_workers():
+    dataset = DXDataset(16000, COLLECTION, (48, 50), (100,), 256, 128,
+                        subsample_ratio=0.01, random_seed=1, profile=True)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=16, num_workers=2, collate_fn=dx_collate,
+                                         multiprocessing_context='fork')
+    with dataset.profile() as stats:
+        nitems = sum(batch['audio'].shape[0] for batch in loader)
+
+    assert nitems == len(dataset)
+    assert set(stats['workers']) == {0, 1}
+    assert stats['total']['notes'] == len(dataset)
+    assert sum(worker['notes'] for worker in stats['workers'].values()) == len(dataset)
+    assert stats['total']['samples_rendered'] + stats['total']['samples_skipped'] == len(dataset) * 384
+
+    # Workers are created again every epoch, counting from zero: they add to the same slots.
+    with dataset.profile() as stats:
+        for _ in range(2):
+            assert sum(batch['audio'].shape[0] for batch in loader) == len(dataset)
+    assert stats['total']['notes'] == 2 * len(dataset)
+    assert dataset.stats()['total']['notes'] == 3 * len(dataset)
+
+    # Rendering in the main process shows up on its own.
+    dataset[0]
+    assert dataset.stats()['workers']['main']['notes'] == 1
+
+    # Processes beyond the table are dropped with a warning, not an error.
+    with pytest.warns(RuntimeWarning):
+        assert not dataset.shared_stats.add(dataset.shared_stats.nslots, np.ones(STATS_VECTOR_SIZE))
+
+
+def test_spawned_workers_share_patches():
+    dataset = DXDataset(16000, COLLECTION, (48, 50), (100,), 256, 128,
+                        subsample_ratio=0.01, random_seed=1)
+    expected = dx_collate(dataset.__getitems__(list(range(len(dataset)))))['audio']
+    # Workers render with their own synthesizer and map the patch bank of the parent.
+    dataset = DXDataset(16000, COLLECTION, (48, 50), (100,), 256, 128,
+                        subsample_ratio=0.01, random_seed=1)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=16, num_workers=2, collate_fn=dx_collate,
+                                         worker_init_fn=dx_worker_init, multiprocessing_context='spawn')
+    audio = torch.cat([batch['audio'] for batch in loader])
+
+    assert dataset._synth is None
+    np.testing.assert_array_equal(audio.numpy(), expected.numpy())
+    assert not dataset.patches.flags.writeable
+
+
+def test_feature_store_round_trip(tmp_path):
+    dataset = DXDataset(16000, COLLECTION, (48, 50), (100,), 256, 128,
+                        subsample_ratio=0.01, random_seed=1, return_length=True)
+    expected = dx_collate(dataset.__getitems__(list(range(len(dataset)))))
+    order = np.random.RandomState(0).permutation(len(dataset))
+
+    for feature, compress in (('float32', None), ('int16', 6)):
+        directory = str(tmp_path / feature)
+        export_features(dataset, directory, feature=feature, compress=compress, shard_size=100, batch_size=64)
+        store = DXFeatureStore(directory)
+        assert len(store) == len(dataset)
+        batch = dx_collate(store.__getitems__(order))
+        tolerance = 0.0 if feature == 'float32' else 0.5 / 32767.0 + 1e-7
+        np.testing.assert_allclose(batch['audio'].numpy(), expected['audio'].numpy()[order], rtol=0, atol=tolerance)
+        for key in ('patch', 'name', 'note', 'velocity', 'length'):
+            np.testing.assert_array_equal(batch[key].numpy(), expected[key].numpy()[order])
+        item = store[order[0]]
+        np.testing.assert_array_equal(item['audio'], batch['audio'][0].numpy())
+
+    export_features(dataset, str(tmp_path / 'logmel'), feature='logmel', n_fft=256, hop_length=64, n_mels=40)
+    store = DXFeatureStore(str(tmp_path / 'logmel'))
+    assert store[0]['logmel'].shape == (40, 384 // 64 + 1)
+
+
+def test_output_buffer_ring():
+    dataset = DXDataset(16000, COLLECTION, (48, 50), (100,), 256, 128,
+                        subsample_ratio=0.01, random_seed=1, output_buffers=2)
+    batches = [dx_collate(dataset.__getitems__(list(range(start, start + 16)))) for start in (0, 16, 32)]
+    pointers = [batch['audio'].data_ptr() for batch in batches]
+    assert pointers[0] == pointers[2] and pointers[0] != pointers[1]
+
+    expected = DXDataset(16000, COLLECTION, (48, 50), (100,), 256, 128,
+                         subsample_ratio=0.01, random_seed=1).__getitems__(list(range(32, 48))).batch['audio']
+    np.testing.assert_array_equal(batches[2]['audio'].numpy(), expected.numpy())
+    # A smaller last batch reuses the front of its buffer.
+    assert dx_collate(dataset.__getitems__([0, 1, 2]))['audio'].shape == (3, 1, 384)
+
+
+def test_workers_do_not_pin_memory(monkeypatch):
+    class WorkerInfo:
+        id = 0
+
+    monkeypatch.setattr(torch.utils.data, 'get_worker_info', lambda: WorkerInfo())
+    dataset = DXDataset(16000, COLLECTION, (48, 50), (100,), 256, 128, subsample_ratio=0.01, random_seed=1)
+    # As if CUDA were available: workers must still leave pinning to the DataLoader.
+    dataset.pin_memory = True
+    audio = dataset.__getitems__(list(range(8))).batch['audio']
+    assert audio.shape == (8, 1, 384) and not audio.is_pinned()
+
+
+def test_workers_do_not_reuse_output_buffers(monkeypatch):
+    class WorkerInfo:
+        id = 0
+
+    monkeypatch.setattr(torch.utils.data, 'get_worker_info', lambda: WorkerInfo())
+    dataset = DXDataset(16000, COLLECTION, (48, 50), (100,), 256, 128,
+                        subsample_ratio=0.01, random_seed=1, output_buffers=2)
+    batches = [dataset.__getitems__(list(range(start, start + 16))).batch['audio'] for start in (0, 16, 32)]
+    assert len({batch.data_ptr() for batch in batches}) == 3
+    expected = dataset.__getitems__(list(range(0, 16))).batch['audio']
+    np.testing.assert_array_equal(batches[0].numpy(), expected.numpy())
+
+
+def test_predecoded_patches():
+    dataset = DXDataset(16000, COLLECTION, (48, 50), (100,), 256, 128,
+                        subsample_ratio=0.01, random_seed=1, predecode=True)
+    expected = DXDataset(16000, COLLECTION, (48, 50), (100,), 256, 128,
+                         subsample_ratio=0.01, random_seed=1)
+    assert expected.decoded is None
+    assert dataset.decoded.shape == (len(dataset.patches), 148) and not dataset.decoded.flags.writeable
+    indices = list(range(0, len(dataset), 3))
+    np.testing.assert_array_equal(dataset.__getitems__(indices).batch['audio'].numpy(),
+                                  expected.__getitems__(indices).batch['audio'].numpy())
+    np.testing.assert_array_equal(dataset[5]['audio'], expected[5]['audio'])
+
+
+def test_patch_index_and_dedup():
+    patches = np.fromfile(COLLECTION, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED))[0:2000]
+    parameters = unpack_patches(patches)[:, 0:145]
+    index = PatchIndex(patches, block_size=512)
+
+    queries = parameters[[3, 700, 1999]] + np.random.RandomState(0).normal(0, 1, (3, 145))
+    distances, indices = index.query(queries, k=4)
+    features = parameters / DX7_VOICE_MAXES[0:145].astype(np.float64)
+    exact = np.linalg.norm(features[np.newaxis] - (queries / DX7_VOICE_MAXES[0:145])[:, np.newaxis], axis=2)
+    np.testing.assert_allclose(distances, np.sort(exact, axis=1)[:, 0:4], rtol=1e-4)
+    np.testing.assert_allclose(np.take_along_axis(exact, indices, axis=1), distances, rtol=1e-4)
+
+    # Tolerance 0 keeps the first of every set of identical parameter vectors.
+    _, first = np.unique(parameters, axis=0, return_index=True)
+    np.testing.assert_array_equal(index.unique(0.0), np.sort(first))
+    kept = index.unique(0.3)
+    assert kept.size < first.size
+    assert all(np.linalg.norm(features[kept[i + 1:]] - features[kept[i]], axis=1).min() > 0.3
+               for i in range(kept.size - 1))
+
+    # Fewer than two patches have no pairs.
+    for n in (0, 1):
+        small = PatchIndex(patches[0:n])
+        assert [pair.shape for pair in small.neighbours(0.1)] == [(0,), (0,)]
+        np.testing.assert_array_equal(small.unique(0.1), np.arange(n))
+
+    dataset = DXDataset(16000, COLLECTION, (60,), (100,), 64, 64, dedup_tolerance=0.3)
+    full = PatchIndex.from_collection(COLLECTION)
+    collection = np.fromfile(COLLECTION, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED))
+    np.testing.assert_array_equal(dataset.patches, collection[full.unique(0.3)])
+    distances, indices = dataset.nearest(dataset.parameters[10], k=1)
+    assert indices[0, 0] == 10 and distances[0, 0] == 0.0
@@ -0,0 +1,473 @@
+'''
+DXSynth tests. Run with pytest from the repository root.
+'''
+
+import ctypes
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+import torch
+
+from dx7pytorch.dxsynth import (DXSynth, DX7_VOICE_SIZE_PACKED, EVENT_CONTROL_CHANGE, EVENT_NOTE_OFF, EVENT_NOTE_ON,
+                                EVENT_PITCH_BEND, RenderCache, decode_patches, note_lengths, pack_patches,
+                                timeline_events, unpack_patches)
+from dx7pytorch.dxsynth.dxsynth import DX7_VOICE_MAXES, load_library
+from dx7pytorch.dxsynth.rendercache import render_key
+
+COLLECTION = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '../dataset/collection.bin')
+
+
+def load_patches(n, offset=0):
+    patches = np.fromfile(COLLECTION, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED))
+    return patches[offset:offset + n]
+
+
+def render_stepwise(synth, patches, notes, velocities, nsamples_noteon, nsamples_noteoff):
+    # Reference path: one ctypes call per synthesis step, as done before render_batch.
+    nsamples = nsamples_noteon + nsamples_noteoff
+    x = np.zeros((patches.shape[0], nsamples), dtype=np.float32)
+    for i in range(patches.shape[0]):
+        synth.patch_buffer[0, :] = patches[i]
+        synth.reset_synth()
+        synth.program_change(0)
+        synth.note_on(notes[i], velocities[i])
+        synth.run_synth(x[i, :], 0, nsamples_noteon)
+        synth.note_off(notes[i], velocities[i])
+        synth.run_synth(x[i, :], nsamples_noteon, nsamples)
+    return x
+
+
+def test_render_batch_matches_stepwise():
+    patches = load_patches(24)
+    notes = np.arange(36, 60, dtype=np.uint8)
+    velocities = np.full(24, 100, dtype=np.uint8)
+
+    expected = render_stepwise(DXSynth(16000), patches, notes, velocities, 3000, 1000)
+    rendered = DXSynth(16000).render_batch(patches, notes, velocities, 3000, 1000)
+
+    np.testing.assert_array_equal(rendered, expected)
+
+
+def test_render_batch_into_preallocated_buffer():
+    patches = load_patches(200)
+    out = np.empty((200, 640), dtype=np.float32)
+    rendered = DXSynth(16000).render_batch(patches, 60, 127, 512, 128, out=out)
+
+    assert rendered is out
+    assert np.any(out != 0.0)
+
+
+def test_threaded_render_matches_single_thread():
+    patches = load_patches(64)
+    notes = np.random.RandomState(0).randint(30, 90, size=64)
+
+    expected = DXSynth(16000).render_batch(patches, notes, 110, 2048, 512)
+    rendered = DXSynth(16000, num_threads=4).render_batch(patches, notes, 110, 2048, 512)
+
+    np.testing.assert_array_equal(rendered, expected)
+
+
+def init_voice():
+    # Unpacked INIT VOICE: a single sine carrier (OP1) at ratio 1, no LFO or pitch EG.
+    op = [99, 99, 99, 99, 99, 99, 99, 0, 39, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 7]
+    patch = []
+    for i in range(6):
+        patch += op[:16] + [99 if i == 5 else 0] + op[17:]
+    patch += [99, 99, 99, 99, 50, 50, 50, 50, 0, 0, 1, 35, 0, 0, 0, 1, 0, 3, 24]
+    return np.asarray(patch, dtype=np.uint8)
+
+
+def test_pitch_follows_sample_rate():
+    for sample_rate in (16000, 22050, 44100, 48000):
+        synth = DXSynth(sample_rate)
+        patch = synth.pack_patch(init_voice())
+        x = synth.render_batch(patch[np.newaxis, :], 69, 100, sample_rate, 0)[0]
+
+        spectrum = np.abs(np.fft.rfft(x * np.hanning(x.size)))
+        peak = np.argmax(spectrum)
+        # Refine the peak bin with parabolic interpolation.
+        a, b, c = np.log(spectrum[peak - 1:peak + 2])
+        peak = peak + 0.5 * (a - c) / (a - 2 * b + c)
+        frequency = peak * sample_rate / x.size
+
+        assert abs(frequency - 440.0) < 1.0, (sample_rate, frequency)
+
+
+def unpack_reference(p):
+    # Per-patch learnfm unpacker that DXDataset used before unpack_patches.
+    o = [0] * 156
+    for op in range(6):
+        o[op * 21:op * 21 + 11] = p[op * 17:op * 17 + 11]
+        o[op * 21 + 11] = p[op * 17 + 11] & 3
+        o[op * 21 + 12] = (p[op * 17 + 11] >> 2) & 3
+        o[op * 21 + 13] = p[op * 17 + 12] & 7
+        o[op * 21 + 20] = p[op * 17 + 12] >> 3
+        o[op * 21 + 14] = p[op * 17 + 13] & 3
+        o[op * 21 + 15] = p[op * 17 + 13] >> 2
+        o[op * 21 + 16] = p[op * 17 + 14]
+        o[op * 21 + 17] = p[op * 17 + 15] & 1
+        o[op * 21 + 18] = p[op * 17 + 15] >> 1
+        o[op * 21 + 19] = p[op * 17 + 16]
+    o[126:135] = p[102:111]
+    o[135] = p[111] & 7
+    o[136] = p[111] >> 3
+    o[137:141] = p[112:116]
+    o[141] = p[116] & 1
+    o[142] = (p[116] >> 1) & 7
+    o[143] = p[116] >> 4
+    o[144:155] = p[117:128]
+    o[155] = 0x3f
+    return [min(value, limit) for value, limit in zip(o, DX7_VOICE_MAXES)]
+
+
+def test_unpack_patches_matches_reference():
+    patches = load_patches(2000)
+    expected = np.array([unpack_reference(p) for p in patches], dtype=np.uint8)
+
+    unpacked = unpack_patches(patches)
+
+    assert unpacked.shape == (patches.shape[0], 156)
+    np.testing.assert_array_equal(unpacked, expected)
+    np.testing.assert_array_equal(unpack_patches(patches[7]), unpacked[7])
+
+
+def test_pack_patches_matches_native_packer():
+    unpacked = np.ascontiguousarray(unpack_patches(load_patches(2000))[:, 0:155])
+    lib = DXSynth(16000).lib
+    expected = np.zeros((unpacked.shape[0], DX7_VOICE_SIZE_PACKED), dtype=np.uint8)
+    for i in range(unpacked.shape[0]):
+        lib.dx7_patch_pack(unpacked[i].ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)),
+                           expected[i].ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)), 0)
+
+    np.testing.assert_array_equal(pack_patches(unpacked), expected)
+    np.testing.assert_array_equal(unpack_patches(pack_patches(unpacked))[:, 0:155], unpacked)
+
+
+def test_note_lengths():
+    patches = load_patches(200)
+    synth = DXSynth(16000)
+    for threshold in (0.0, 1e-3):
+        x, lengths = synth.render_batch(patches, 60, 100, 2000, 30000, return_length=True,
+                                        silence_threshold=threshold)
+        np.testing.assert_array_equal(lengths, note_lengths(x, threshold))
+        assert np.all(np.abs(x[np.arange(x.shape[1]) >= lengths[:, np.newaxis]]) <= threshold)
+        # Short releases die well before the end of the clip.
+        assert np.any(lengths < x.shape[1] // 2)
+
+        _, unpacked_lengths = synth.render_unpacked(unpack_patches(patches)[:, 0:155], 60, 100, 2000, 30000,
+                                                    return_length=True, silence_threshold=threshold)
+        np.testing.assert_array_equal(unpacked_lengths, lengths)
+
+
+def test_render_unpacked_matches_packed():
+    patches = load_patches(300)
+    notes = np.random.RandomState(1).randint(30, 90, size=300)
+    expected = DXSynth(16000).render_batch(patches, notes, 100, 768, 256)
+    parameters = unpack_patches(patches).astype(np.float32)
+
+    synth = DXSynth(16000, num_threads=3)
+    np.testing.assert_array_equal(synth.render_unpacked(parameters[:, 0:155], notes, 100, 768, 256), expected)
+    # Without a name, and with values that need rounding.
+    noisy = parameters[:, 0:145] + np.random.RandomState(2).uniform(-0.4, 0.4, size=(300, 145))
+    np.testing.assert_array_equal(synth.render_unpacked(noisy, notes, 100, 768, 256), expected)
+
+    # Out of range values are clamped like unpack_patches does.
+    wild = np.random.RandomState(3).uniform(-50, 300, size=(50, 145)).astype(np.float32)
+    clamped = np.clip(np.rint(wild), 0, DX7_VOICE_MAXES[0:145])
+    np.testing.assert_array_equal(synth.render_unpacked(wild, 60, 100, 512, 128),
+                                  synth.render_batch(pack_patches(clamped), 60, 100, 512, 128))
+
+
+def test_render_cache_hits_and_evicts():
+    patches = load_patches(8)
+    expected = DXSynth(16000).render_batch(patches, 60, 100, 1024, 256)
+
+    # Room for 4 notes of 1280 samples plus their keys.
+    cache = RenderCache(4 * (1280 * 4 + 154))
+    synth = DXSynth(16000, render_cache=cache)
+    np.testing.assert_array_equal(synth.render_batch(patches[0:4], 60, 100, 1024, 256), expected[0:4])
+    assert cache.stats()['misses'] == 4 and cache.stats()['entries'] == 4
+
+    np.testing.assert_array_equal(synth.render_batch(patches[0:4], 60, 100, 1024, 256), expected[0:4])
+    assert cache.stats()['hits'] == 4
+
+    # Touch patch 0, then overflow the budget: patch 1 is the least recently used.
+    synth.render_batch(patches[0:1], 60, 100, 1024, 256)
+    synth.render_batch(patches[4:5], 60, 100, 1024, 256)
+    stats = cache.stats()
+    assert stats['entries'] == 4 and stats['bytes'] <= cache.max_bytes
+    np.testing.assert_array_equal(synth.render_batch(patches, 60, 100, 1024, 256), expected)
+    assert cache.stats()['hits'] == 4 + 1 + 4
+
+
+def test_render_cache_shared_across_sample_rates():
+    patches = load_patches(4)
+    for shared in (False, True):
+        cache = RenderCache(1 << 20, shared=shared, nsamples=640)
+        for sample_rate in (16000, 8000, 16000):
+            expected = DXSynth(sample_rate).render_batch(patches, 60, 100, 512, 128)
+            rendered = DXSynth(sample_rate, render_cache=cache).render_batch(patches, 60, 100, 512, 128)
+            np.testing.assert_array_equal(rendered, expected)
+        assert cache.stats()['hits'] == 4 and cache.stats()['misses'] == 8
+
+
+def read_shared_cache(cache, key, queue):
+    queue.put(cache.get(key))
+
+
+def test_shared_render_cache_across_processes():
+    patches = load_patches(2)
+    cache = RenderCache(1 << 20, shared=True, nsamples=640)
+    expected = DXSynth(16000, render_cache=cache).render_batch(patches, 48, 90, 512, 128)
+
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    worker = ctx.Process(target=read_shared_cache,
+                         args=(cache, render_key(patches[1], 48, 90, 512, 128, 16000), queue))
+    worker.start()
+    np.testing.assert_array_equal(queue.get(timeout=30), expected[1])
+    worker.join()
+
+
+def test_lanes_match_scalar_kernel():
+    # Two notes per algorithm, plus leftovers that leave some lane groups partly filled.
+    patches = np.fromfile(COLLECTION, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED))
+    algorithms = patches[:, 110] & 0x1f
+    picked = np.concatenate([np.flatnonzero(algorithms == a)[0:2] for a in range(32)] + [np.arange(37)])
+    patches = patches[picked]
+    assert set(patches[:, 110] & 0x1f) == set(range(32))
+    notes = np.random.RandomState(4).randint(30, 90, size=picked.size)
+    velocities = np.random.RandomState(5).randint(1, 128, size=picked.size)
+
+    expected, expected_lengths = DXSynth(16000).render_batch(patches, notes, velocities, 1000, 3000,
+                                                             return_length=True)
+    for lanes, num_threads in ((8, 1), (3, 2)):
+        rendered, lengths = DXSynth(16000, num_threads=num_threads, lanes=lanes).render_batch(
+            patches, notes, velocities, 1000, 3000, return_length=True)
+        np.testing.assert_array_equal(rendered, expected)
+        np.testing.assert_array_equal(lengths, expected_lengths)
+
+
+def test_render_does_not_depend_on_previous_notes():
+    # Sample/hold LFO patches used to pick up the last hold value of the previous note.
+    patches = load_patches(2000)
+    patches = patches[((patches[:, 116] >> 1) & 7) == 5][0:10]
+    synth = DXSynth(16000)
+    batch = synth.render_batch(patches, 60, 100, 4000, 1000)
+    for i in range(patches.shape[0]):
+        np.testing.assert_array_equal(synth.render_batch(patches[i:i + 1], 60, 100, 4000, 1000)[0], batch[i])
+
+
+def test_render_decoded_matches_packed():
+    patches = load_patches(300, offset=1000)
+    decoded = decode_patches(patches)
+    notes = np.random.RandomState(6).randint(30, 90, size=300)
+    velocities = np.random.RandomState(7).randint(1, 128, size=300)
+    expected, expected_lengths = DXSynth(16000).render_batch(patches, notes, velocities, 1000, 2000,
+                                                             return_length=True)
+
+    for lanes, num_threads in ((1, 1), (8, 2)):
+        synth = DXSynth(16000, num_threads=num_threads, lanes=lanes, render_cache=RenderCache(1 << 20))
+        with synth.profile() as stats:
+            rendered, lengths = synth.render_batch(patches, notes, velocities, 1000, 2000,
+                                                   return_length=True, decoded=decoded)
+        np.testing.assert_array_equal(rendered, expected)
+        np.testing.assert_array_equal(lengths, expected_lengths)
+        assert stats['notes'] == 300 and stats['program_changes'] == 0
+
+    # Step by step renders after a decoded batch play the patch of their program change again.
+    synth = DXSynth(16000)
+    synth.render_batch(patches[0:5], 60, 100, 64, 64, decoded=decoded[0:5])
+    np.testing.assert_array_equal(render_stepwise(synth, patches[10:11], notes[10:11], velocities[10:11], 1000, 2000),
+                                  expected[10:11])
+    with pytest.raises(ValueError):
+        synth.render_batch(patches[0:5], 60, 100, 64, 64, decoded=decoded[0:4])
+
+
+def test_stream_matches_render_batch():
+    patches = load_patches(50, offset=300)
+    notes = np.random.RandomState(8).randint(30, 90, size=50)
+    velocities = np.random.RandomState(9).randint(1, 128, size=50)
+    synth = DXSynth(16000, num_threads=2)
+
+    for nsamples_noteon, nsamples_noteoff, block_size in ((1000, 3000, 64), (4000, 37, 512), (0, 2000, 1024)):
+        expected = synth.render_batch(patches, notes, velocities, nsamples_noteon, nsamples_noteoff)
+        blocks = list(synth.stream(patches, notes, velocities, nsamples_noteon, nsamples_noteoff, block_size))
+        assert all(block.shape == (50, block_size) for block in blocks[:-1])
+        np.testing.assert_array_equal(np.concatenate(blocks, axis=1), expected)
+
+        out = torch.empty((50, 1, block_size))
+        blocks = [block.numpy().copy() for block in synth.stream(patches, notes, velocities, nsamples_noteon,
+                                                                  nsamples_noteoff, block_size, out=out)]
+        np.testing.assert_array_equal(np.concatenate(blocks, axis=2)[:, 0], expected)
+
+    single = list(synth.stream(patches[7], 60, 100, 3000, 100, block_size=256, decoded=decode_patches(patches[7:8])))
+    np.testing.assert_array_equal(np.concatenate(single, axis=1), synth.render_batch(patches[7:8], 60, 100, 3000, 100))
+    with pytest.raises(ValueError):
+        synth.stream(patches, 60, 100, 1000, 1000, block_size=100)
+
+
+def test_stream_reuses_synth_instances():
+    # Many more notes than the synth has instances, in two streams advanced in turn.
+    patches = load_patches(300)
+    notes = np.random.RandomState(10).randint(30, 90, size=300)
+    synth = DXSynth(16000, num_threads=2)
+    instances = [ctypes.addressof(instance.contents) for instance in synth.instances]
+    expected = synth.render_batch(patches, notes, 100, 700, 600)
+
+    with synth.profile() as stats:
+        first = synth.stream(patches, notes, 100, 700, 600, block_size=256)
+        second = synth.stream(patches[::-1], notes[::-1], 100, 700, 600, block_size=512)
+        blocks = [next(first)]
+        rest = list(second)
+        blocks += list(first)
+    np.testing.assert_array_equal(np.concatenate(blocks, axis=1), expected)
+    np.testing.assert_array_equal(np.concatenate(rest, axis=1), expected[::-1])
+    assert stats['notes'] == 600
+    assert [ctypes.addressof(instance.contents) for instance in synth.instances] == instances
+
+    # The instances are left as they were: a note played step by step carries on.
+    played = []
+    for streamed in (False, True):
+        synth = DXSynth(16000)
+        synth.note_on(np.array(60), np.array(100))
+        output = np.zeros(1024, dtype=np.float32)
+        synth.run_synth(output[0:512], 0, 512)
+        if streamed:
+            list(synth.stream(patches[0:20], 60, 100, 300, 300, block_size=128))
+        synth.run_synth(output[512:], 0, 512)
+        played.append(output)
+    assert np.any(played[0] != 0)
+    np.testing.assert_array_equal(played[1], played[0])
+
+
+def test_render_timeline():
+    patches = load_patches(6, offset=60)
+    synth = DXSynth(16000)
+    single = synth.render_batch(patches, 60, 100, 1000, 2000)
+
+    # One note on, then off, is render_batch.
+    note = timeline_events([0, 1000], [EVENT_NOTE_ON, EVENT_NOTE_OFF], note=60, velocity=100)
+    np.testing.assert_array_equal(synth.render_timeline(patches, note, 3000, polyphony=1), single)
+
+    # A chord is the mix of its notes; with too few voices, later notes steal them.
+    chord = timeline_events([0, 0, 1000, 1000], [EVENT_NOTE_ON, EVENT_NOTE_ON, EVENT_NOTE_OFF, EVENT_NOTE_OFF],
+                            note=[60, 67, 60, 67], velocity=100)
+    mixed = synth.render_timeline(patches, chord, 3000, polyphony=2)
+    fifth = synth.render_batch(patches, 67, 100, 1000, 2000)
+    np.testing.assert_allclose(mixed, single + fifth, atol=1e-6)
+    np.testing.assert_array_equal(synth.render_timeline(patches, chord, 3000, polyphony=1), fifth)
+
+    # Notes later in the timeline start where their events are. Events past the end are ignored.
+    later = timeline_events([500, 1500, 5000], [EVENT_NOTE_ON, EVENT_NOTE_OFF, EVENT_NOTE_ON], note=60, velocity=100)
+    shifted = synth.render_timeline(patches[0], later, 3000)
+    assert not np.any(shifted[:, 0:500])
+    assert np.any(shifted[:, 500:] != 0)
+
+    # Pitch bend and mod wheel change the sound, and are reset for the next timeline and render.
+    bent = timeline_events([0, 0, 1000], [EVENT_PITCH_BEND, EVENT_NOTE_ON, EVENT_NOTE_OFF], note=60, velocity=100,
+                           value=[8191, 0, 0])
+    wheel = timeline_events([0, 0, 1000], [EVENT_CONTROL_CHANGE, EVENT_NOTE_ON, EVENT_NOTE_OFF], note=60,
+                            velocity=100, cc=1, value=[127, 0, 0])
+    assert np.all(np.any(synth.render_timeline(patches, bent, 3000) != single, axis=1))
+    assert np.any(synth.render_timeline(patches, wheel, 3000) != single)
+    timelines = synth.render_timeline(patches[0:3], [bent, note, wheel], 3000)
+    np.testing.assert_array_equal(timelines[1], single[1])
+    np.testing.assert_array_equal(synth.render_batch(patches, 60, 100, 1000, 2000), single)
+
+    # Threads render the same timelines.
+    threaded = DXSynth(16000, num_threads=3).render_timeline(patches, chord, 3000, polyphony=2)
+    np.testing.assert_array_equal(threaded, mixed)
+
+    with pytest.raises(ValueError):
+        synth.render_timeline(patches, chord, 3000, polyphony=17)
+    with pytest.raises(ValueError):
+        synth.render_timeline(patches, chord[::-1].copy(), 3000)
+    with pytest.raises(ValueError):
+        synth.render_timeline(patches, [note, note], 3000)
+
+
+def test_concurrent_instance_creation():
+    # Synths and streams at a rate no other test uses, created from several threads at once, must all
+    # share the same per-rate tables and render identically.
+    patches = load_patches(8, offset=40)
+    synths = [None] * 8
+    streams = [None] * 8
+
+    def create(k):
+        synths[k] = DXSynth(11025 * 3, num_threads=2)
+        streams[k] = np.concatenate(list(synths[k].stream(patches, 60, 100, 1000, 500, block_size=256)), axis=1)
+
+    threads = [threading.Thread(target=create, args=(k,)) for k in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    reference = DXSynth(11025 * 3).render_batch(patches, 60, 100, 1000, 500)
+    for synth, streamed in zip(synths, streams):
+        np.testing.assert_array_equal(synth.render_batch(patches, 60, 100, 1000, 500), reference)
+        np.testing.assert_array_equal(streamed, reference)
+
+
+def test_render_stats():
+    patches = load_patches(100)
+    expected = DXSynth(16000).render_batch(patches, 60, 100, 1000, 20000)
+
+    for lanes in (1, 8):
+        synth = DXSynth(16000, num_threads=2, lanes=lanes)
+        synth.render_batch(patches, 60, 100, 1000, 20000)
+        assert synth.stats()['samples_rendered'] == 0  # Disabled by default.
+
+        with synth.profile() as stats:
+            np.testing.assert_array_equal(synth.render_batch(patches, 60, 100, 1000, 20000), expected)
+        assert stats['notes'] == stats['program_changes'] == stats['resets'] == 100
+        assert stats['samples_rendered'] + stats['samples_skipped'] == 100 * 21000
+        assert stats['samples_skipped'] > 0
+        assert stats['algorithm_samples'].sum() == stats['samples_rendered']
+        algorithms = np.bincount(patches[:, 110] & 0x1f, minlength=32)
+        assert np.all((stats['algorithm_samples'] > 0) == (algorithms > 0))
+        assert stats['nuggets'] > 0 and stats['render_seconds'] > 0 and stats['control_seconds'] > 0
+        assert not synth.stats_enabled
+        if lanes == 1:
+            scalar = stats
+        else:
+            np.testing.assert_array_equal(stats['algorithm_samples'], scalar['algorithm_samples'])
+
+
+def test_render_into_tensors():
+    patches = load_patches(16)
+    synth = DXSynth(16000)
+    expected = synth.render_batch(patches, 60, 100, 256, 128)
+
+    for shape in ((16, 384), (16, 1, 384)):
+        out = torch.full(shape, np.nan)
+        assert synth.render_batch(patches, 60, 100, 256, 128, out=out) is out
+        np.testing.assert_array_equal(out.numpy().reshape((16, 384)), expected)
+    out = torch.empty((16, 384))
+    audio, lengths = synth.render_unpacked(unpack_patches(patches)[:, 0:155], 60, 100, 256, 128, out=out,
+                                           return_length=True)
+    assert audio is out
+
+    # Anything the native core cannot write to as it is fails before rendering.
+    bad = [torch.empty((16, 384), dtype=torch.float64), torch.empty((384, 16)).t(), torch.empty((15, 384)),
+           torch.empty((16, 384), requires_grad=True), np.empty((16, 384), dtype=np.float32)[:, ::-1],
+           np.broadcast_to(np.float32(0.0), (16, 384)), [[0.0] * 384] * 16]
+    for out in bad:
+        with pytest.raises(ValueError):
+            synth.render_batch(patches, 60, 100, 256, 128, out=out)
+
+
+def test_library_is_shared_and_import_is_torch_free():
+    assert DXSynth(16000).lib is DXSynth(8000, num_threads=2).lib is load_library()
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    code = "import sys, dx7pytorch.dxsynth, dx7pytorch.dxdataset.patchindex; print('torch' in sys.modules)"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == 'False'
@@ -0,0 +1,132 @@
+'''
+Patch packer tests. Run with pytest from the repository root.
+'''
+
+import os
+import sys
+
+import numpy as np
+
+from dx7pytorch.dxsynth import DX7_VOICE_SIZE_PACKED, pack_patches, unpack_patches
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../dataset'))
+from patchpacker import pack, parse_file, parse_message, sysex_checksum, sysex_messages  # noqa: E402
+
+COLLECTION = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '../dataset/collection.bin')
+
+
+def load_patches(n, offset=0):
+    patches = np.fromfile(COLLECTION, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED))
+    return patches[offset:offset + n].copy()
+
+
+def sysex(format_byte, data, channel=0):
+    data = np.asarray(data, dtype=np.uint8).ravel()
+    header = [0xF0, 0x43, channel, format_byte, data.size >> 7, data.size & 0x7F]
+    return np.concatenate([np.array(header, dtype=np.uint8), data,
+                           np.array([sysex_checksum(data), 0xF7], dtype=np.uint8)])
+
+
+def bulk_dump(patches, channel=0):
+    return sysex(0x09, patches, channel)
+
+
+def single_dump(patch):
+    # VCED dumps hold the 155 voice parameters, without the OP ON/OFF byte.
+    return sysex(0x00, unpack_patches(patch)[:155])
+
+
+def test_bulk_dump():
+    patches = load_patches(32)
+    message = bulk_dump(patches)
+    assert message.size == 4104
+    assert [m.size for m in sysex_messages(message)] == [4104]
+    np.testing.assert_array_equal(parse_message(message), patches)
+    # Any MIDI channel.
+    np.testing.assert_array_equal(parse_message(bulk_dump(patches, channel=5)), patches)
+
+
+def test_single_voice_dump():
+    patch = load_patches(1, offset=100)[0]
+    message = single_dump(patch)
+    assert message.size == 163
+    parsed = parse_message(message)
+    assert parsed.shape == (1, DX7_VOICE_SIZE_PACKED)
+    np.testing.assert_array_equal(parsed[0], pack_patches(unpack_patches(patch)))
+
+
+def test_concatenated_messages(tmp_path):
+    bulk = load_patches(32, offset=200)
+    single = load_patches(1, offset=300)[0]
+    # Other manufacturers' messages and bytes between messages are ignored.
+    other = np.array([0xF0, 0x41, 0x10, 0x42, 0x12, 0x00, 0xF7], dtype=np.uint8)
+    data = np.concatenate([bulk_dump(bulk), np.array([0x00, 0x01], dtype=np.uint8), other,
+                           single_dump(single), bulk_dump(bulk[::-1])])
+    assert len(sysex_messages(data)) == 4
+    path = tmp_path / 'several.syx'
+    data.tofile(path)
+    expected = np.concatenate([bulk, pack_patches(unpack_patches(single))[np.newaxis], bulk[::-1]])
+    np.testing.assert_array_equal(parse_file(str(path)), expected)
+
+
+def test_truncated_and_corrupt_dumps(tmp_path):
+    patches = load_patches(32, offset=400)
+    message = bulk_dump(patches)
+
+    # Cut short, with or without its F7.
+    assert parse_message(message[:-100]).shape == (0, DX7_VOICE_SIZE_PACKED)
+    assert sysex_messages(message[:-1]) == []
+    assert parse_message(np.concatenate([message[:2000], message[-1:]])).shape == (0, DX7_VOICE_SIZE_PACKED)
+    assert parse_message(message[:5]).shape == (0, DX7_VOICE_SIZE_PACKED)
+
+    # Bad checksum.
+    corrupt = message.copy()
+    corrupt[-2] = (corrupt[-2] + 1) & 0x7F
+    assert parse_message(corrupt).shape == (0, DX7_VOICE_SIZE_PACKED)
+    corrupt = message.copy()
+    corrupt[100] ^= 0x01
+    assert parse_message(corrupt).shape == (0, DX7_VOICE_SIZE_PACKED)
+    corrupt = single_dump(patches[0])
+    corrupt[-2] ^= 0x01
+    assert parse_message(corrupt).shape == (0, DX7_VOICE_SIZE_PACKED)
+
+    # A dump cut short by the start of the next one only loses itself.
+    path = tmp_path / 'truncated.syx'
+    np.concatenate([message[:3000], message]).tofile(path)
+    np.testing.assert_array_equal(parse_file(str(path)), patches)
+
+    path = tmp_path / 'empty.syx'
+    path.write_bytes(b'')
+    assert parse_file(str(path)).shape == (0, DX7_VOICE_SIZE_PACKED)
+
+
+def test_pack_and_append(tmp_path):
+    patches = load_patches(96, offset=500)
+    source = tmp_path / 'syx'
+    (source / 'sub').mkdir(parents=True)
+    bulk_dump(patches[:32]).tofile(source / 'a.syx')
+    # Repeats the first bank: only its 16 new patches count.
+    bulk_dump(np.concatenate([patches[16:32], patches[32:48]])).tofile(source / 'sub' / 'b.SYX')
+    (source / 'notes.txt').write_text('not a sysex file')
+    output = str(tmp_path / 'collection.bin')
+
+    def collection():
+        return np.fromfile(output, dtype=np.uint8).reshape((-1, DX7_VOICE_SIZE_PACKED))
+
+    assert pack([str(source)], output, jobs=1) == {'files': 2, 'found': 64, 'added': 48, 'patches': 48}
+    np.testing.assert_array_equal(collection(), patches[:48])
+
+    # Appending the same tree again adds nothing.
+    assert pack([str(source)], output, append=True, jobs=1) == {'files': 0, 'found': 0, 'added': 0, 'patches': 48}
+    np.testing.assert_array_equal(collection(), patches[:48])
+
+    # A new file only adds its unseen voices, even when it repeats voices already packed.
+    bulk_dump(np.concatenate([patches[:16], patches[48:64]])).tofile(source / 'c.syx')
+    assert pack([str(source)], output, append=True, jobs=1) == {'files': 1, 'found': 32, 'added': 16, 'patches': 64}
+    np.testing.assert_array_equal(collection(), patches[:64])
+    assert pack([str(source)], output, append=True, jobs=1)['added'] == 0
+
+    # Without --append the collection is rebuilt from scratch, visiting the files in sorted order.
+    assert pack([str(source)], output, jobs=1)['patches'] == 64
+    np.testing.assert_array_equal(collection(), np.concatenate([patches[:32], patches[48:64], patches[32:48]]))